@@ -0,0 +1,33 @@
+# coding:utf8
+"""Ping handler for the benchmarks, msg selects the work done per call:
+
+    "cpu:N"     pure python loop of N iterations
+    "io:S"      time.sleep(S), cooperative under the gevent worker
+    "cblock:S"  usleep in libc, blocks the whole process under gevent
+    anything else is echoed back
+"""
+import ctypes
+import ctypes.util
+import time
+
+from ping import Ping
+
+libc = ctypes.CDLL(ctypes.util.find_library("c"))
+
+
+class BenchHandler(object):
+
+    def send_ping(self, msg):
+        kind, _, arg = msg.partition(":")
+        if kind == "cpu":
+            n = 0
+            for i in range(int(arg)):
+                n += i
+        elif kind == "io":
+            time.sleep(float(arg))
+        elif kind == "cblock":
+            libc.usleep(int(float(arg) * 1000000))
+        return msg
+
+
+processor = Ping.Processor(BenchHandler())
@@ -0,0 +1,292 @@
+# coding:utf8
+"""drive gunicorn_thrift serving the Ping example and report JSON.
+
+starts the server with examples/thrift_config.py on localhost for each
+protocol and transport, then runs a closed-loop load for every mix of
+connections, pipelining depth and payload size. Connections are spread
+over client processes running gevent, each keeps pipeline calls in
+flight. Each run reports its throughput and latency percentiles, and
+with --baseline the change against an earlier report::
+
+    python benchmarks/loadgen.py --connections 1,64 --pipeline 1,8 \\
+        --payload 16,4096 --protocol accelerated,compact \\
+        --transport buffered,framed --output run.json
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "examples"))
+sys.path.insert(0, ROOT)
+
+from thrift.Thrift import TMessageType, TType
+from thrift.transport import TSocket, TTransport
+
+from ping.Ping import send_ping_args, send_ping_result
+from gunicorn_thrift import __version__
+from gunicorn_thrift.config import PROTOCOL_FACTORIES, load_factory
+from gunicorn_thrift.stats import LatencyHistogram
+
+CONFIG = os.path.join(ROOT, "examples", "thrift_config.py")
+# the slack for the client processes to start and connect
+START_DELAY = 0.5
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def name_list(value):
+    return [v.strip() for v in value.split(",")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--connections", type=int_list, default=[16])
+    parser.add_argument("--pipeline", type=int_list, default=[1],
+                        help="calls in flight per connection")
+    parser.add_argument("--payload", type=int_list, default=[16],
+                        help="bytes of the ping message")
+    parser.add_argument("--protocol", type=name_list,
+                        default=["accelerated"])
+    parser.add_argument("--transport", type=name_list, default=["buffered"])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--processes", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="client processes")
+    parser.add_argument("--workers", type=int, help="server workers")
+    parser.add_argument("--server-args", default="",
+                        help="more gunicorn_thrift arguments")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7750)
+    parser.add_argument("--no-server", action="store_true",
+                        help="drive a server started separately")
+    parser.add_argument("--output", help="JSON report file, default stdout")
+    parser.add_argument("--baseline", help="JSON report to compare with")
+    return parser.parse_args()
+
+
+def start_server(options, protocol, transport):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ROOT, os.path.join(ROOT, "examples")])
+    cmd = [sys.executable, "-c",
+           "from gunicorn_thrift.app.thriftapp import run; run()",
+           "-c", CONFIG, "--bind", "%s:%d" % (options.host, options.port),
+           "--access-logfile", os.devnull, "--error-logfile", "-",
+           "--log-level", "warning",
+           "--thrift-protocol-factory", protocol,
+           "--thrift-transport-factory", transport]
+    if options.workers:
+        cmd += ["--workers", str(options.workers)]
+    cmd += shlex.split(options.server_args) + ["ping_server:processor"]
+    proc = subprocess.Popen(cmd, env=env)
+    for _ in range(100):
+        try:
+            socket.create_connection((options.host, options.port)).close()
+            return proc
+        except socket.error:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def stop_server(proc):
+    proc.terminate()
+    proc.wait()
+
+
+class Connection(object):
+
+    """a client keeping depth calls in flight, matched by seqid."""
+
+    def __init__(self, conf, histogram):
+        sock = TSocket.TSocket(conf["host"], conf["port"])
+        # a frame holds one message, framed calls are flushed one by one
+        self.framed = conf["transport"] == "framed"
+        if self.framed:
+            self.trans = TTransport.TFramedTransport(sock)
+        else:
+            self.trans = TTransport.TBufferedTransport(sock)
+        pfactory = load_factory(conf["protocol"], PROTOCOL_FACTORIES)
+        self.prot = pfactory.getProtocol(self.trans)
+        self.args = send_ping_args(msg="p" * conf["payload"])
+        self.depth = conf["pipeline"]
+        self.histogram = histogram
+        self.sent = {}
+        self.seqid = 0
+        self.errors = 0
+
+    def send(self):
+        self.seqid += 1
+        self.prot.writeMessageBegin("send_ping", TMessageType.CALL,
+                                    self.seqid)
+        self.args.write(self.prot)
+        self.prot.writeMessageEnd()
+        if self.framed:
+            self.trans.flush()
+        self.sent[self.seqid] = time.time()
+
+    def receive(self):
+        (name, type, seqid) = self.prot.readMessageBegin()
+        if type == TMessageType.EXCEPTION:
+            self.prot.skip(TType.STRUCT)
+            self.errors += 1
+        else:
+            send_ping_result().read(self.prot)
+        self.prot.readMessageEnd()
+        return seqid, time.time()
+
+    def run(self, start, end):
+        self.trans.open()
+        try:
+            while True:
+                now = time.time()
+                if now < end:
+                    while len(self.sent) < self.depth:
+                        self.send()
+                    if not self.framed:
+                        self.trans.flush()
+                elif not self.sent:
+                    return
+                seqid, done = self.receive()
+                sent = self.sent.pop(seqid)
+                if start <= sent and done <= end:
+                    self.histogram.record((done - sent) * 1000000)
+        except Exception:
+            self.errors += 1
+        finally:
+            self.trans.close()
+
+
+def client_process(conf, connections, start, end, queue):
+    # sockets only, the queue to the parent needs real threads
+    from gevent import monkey
+    monkey.patch_socket()
+    import gevent
+
+    histogram = LatencyHistogram()
+    clients = [Connection(conf, histogram) for _ in range(connections)]
+    gevent.joinall([gevent.spawn(c.run, start, end) for c in clients])
+    queue.put((histogram.counts, histogram.count, histogram.total,
+               histogram.max, sum(c.errors for c in clients)))
+
+
+def run(conf, options):
+    processes = min(options.processes, conf["connections"])
+    shares = [conf["connections"] // processes +
+              (i < conf["connections"] % processes)
+              for i in range(processes)]
+    start = time.time() + START_DELAY + options.warmup
+    end = start + options.duration
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=client_process,
+                                     args=(conf, n, start, end, queue))
+             for n in shares]
+    [p.start() for p in procs]
+    histogram = LatencyHistogram()
+    errors = 0
+    for _ in procs:
+        counts, count, total, max_value, proc_errors = queue.get()
+        histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+        histogram.count += count
+        histogram.total += total
+        histogram.max = max(histogram.max, max_value)
+        errors += proc_errors
+    [p.join() for p in procs]
+
+    result = dict(conf)
+    del result["host"], result["port"]
+    result.update({
+        "requests": histogram.count,
+        "errors": errors,
+        "throughput": histogram.count / options.duration,
+        "latency_ms": histogram.summary(),
+    })
+    return result
+
+
+def result_key(result):
+    return tuple(result[k] for k in ("protocol", "transport", "connections",
+                                     "pipeline", "payload"))
+
+
+def compare(results, baseline):
+    previous = dict((result_key(r), r) for r in baseline["results"])
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None or not old["throughput"]:
+            continue
+        sys.stderr.write(
+            "%-40s throughput %+6.1f%%  p99 %+6.1f%%\n" % (
+                " ".join(str(k) for k in result_key(result)),
+                100.0 * result["throughput"] / old["throughput"] - 100,
+                100.0 * result["latency_ms"]["p99"] /
+                (old["latency_ms"]["p99"] or 1) - 100))
+
+
+def main():
+    options = parse_args()
+    results = []
+    for protocol, transport in itertools.product(options.protocol,
+                                                 options.transport):
+        proc = None if options.no_server else \
+            start_server(options, protocol, transport)
+        try:
+            for connections, pipeline, payload in itertools.product(
+                    options.connections, options.pipeline, options.payload):
+                conf = {
+                    "host": options.host, "port": options.port,
+                    "protocol": protocol, "transport": transport,
+                    "connections": connections, "pipeline": pipeline,
+                    "payload": payload,
+                }
+                result = run(conf, options)
+                results.append(result)
+                sys.stderr.write(
+                    "%-11s %-8s conns=%-4d depth=%-3d payload=%-6d "
+                    "%9.0f/s p50=%.3fms p99=%.3fms p999=%.3fms errors=%d\n"
+                    % (protocol, transport, connections, pipeline, payload,
+                       result["throughput"], result["latency_ms"]["p50"],
+                       result["latency_ms"]["p99"],
+                       result["latency_ms"]["p999"], result["errors"]))
+        finally:
+            if proc is not None:
+                stop_server(proc)
+
+    report = {
+        "meta": {
+            "time": time.time(),
+            "version": __version__,
+            "python": platform.python_version(),
+            "host": platform.node(),
+            "duration": options.duration,
+            "warmup": options.warmup,
+            "processes": options.processes,
+            "workers": options.workers,
+            "server_args": options.server_args,
+        },
+        "results": results,
+    }
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(data + "\n")
+    else:
+        sys.stdout.write(data + "\n")
+    if options.baseline:
+        with open(options.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# coding:utf8
+"""encode/decode the Ping example messages with each protocol factory.
+
+    python benchmarks/protocol_bench.py [loops] [msg_size]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "examples"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from thrift.Thrift import TMessageType
+from thrift.transport.TTransport import TMemoryBuffer
+
+from ping.Ping import send_ping_args, send_ping_result
+from gunicorn_thrift.thrift.protocol import TBinaryProtocolFactoryExt
+from gunicorn_thrift.thrift.protocol import TBinaryProtocolAcceleratedFactoryExt
+
+
+def roundtrip(pfactory, msg, loops):
+    """one server side call: decode the args, encode the result."""
+    otrans = TMemoryBuffer()
+    oprot = pfactory.getProtocol(otrans)
+    oprot.writeMessageBegin("send_ping", TMessageType.CALL, 0)
+    send_ping_args(msg=msg).write(oprot)
+    oprot.writeMessageEnd()
+    request = otrans.getvalue()
+
+    start = time.time()
+    for _ in range(loops):
+        iprot = pfactory.getProtocol(TMemoryBuffer(request))
+        iprot.readMessageBegin()
+        args = send_ping_args()
+        args.read(iprot)
+        iprot.readMessageEnd()
+
+        oprot = pfactory.getProtocol(TMemoryBuffer())
+        oprot.writeMessageBegin("send_ping", TMessageType.REPLY, 0)
+        send_ping_result(success=args.msg).write(oprot)
+        oprot.writeMessageEnd()
+    return time.time() - start
+
+
+def main():
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    msg = "p" * size
+    base = None
+    for name, pfactory in (
+            ("binary", TBinaryProtocolFactoryExt()),
+            ("accelerated", TBinaryProtocolAcceleratedFactoryExt())):
+        cost = roundtrip(pfactory, msg, loops)
+        base = base or cost
+        print("%-12s %8.0f calls/s  x%.2f" % (name, loops / cost, base / cost))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# coding:utf8
+"""serve Ping calls over a socketpair with each server side transport.
+
+reports syscalls per call (recv/recv_into/send/sendall on the server
+socket) and bytes copied out of the kernel into freshly allocated strings
+by recv(); recv_into fills a reused buffer and allocates nothing.
+
+    python benchmarks/transport_bench.py [loops] [msg_size]
+"""
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "examples"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from thrift.Thrift import TMessageType
+from thrift.transport.TSocket import TSocket
+from thrift.transport.TTransport import TMemoryBuffer
+from thrift.transport.TTransport import TBufferedTransport
+from thrift.transport.TTransport import TFileObjectTransport
+
+from ping import Ping
+from ping.Ping import send_ping_args, send_ping_result
+from gunicorn_thrift.thrift.protocol import TBinaryProtocolAcceleratedFactoryExt
+from gunicorn_thrift.thrift.transport import TSocketTransportExt
+
+
+class CountingSocket(object):
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.syscalls = 0
+        self.copied = 0
+
+    def recv(self, *args):
+        self.syscalls += 1
+        data = self._sock.recv(*args)
+        self.copied += len(data)
+        return data
+
+    def recv_into(self, *args):
+        self.syscalls += 1
+        return self._sock.recv_into(*args)
+
+    def send(self, data, *args):
+        self.syscalls += 1
+        return self._sock.send(data, *args)
+
+    def sendall(self, data, *args):
+        self.syscalls += 1
+        return self._sock.sendall(data, *args)
+
+    def close(self):
+        self._sock.close()
+
+
+def makefile_transport(sock):
+    return TFileObjectTransport(socket._fileobject(sock))
+
+
+def buffered_transport(sock):
+    client = TSocket()
+    client.setHandle(sock)
+    return TBufferedTransport(client)
+
+
+class Handler(object):
+
+    def send_ping(self, msg):
+        return msg
+
+
+def encode(mtype, struct):
+    trans = TMemoryBuffer()
+    prot = TBinaryProtocolAcceleratedFactoryExt().getProtocol(trans)
+    prot.writeMessageBegin("send_ping", mtype, 0)
+    struct.write(prot)
+    prot.writeMessageEnd()
+    return trans.getvalue()
+
+
+def call(client, request, reply_size, loops):
+    for _ in range(loops):
+        client.sendall(request)
+        left = reply_size
+        while left:
+            left -= len(client.recv(left))
+
+
+def run(make_transport, msg, loops):
+    client, server = socket.socketpair()
+    counter = CountingSocket(server)
+    trans = make_transport(counter)
+    prot = TBinaryProtocolAcceleratedFactoryExt().getProtocol(trans)
+    processor = Ping.Processor(Handler())
+    request = encode(TMessageType.CALL, send_ping_args(msg=msg))
+    reply_size = len(encode(TMessageType.REPLY, send_ping_result(success=msg)))
+    caller = threading.Thread(
+        target=call, args=(client, request, reply_size, loops))
+
+    start = time.time()
+    caller.start()
+    for _ in range(loops):
+        processor.process(prot, prot)
+    caller.join()
+    cost = time.time() - start
+    client.close()
+    server.close()
+    return cost, counter
+
+
+def main():
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    msg = "p" * size
+    for name, make_transport in (
+            ("makefile", makefile_transport),
+            ("buffered", buffered_transport),
+            ("socketext", TSocketTransportExt)):
+        cost, counter = run(make_transport, msg, loops)
+        print("%-10s %8.0f calls/s %6.2f syscalls/call %8.1f copied bytes/call" % (
+            name, loops / cost, float(counter.syscalls) / loops,
+            float(counter.copied) / loops))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# coding:utf8
+"""compare the gevent and thread workers on CPU-bound and IO-bound calls.
+
+starts gunicorn_thrift with benchmarks/bench_app.py for each worker class
+and drives it with one connection per client thread.
+
+    python benchmarks/worker_bench.py [duration] [clients]
+"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "examples"))
+
+from thrift.transport import TSocket, TTransport
+from thrift.protocol import TBinaryProtocol
+
+from ping import Ping
+
+PORT = 7749
+
+WORKERS = (
+    ("gevent", ["--worker-class",
+                "gunicorn_thrift.workers.gthriftgevent.ThriftGeventWorker"]),
+    ("thread", ["--worker-class",
+                "gunicorn_thrift.workers.gthriftthread.ThriftThreadWorker",
+                "--threads", "16"]),
+)
+
+LOADS = (
+    ("echo", "ping"),
+    ("cpu", "cpu:20000"),
+    ("io", "io:0.01"),
+    ("cblock", "cblock:0.01"),
+)
+
+
+def start_server(args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT, os.path.join(ROOT, "examples"), os.path.dirname(__file__)])
+    cmd = [sys.executable, "-c",
+           "from gunicorn_thrift.app.thriftapp import run; run()",
+           "--bind", "127.0.0.1:%d" % PORT, "--workers", "1",
+           "--log-level", "warning"] + args + ["bench_app:processor"]
+    proc = subprocess.Popen(cmd, env=env)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", PORT)).close()
+            return proc
+        except socket.error:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def client(msg, deadline, counts):
+    transport = TTransport.TBufferedTransport(
+        TSocket.TSocket("127.0.0.1", PORT))
+    transport.open()
+    ping = Ping.Client(TBinaryProtocol.TBinaryProtocolAccelerated(transport))
+    n = 0
+    while time.time() < deadline:
+        ping.send_ping(msg)
+        n += 1
+    counts.append(n)
+    transport.close()
+
+
+def drive(msg, duration, clients):
+    counts = []
+    deadline = time.time() + duration
+    threads = [threading.Thread(target=client, args=(msg, deadline, counts))
+               for _ in range(clients)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    return sum(counts) / float(duration)
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    print("%-8s" % "" + "".join("%12s" % name for name, _ in LOADS))
+    for worker, args in WORKERS:
+        proc = start_server(args)
+        try:
+            rates = [drive(msg, duration, clients) for _, msg in LOADS]
+        finally:
+            proc.terminate()
+            proc.wait()
+        print("%-8s" % worker + "".join("%10.0f/s" % r for r in rates))
+
+
+if __name__ == "__main__":
+    main()
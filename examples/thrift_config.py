@@ -7,4 +7,6 @@ timeout = 30
 graceful_timeout = 30
 daemon = False
 accesslog = "access.log"
-errorlog = "error.log"
\ No newline at end of file
+errorlog = "error.log"
+thrift_transport_factory = "buffered"
+thrift_protocol_factory = "accelerated"
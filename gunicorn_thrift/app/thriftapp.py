@@ -24,15 +24,48 @@ THE SOFTWARE.
 """
 
 import os
+import re
 import sys
 
 from gunicorn.errors import AppImportError
 from gunicorn.app.wsgiapp import WSGIApplication
 
+# register the thrift_* settings
+import gunicorn_thrift.config
+
+# a part of a multiplexed app, "Service=module:processor"
+SERVICE_SPEC = re.compile(r"^\s*\w+=[\w.]+:")
+
 
 class ThriftApplication(WSGIApplication):
 
-    def _import_app(self, module):
+    # SharedMetrics, mapped before the first worker is forked
+    metrics = None
+
+    def load_config(self):
+        WSGIApplication.load_config(self)
+
+        if self.cfg.thrift_metrics_bind:
+            user_pre_fork = self.cfg.pre_fork
+
+            def pre_fork(server, worker):
+                self.metrics_pre_fork(server, worker)
+                user_pre_fork(server, worker)
+            self.cfg.set("pre_fork", pre_fork)
+
+    def metrics_pre_fork(self, server, worker):
+        from gunicorn_thrift.metrics import SharedMetrics
+
+        if self.metrics is None:
+            # room for the workers replacing the ones being stopped, slots
+            # only take memory as their rows are used
+            self.metrics = SharedMetrics(max(self.cfg.workers * 2, 4))
+            self.metrics.serve(self.cfg.thrift_metrics_bind, server.log)
+        worker.thrift_metrics_slot = self.metrics.assign_slot(
+            server.WORKERS.values())
+
+    @staticmethod
+    def _import_app(module):
         """fork from gunicorn.until.import_app.
         thrift app is not callable,delete callable test.
         """
@@ -60,11 +93,25 @@ class ThriftApplication(WSGIApplication):
             raise AppImportError("Failed to find application object: %r" % obj)
         return app
 
+    @classmethod
+    def load_app(cls, app_uri):
+        # multiplexed app: "Service=module:processor,Other=module:processor",
+        # methods are called as "Service:method".
+        specs = app_uri.split(",")
+        if not all(SERVICE_SPEC.match(spec) for spec in specs):
+            return cls._import_app(app_uri)
+
+        app = {}
+        for spec in specs:
+            service, _, uri = spec.partition("=")
+            app[service.strip()] = cls._import_app(uri.strip())
+        return app
+
     def load_thriftapp(self):
         self.chdir()
 
         # load the app
-        return self._import_app(self.app_uri)
+        return self.load_app(self.app_uri)
 
     def load(self):
         return self.load_thriftapp()
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -
+"""capture sampled calls to a file and replay them against a server.
+
+with thrift_capture_file set, gevent workers append the raw argument
+bytes of a share of the calls to that file, all workers to the same one.
+The file is a sequence of records, written in batches with O_APPEND:
+
+    b"P" !H len + JSON {"protocol": factory path, "framed": bool}
+    b"C" !dBHI time, message type, len(name), len(args) + name + args
+
+each worker writes a P record when it opens the file. replay sends the
+calls of a capture to a server at their original pace, scaled by speed,
+and reports the latency by method from the time each call was due::
+
+    python -m gunicorn_thrift.capture capture.bin 127.0.0.1:9090 --speed 2
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from struct import pack, unpack
+
+from thrift.Thrift import TMessageType, TType
+
+from gunicorn_thrift.stats import LatencyHistogram
+
+PROTOCOL_RECORD = b"P"
+CALL_RECORD = b"C"
+CALL_HEADER = "!dBHI"
+CALL_HEADER_SIZE = 15
+
+
+class CaptureWriter(object):
+
+    FLUSH_SIZE = 65536
+
+    def __init__(self, path, pfactory, framed, rate=1.0, max_bytes=0):
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        self.rate = rate
+        self.max_bytes = max_bytes
+        self.full = False
+        self.buf = []
+        self.buffered = 0
+        desc = json.dumps({
+            "protocol": "%s.%s" % (pfactory.__class__.__module__,
+                                   pfactory.__class__.__name__),
+            "framed": framed,
+        }).encode("utf-8")
+        self.append(PROTOCOL_RECORD + pack("!H", len(desc)) + desc)
+
+    def sample(self):
+        if self.full:
+            return False
+        return self.rate >= 1 or random.random() < self.rate
+
+    def record(self, name, type, args):
+        if isinstance(name, bytes):
+            bname = name
+        else:
+            bname = name.encode("utf-8")
+        header = pack(CALL_HEADER, time.time(), type, len(bname), len(args))
+        self.append(CALL_RECORD + header + bname + args)
+
+    def append(self, data):
+        if self.max_bytes and self.size + len(data) > self.max_bytes:
+            self.full = True
+            return
+        self.buf.append(data)
+        self.buffered += len(data)
+        self.size += len(data)
+        if self.buffered >= self.FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """write the buffered records that still fit, whole, in one append.
+
+        the other workers append to the file too, its size is read again
+        before each write.
+        """
+        if not self.buf:
+            return
+        records, self.buf, self.buffered = self.buf, [], 0
+        self.size = os.fstat(self.fd).st_size
+        data = []
+        for record in records:
+            if self.max_bytes and self.size + len(record) > self.max_bytes:
+                self.full = True
+                break
+            data.append(record)
+            self.size += len(record)
+        data = b"".join(data)
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def close(self):
+        self.flush()
+        os.close(self.fd)
+
+
+def read_records(path):
+    """yield ("P", desc) and ("C", time, type, name, args) records."""
+    with open(path, "rb") as f:
+        while True:
+            kind = f.read(1)
+            if not kind:
+                return
+            if kind == PROTOCOL_RECORD:
+                size, = unpack("!H", f.read(2))
+                yield "P", json.loads(f.read(size).decode("utf-8"))
+            elif kind == CALL_RECORD:
+                header = f.read(CALL_HEADER_SIZE)
+                if len(header) < CALL_HEADER_SIZE:
+                    return
+                at, type, name_len, args_len = unpack(CALL_HEADER, header)
+                name = f.read(name_len)
+                if not isinstance(name, str):
+                    name = name.decode("utf-8")
+                args = f.read(args_len)
+                if len(args) < args_len:
+                    return
+                yield "C", at, type, name, args
+            else:
+                raise ValueError("bad capture record %r" % kind)
+
+
+def load_capture(path):
+    """the protocol description and the calls of a capture, by time."""
+    desc = None
+    calls = []
+    for record in read_records(path):
+        if record[0] == "P":
+            desc = desc or record[1]
+        else:
+            calls.append(record[1:])
+    if desc is None:
+        raise ValueError("%s has no protocol record" % path)
+    calls.sort(key=lambda call: call[0])
+    return desc, calls
+
+
+class ReplayStats(object):
+
+    def __init__(self):
+        # name -> [errors, LatencyHistogram]
+        self.methods = {}
+
+    def record(self, name, latency, error):
+        entry = self.methods.get(name)
+        if entry is None:
+            entry = self.methods[name] = [0, LatencyHistogram()]
+        if error:
+            entry[0] += 1
+        entry[1].record(latency * 1000000)
+
+    def summary(self, duration):
+        calls = sum(h.count for _, h in self.methods.values())
+        return {
+            "calls": calls,
+            "errors": sum(e for e, _ in self.methods.values()),
+            "duration": duration,
+            "throughput": calls / duration if duration else 0,
+            "methods": dict((name, dict(h.summary(), errors=errors))
+                            for name, (errors, h) in self.methods.items()),
+        }
+
+
+def replay(path, host, port, speed=1.0, connections=16, limit=None):
+    """send the calls of a capture, speed 0 sends them as fast as the
+    connections allow."""
+    import gevent
+    from gevent.queue import Queue
+    from thrift.transport.TSocket import TSocket
+    from thrift.transport.TTransport import TBufferedTransport
+    from thrift.transport.TTransport import TFramedTransport
+
+    from gunicorn_thrift.config import PROTOCOL_FACTORIES, load_factory
+
+    desc, calls = load_capture(path)
+    if limit:
+        calls = calls[:limit]
+    pfactory = load_factory(desc["protocol"], PROTOCOL_FACTORIES)
+    stats = ReplayStats()
+    queue = Queue(connections if not speed else None)
+
+    def connection():
+        sock = TSocket(host, int(port))
+        if desc["framed"]:
+            trans = TFramedTransport(sock)
+        else:
+            trans = TBufferedTransport(sock)
+        prot = pfactory.getProtocol(trans)
+        trans.open()
+        seqid = 0
+        try:
+            while True:
+                call = queue.get()
+                if call is None:
+                    return
+                due, type, name, args = call
+                seqid += 1
+                sent = time.time()
+                prot.writeMessageBegin(name, type, seqid)
+                trans.write(args)
+                prot.writeMessageEnd()
+                trans.flush()
+                error = False
+                if type != TMessageType.ONEWAY:
+                    (_, rtype, _) = prot.readMessageBegin()
+                    prot.skip(TType.STRUCT)
+                    prot.readMessageEnd()
+                    error = rtype == TMessageType.EXCEPTION
+                # from when the call was due, waiting for a connection
+                # counts
+                stats.record(name, time.time() - (due or sent), error)
+        finally:
+            trans.close()
+
+    workers = [gevent.spawn(connection) for _ in range(connections)]
+    start = time.time()
+    first = calls[0][0] if calls else 0
+    for at, type, name, args in calls:
+        due = None
+        if speed:
+            due = start + (at - first) / speed
+            delay = due - time.time()
+            if delay > 0:
+                gevent.sleep(delay)
+        queue.put((due, type, name, args))
+    for _ in workers:
+        queue.put(None)
+    gevent.joinall(workers, raise_error=True)
+    return stats.summary(time.time() - start)
+
+
+def main():
+    from gevent import monkey
+    monkey.patch_socket()
+
+    parser = argparse.ArgumentParser(
+        prog="python -m gunicorn_thrift.capture",
+        description="replay a capture against a server.")
+    parser.add_argument("capture")
+    parser.add_argument("address", help="HOST:PORT")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="pace relative to the capture, 0 for no pauses")
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--limit", type=int, help="replay the first calls")
+    args = parser.parse_args()
+    host, port = args.address.rsplit(":", 1)
+    report = replay(args.capture, host, port, args.speed, args.connections,
+                    args.limit)
+    sys.stdout.write(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,718 @@
+# -*- coding: utf-8 -
+"""thrift settings, registered on gunicorn's config when imported."""
+
+import inspect
+import sys
+
+from gunicorn import six
+from gunicorn.config import Setting, validate_bool, validate_hostport
+from gunicorn.config import validate_pos_int, validate_string
+from gunicorn.config import validate_string_to_list
+from gunicorn.errors import ConfigError
+
+# connections are already wrapped in the buffered TSocketTransportExt
+TRANSPORT_FACTORIES = {
+    "raw": "thrift.transport.TTransport.TTransportFactoryBase",
+    "buffered": "thrift.transport.TTransport.TTransportFactoryBase",
+    "framed": "thrift.transport.TTransport.TFramedTransportFactory",
+}
+
+PROTOCOL_FACTORIES = {
+    "binary": "gunicorn_thrift.thrift.protocol.TBinaryProtocolFactoryExt",
+    "accelerated":
+        "gunicorn_thrift.thrift.protocol.TBinaryProtocolAcceleratedFactoryExt",
+    "compact": "gunicorn_thrift.thrift.protocol.TCompactProtocolFactoryExt",
+    # thrift >= 0.10
+    "compact_accelerated":
+        "thrift.protocol.TCompactProtocol.TCompactProtocolAcceleratedFactory",
+}
+
+
+def load_factory(uri, aliases):
+    """load a transport/protocol factory from a short name or dotted path.
+
+    classes are instantiated without arguments, factory objects set in
+    the config file are used as is.
+    """
+    factory = uri
+    if isinstance(uri, six.string_types):
+        uri = uri.strip()
+        path = aliases.get(uri, uri)
+        module, _, obj = path.rpartition(".")
+        try:
+            __import__(module)
+            factory = getattr(sys.modules[module], obj)
+        except (ImportError, AttributeError, ValueError):
+            raise ConfigError("Invalid thrift factory: %r" % uri)
+    if inspect.isclass(factory):
+        factory = factory()
+    return factory
+
+
+def validate_method_list(val):
+    if isinstance(val, six.string_types):
+        return validate_string_to_list(val)
+    return [v.strip() for v in val or []]
+
+
+def validate_pos_float(val):
+    val = float(val)
+    if val <= 0:
+        raise ValueError("Value must be positive: %s" % val)
+    return val
+
+
+def validate_access_log_overflow(val):
+    if val not in ("drop_new", "drop_old"):
+        raise ConfigError("Invalid access log overflow policy: %r" % val)
+    return val
+
+
+def validate_profile_format(val):
+    if val not in ("collapsed", "pstats"):
+        raise ConfigError("Invalid profile format: %r" % val)
+    return val
+
+
+def validate_float(val):
+    val = float(val)
+    if val < 0:
+        raise ValueError("Value must not be negative: %s" % val)
+    return val
+
+
+def validate_rate(val):
+    val = float(val)
+    if not 0 <= val <= 1:
+        raise ValueError("Value must be between 0 and 1: %s" % val)
+    return val
+
+
+def method_map(val, validate):
+    """{method: value} from a dict or "method=value,method=value"."""
+    if isinstance(val, six.string_types):
+        items = []
+        for item in validate_string_to_list(val):
+            name, sep, value = item.partition("=")
+            if not sep:
+                raise ConfigError("Invalid method setting: %r" % item)
+            items.append((name.strip(), value.strip()))
+    else:
+        items = (val or {}).items()
+    return dict((name, validate(value)) for name, value in items)
+
+
+def validate_method_timeouts(val):
+    return method_map(val, validate_pos_float)
+
+
+def validate_method_ttls(val):
+    return method_map(val, validate_pos_float)
+
+
+def validate_method_concurrency(val):
+    limits = method_map(val, validate_pos_int)
+    for name, limit in limits.items():
+        if not limit:
+            raise ConfigError("Invalid concurrency limit of %s: 0" % name)
+    return limits
+
+
+def validate_transport_factory(val):
+    return load_factory(val, TRANSPORT_FACTORIES)
+
+
+def validate_protocol_factory(val):
+    return load_factory(val, PROTOCOL_FACTORIES)
+
+
+class ThriftTransportFactory(Setting):
+    name = "thrift_transport_factory"
+    section = "Thrift"
+    cli = ["--thrift-transport-factory"]
+    meta = "STRING"
+    validator = validate_transport_factory
+    default = "buffered"
+    desc = """\
+        The thrift transport factory used for each connection.
+
+        One of raw, buffered or framed, or the dotted path of a transport
+        factory class.
+        """
+
+
+class ThriftProtocolFactory(Setting):
+    name = "thrift_protocol_factory"
+    section = "Thrift"
+    cli = ["--thrift-protocol-factory"]
+    meta = "STRING"
+    validator = validate_protocol_factory
+    default = "accelerated"
+    desc = """\
+        The thrift protocol factory used for each connection.
+
+        One of binary, accelerated, compact or compact_accelerated, or the
+        dotted path of a protocol factory class. accelerated decodes whole
+        structs with fastbinary when it is installed, handlers still get and
+        return unicode strings on python 2 as with binary.
+        """
+
+
+class ThriftPipeline(Setting):
+    name = "thrift_pipeline"
+    section = "Thrift"
+    cli = ["--thrift-pipeline"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 0
+    desc = """\
+        The number of messages processed concurrently per connection.
+
+        Only used with the framed transport. Frames are read ahead and each
+        message runs in its own greenlet, responses are written back as soon
+        as they finish so clients must match them by seqid. 0 (the default)
+        processes one message at a time.
+        """
+
+
+class ThriftOffloadMethods(Setting):
+    name = "thrift_offload_methods"
+    section = "Thrift"
+    cli = ["--thrift-offload-methods"]
+    meta = "STRING"
+    validator = validate_method_list
+    default = []
+    desc = """\
+        Methods run in a pool of child processes.
+
+        A list, or a comma separated string, of method names as they appear
+        on the wire ("Service:method" for multiplexed apps). Use it for
+        CPU-heavy calls that would stall the other connections of a gevent
+        worker. Arguments and results cross the process boundary in their
+        serialized form.
+        """
+
+
+class ThriftOffloadWorkers(Setting):
+    name = "thrift_offload_workers"
+    section = "Thrift"
+    cli = ["--thrift-offload-workers"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 0
+    desc = """\
+        The number of offload processes per worker.
+
+        0 (the default) splits the CPUs between the workers, each worker
+        starting one process at least.
+        """
+
+
+class ThriftStatsdHost(Setting):
+    name = "thrift_statsd_host"
+    section = "Thrift"
+    cli = ["--thrift-statsd-host"]
+    meta = "STATSD_ADDR"
+    validator = validate_hostport
+    default = None
+    desc = """\
+        host:port of the statsd server access metrics are sent to.
+
+        Falls back to the ``statsd`` environment variable. Per method call
+        counts (by status) and timings are aggregated in each worker and
+        sent in batches.
+        """
+
+
+class ThriftStatsdInterval(Setting):
+    name = "thrift_statsd_interval"
+    section = "Thrift"
+    cli = ["--thrift-statsd-interval"]
+    meta = "FLOAT"
+    validator = validate_pos_float
+    type = float
+    default = 1.0
+    desc = """\
+        Seconds between two flushes of the aggregated statsd metrics.
+        """
+
+
+class ThriftStatsdMTU(Setting):
+    name = "thrift_statsd_mtu"
+    section = "Thrift"
+    cli = ["--thrift-statsd-mtu"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 1432
+    desc = """\
+        The maximum size in bytes of a statsd datagram.
+
+        Metrics are packed one per line into datagrams up to this size. Keep
+        it under the path MTU, 8932 is fine on jumbo frame networks.
+        """
+
+
+class ThriftStatsdMaxSamples(Setting):
+    name = "thrift_statsd_max_samples"
+    section = "Thrift"
+    cli = ["--thrift-statsd-max-samples"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 100
+    desc = """\
+        The number of timings kept per method and flush interval.
+
+        Calls beyond it are sampled, the timings are sent with their sample
+        rate so statsd still counts every call.
+        """
+
+
+class ThriftAccessLogBuffer(Setting):
+    name = "thrift_access_log_buffer"
+    section = "Thrift"
+    cli = ["--thrift-access-log-buffer"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 8192
+    desc = """\
+        The number of access log lines buffered per worker.
+
+        Calls only record their access log entry in a ring buffer, a
+        background writer formats and writes the lines. When the writer
+        falls behind, lines are dropped following
+        thrift_access_log_overflow and counted in the error log. 0 writes
+        each line from the request itself.
+        """
+
+
+class ThriftAccessLogOverflow(Setting):
+    name = "thrift_access_log_overflow"
+    section = "Thrift"
+    cli = ["--thrift-access-log-overflow"]
+    meta = "STRING"
+    validator = validate_access_log_overflow
+    default = "drop_new"
+    desc = """\
+        What to drop when the access log buffer is full.
+
+        drop_new (the default) drops the lines of new calls, drop_old the
+        oldest buffered lines.
+        """
+
+
+class ThriftStatsEndpoint(Setting):
+    name = "thrift_stats_endpoint"
+    section = "Thrift"
+    cli = ["--thrift-stats-endpoint"]
+    validator = validate_bool
+    action = "store_true"
+    default = False
+    desc = """\
+        Answer calls to the gunicorn_thrift:stats method.
+
+        The reply is a JSON string with the in-flight and error counts and
+        the latency percentiles by method and status of the worker handling
+        the connection. ``python -m gunicorn_thrift.stats HOST:PORT`` prints
+        it.
+        """
+
+
+class ThriftMetricsBind(Setting):
+    name = "thrift_metrics_bind"
+    section = "Thrift"
+    cli = ["--thrift-metrics-bind"]
+    meta = "ADDRESS"
+    validator = validate_hostport
+    default = None
+    desc = """\
+        host:port the arbiter serves the metrics of all workers on.
+
+        Workers write their call counts, in-flight calls and latency
+        histograms to shared memory, GET /metrics on this address returns
+        their sum in the Prometheus text format. The gunicorn_thrift:stats
+        method then also answers for the whole server.
+        """
+
+
+class ThriftMethodTimeouts(Setting):
+    name = "thrift_method_timeouts"
+    section = "Thrift"
+    cli = ["--thrift-method-timeouts"]
+    meta = "STRING"
+    validator = validate_method_timeouts
+    default = {}
+    desc = """\
+        Timeouts of single methods, overriding timeout.
+
+        A dict, or a comma separated string like ``get_user=0.005,
+        rebuild=20``, of method names as they appear on the wire to
+        seconds. The gevent worker enforces deadlines with a 10ms timer
+        wheel.
+        """
+
+
+class ThriftMaxInFlight(Setting):
+    name = "thrift_max_in_flight"
+    section = "Thrift"
+    cli = ["--thrift-max-in-flight"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 0
+    desc = """\
+        The maximum number of calls a gevent worker processes at once.
+
+        Calls over the limit are answered at once with a
+        TApplicationException and logged with the OVERLOADED (503) status,
+        their connection stays open. 0 (the default) sets no limit.
+        """
+
+
+class ThriftQueueTarget(Setting):
+    name = "thrift_queue_target"
+    section = "Thrift"
+    cli = ["--thrift-queue-target"]
+    meta = "FLOAT"
+    validator = validate_float
+    type = float
+    default = 0
+    desc = """\
+        Queueing delay in seconds the adaptive limit aims for.
+
+        When set, the gevent worker measures how late its event loop runs
+        ready greenlets. While that delay stays above the target for 100ms
+        it admits a shrinking share of the calls, rejecting the others as
+        with thrift_max_in_flight, then admits more again once it is below.
+        0 (the default) disables it.
+        """
+
+
+class ThriftMethodConcurrency(Setting):
+    name = "thrift_method_concurrency"
+    section = "Thrift"
+    cli = ["--thrift-method-concurrency"]
+    meta = "STRING"
+    validator = validate_method_concurrency
+    default = {}
+    desc = """\
+        The maximum number of concurrent calls of single methods.
+
+        A dict, or a comma separated string like ``search=20,export=2``, of
+        method names as they appear on the wire to limits, enforced by each
+        gevent worker. Calls over the limit wait in a queue of
+        thrift_bulkhead_queue calls at most, until their method timeout,
+        further calls are rejected like with thrift_max_in_flight. A slow
+        method can then not take all the greenlets of a worker.
+        """
+
+
+class ThriftBulkheadQueue(Setting):
+    name = "thrift_bulkhead_queue"
+    section = "Thrift"
+    cli = ["--thrift-bulkhead-queue"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 0
+    desc = """\
+        The number of calls waiting for a method at its concurrency limit.
+
+        0 (the default) rejects calls as soon as the limit is reached.
+        """
+
+
+class ThriftIdleTimeout(Setting):
+    name = "thrift_idle_timeout"
+    section = "Thrift"
+    cli = ["--thrift-idle-timeout"]
+    meta = "FLOAT"
+    validator = validate_float
+    type = float
+    default = 0
+    desc = """\
+        Seconds a connection may wait for its next message.
+
+        Idle connections are closed between messages, so pooled clients
+        do not hold greenlets, threads and buffers of a worker for
+        nothing. 0 (the default) keeps them open until the client closes
+        them.
+        """
+
+
+class ThriftMaxRequestsPerConnection(Setting):
+    name = "thrift_max_requests_per_connection"
+    section = "Thrift"
+    cli = ["--thrift-max-requests-per-connection"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 0
+    desc = """\
+        The number of messages a connection is closed after.
+
+        The connection is closed once the last response is written, which
+        spreads long-lived clients over the workers as they reconnect.
+        0 (the default) does not limit them.
+        """
+
+
+class ThriftReusePort(Setting):
+    name = "thrift_reuse_port"
+    section = "Thrift"
+    cli = ["--thrift-reuse-port"]
+    validator = validate_bool
+    action = "store_true"
+    default = False
+    desc = """\
+        Give every gevent worker listeners of its own with SO_REUSEPORT.
+
+        The kernel then spreads new connections over the workers instead
+        of waking all of them for each one. The shared listeners join the
+        same group and are still served, they get their share of the
+        connections. Connections waiting in the backlog of a stopping
+        worker are reset. TCP addresses only, on systems with
+        SO_REUSEPORT.
+        """
+
+
+class ThriftCacheMethods(Setting):
+    name = "thrift_cache_methods"
+    section = "Thrift"
+    cli = ["--thrift-cache-methods"]
+    meta = "STRING"
+    validator = validate_method_ttls
+    default = {}
+    desc = """\
+        Idempotent methods whose replies are cached, with their TTL.
+
+        A dict, or a comma separated string like ``get_user=5``, of method
+        names as they appear on the wire to seconds. Calls with the same
+        serialized arguments are answered from a cache in each worker of
+        the gevent and thread workers, without running the handler.
+        Handlers can drop entries with
+        ``gunicorn_thrift.workers.cache.invalidate``.
+        """
+
+
+class ThriftCacheMaxBytes(Setting):
+    name = "thrift_cache_max_bytes"
+    section = "Thrift"
+    cli = ["--thrift-cache-max-bytes"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 64 * 1024 * 1024
+    desc = """\
+        The size of the response cache of each worker, in bytes.
+
+        The least recently used replies are evicted beyond it.
+        """
+
+
+class ThriftCoalesceMethods(Setting):
+    name = "thrift_coalesce_methods"
+    section = "Thrift"
+    cli = ["--thrift-coalesce-methods"]
+    meta = "STRING"
+    validator = validate_method_list
+    default = []
+    desc = """\
+        Methods whose identical concurrent calls share one handler run.
+
+        A list, or a comma separated string, of method names as they appear
+        on the wire. Calls with the same serialized arguments arriving while
+        one of them runs wait for its reply instead of running the handler,
+        in the gevent and thread workers. Meant for idempotent reads.
+        """
+
+
+class ThriftCaptureFile(Setting):
+    name = "thrift_capture_file"
+    section = "Thrift"
+    cli = ["--thrift-capture-file"]
+    meta = "FILE"
+    validator = validate_string
+    default = None
+    desc = """\
+        Append a sample of the calls to this file, for replays.
+
+        The gevent workers record the method, arrival time and raw argument
+        bytes of the calls. ``python -m gunicorn_thrift.capture FILE
+        HOST:PORT`` replays them at their original pace.
+        """
+
+
+class ThriftCaptureRate(Setting):
+    name = "thrift_capture_rate"
+    section = "Thrift"
+    cli = ["--thrift-capture-rate"]
+    meta = "FLOAT"
+    validator = validate_rate
+    type = float
+    default = 1.0
+    desc = """\
+        The share of the calls recorded with thrift_capture_file, between 0
+        and 1.
+        """
+
+
+class ThriftCaptureMaxBytes(Setting):
+    name = "thrift_capture_max_bytes"
+    section = "Thrift"
+    cli = ["--thrift-capture-max-bytes"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 1024 * 1024 * 1024
+    desc = """\
+        The size thrift_capture_file stops growing at, in bytes.
+
+        Workers check the size of the file before each batch they append,
+        so the file holds whole records up to this size with all of them
+        writing. 0 does not limit it.
+        """
+
+
+class ThriftProfileDir(Setting):
+    name = "thrift_profile_dir"
+    section = "Thrift"
+    cli = ["--thrift-profile-dir"]
+    meta = "DIR"
+    validator = validate_string
+    default = None
+    desc = """\
+        The directory profiles of the workers are written to.
+
+        A gevent worker samples its stacks for thrift_profile_seconds on
+        SIGUSR2, and with thrift_stats_endpoint on calls to
+        gunicorn_thrift:profile, see ``python -m gunicorn_thrift.profiler``.
+        Files are named after the worker pid, by default in the temporary
+        directory.
+        """
+
+
+class ThriftProfileSeconds(Setting):
+    name = "thrift_profile_seconds"
+    section = "Thrift"
+    cli = ["--thrift-profile-seconds"]
+    meta = "FLOAT"
+    validator = validate_pos_float
+    type = float
+    default = 10.0
+    desc = """\
+        How long a profile samples the worker, in seconds.
+        """
+
+
+class ThriftProfileRate(Setting):
+    name = "thrift_profile_rate"
+    section = "Thrift"
+    cli = ["--thrift-profile-rate"]
+    meta = "FLOAT"
+    validator = validate_pos_float
+    type = float
+    default = 100.0
+    desc = """\
+        Stack samples taken per second of CPU time while profiling.
+        """
+
+
+class ThriftProfileFormat(Setting):
+    name = "thrift_profile_format"
+    section = "Thrift"
+    cli = ["--thrift-profile-format"]
+    meta = "STRING"
+    validator = validate_profile_format
+    default = "collapsed"
+    desc = """\
+        The format of the profiles, collapsed or pstats.
+
+        collapsed stacks, one per line and rooted at the method of the call,
+        are what flamegraph.pl and speedscope read. pstats files load with
+        ``pstats.Stats``.
+        """
+
+
+class ThriftSlowLog(Setting):
+    name = "thrift_slow_log"
+    section = "Thrift"
+    cli = ["--thrift-slow-log"]
+    meta = "FILE"
+    validator = validate_string
+    default = None
+    desc = """\
+        Log the calls slower than thrift_slow_threshold to this file.
+
+        '-' means log to stderr. The gevent workers log the time each call
+        spent queued, reading its arguments, in the handler, encoding and
+        writing the reply, and the stack of the handler at the threshold.
+        Needs the ThriftLogger logger class.
+        """
+
+
+class ThriftSlowThreshold(Setting):
+    name = "thrift_slow_threshold"
+    section = "Thrift"
+    cli = ["--thrift-slow-threshold"]
+    meta = "FLOAT"
+    validator = validate_pos_float
+    type = float
+    default = 1.0
+    desc = """\
+        Seconds from its arrival a call takes to go to thrift_slow_log.
+        """
+
+
+class ThriftMaxMessageSize(Setting):
+    name = "thrift_max_message_size"
+    section = "Thrift"
+    cli = ["--thrift-max-message-size"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 100 * 1024 * 1024
+    desc = """\
+        The largest call a worker reads, in bytes.
+
+        Frames over it are skipped without being read into memory and
+        answered with a TApplicationException, by the gevent workers. Other
+        calls count the strings and containers they decode against it and
+        their connection is closed once over it. 0 does not limit it.
+        """
+
+
+class ThriftMaxStringSize(Setting):
+    name = "thrift_max_string_size"
+    section = "Thrift"
+    cli = ["--thrift-max-string-size"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 0
+    desc = """\
+        The longest string or binary field of a call, in bytes.
+
+        Enforced by the binary and compact protocols of gunicorn_thrift,
+        the accelerated binary protocol decodes in python with it set. 0
+        does not limit it.
+        """
+
+
+class ThriftMaxContainerSize(Setting):
+    name = "thrift_max_container_size"
+    section = "Thrift"
+    cli = ["--thrift-max-container-size"]
+    meta = "INT"
+    validator = validate_pos_int
+    type = int
+    default = 0
+    desc = """\
+        The most elements of a list, set or map of a call.
+
+        Enforced as thrift_max_string_size is. 0 does not limit it.
+        """
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -
+"""metrics of all the workers of a server, in shared memory.
+
+the arbiter maps an anonymous shared region before forking the first
+worker and gives every worker a slot of its own, the worker only ever
+writes to its slot so no locks are shared between processes. A slot is:
+
+    names      NAMES_SIZE bytes, "\\n" joined names of the method rows
+    header     pid, in flight, len(names), connections, active connections,
+               connections accepted on the shared and the reuseport listeners
+    methods    a row for OTHER, then one for each name:
+                   in flight, cache hits, cache misses, coalesced calls
+                   for each status: count, total us, max us, buckets
+
+a method gets its row on its first call, MAX_METHODS of them at most, so
+only the pages of the rows in use are touched. The arbiter serves the sum
+of all slots in the Prometheus text format on thrift_metrics_bind. Slots
+of dead workers are handed to new workers with their rows, so the totals
+only go up.
+"""
+
+from __future__ import absolute_import
+
+import ctypes
+import mmap
+import os
+import threading
+
+from gunicorn.six.moves import BaseHTTPServer
+
+from gunicorn_thrift.stats import BUCKETS, MAX_VALUE, LatencyHistogram
+from gunicorn_thrift.stats import ThriftStats, bucket_index, bucket_value
+from gunicorn_thrift.stats import cache_summary
+from gunicorn_thrift.thriftlogging import THRIFT_STATUS_CODE
+
+STATUSES = sorted(THRIFT_STATUS_CODE)
+
+NAMES_SIZE = 65536
+MAX_METHODS = 256
+OTHER = ThriftStats.OTHER
+
+SLOT_PID, SLOT_IN_FLIGHT, SLOT_NAMES, SLOT_CONNECTIONS, SLOT_ACTIVE = range(5)
+SLOT_ACCEPTED, SLOT_ACCEPTED_REUSEPORT = range(5, 7)
+SLOT_HEADER = 7
+METHOD_IN_FLIGHT, METHOD_CACHE_HITS, METHOD_CACHE_MISSES = range(3)
+METHOD_COALESCED = 3
+METHOD_HEADER = 4
+HIST_COUNT, HIST_TOTAL, HIST_MAX = range(3)
+HIST_SIZE = 3 + BUCKETS
+METHOD_SIZE = METHOD_HEADER + len(STATUSES) * HIST_SIZE
+SLOT_INTS = SLOT_HEADER + (MAX_METHODS + 1) * METHOD_SIZE
+
+# le bounds of the exported histograms, in seconds
+PROMETHEUS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                      0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class MetricsSlot(object):
+
+    def __init__(self, buf, offset):
+        self.buf = buf
+        self.offset = offset
+        self.ints = (ctypes.c_int64 * SLOT_INTS).from_buffer(
+            buf, offset + NAMES_SIZE)
+
+    @property
+    def names(self):
+        size = self.ints[SLOT_NAMES]
+        if not size:
+            return []
+        data = self.buf[self.offset:self.offset + size]
+        return data.decode("utf-8").split("\n")
+
+    def add_row(self, name):
+        """the offset of a new row for name, None when the slot is full."""
+        names = self.names
+        data = "\n".join(names + [name]).encode("utf-8")
+        if len(names) >= MAX_METHODS or len(data) > NAMES_SIZE:
+            return None
+        base = SLOT_HEADER + (len(names) + 1) * METHOD_SIZE
+        ctypes.memset(ctypes.addressof(self.ints) + base * 8, 0,
+                      METHOD_SIZE * 8)
+        self.buf[self.offset:self.offset + len(data)] = data
+        # readers see the name once its row is zeroed
+        self.ints[SLOT_NAMES] = len(data)
+        return base
+
+
+class SharedMetrics(object):
+
+    def __init__(self, slots):
+        self.slot_size = NAMES_SIZE + SLOT_INTS * 8
+        self.buf = mmap.mmap(-1, slots * self.slot_size)
+        self.slots = [MetricsSlot(self.buf, i * self.slot_size)
+                      for i in range(slots)]
+        self.server = None
+
+    def assign_slot(self, workers):
+        """the slot for a new worker, None when all of them are used."""
+        used = set(getattr(w, "thrift_metrics_slot", None) for w in workers)
+        for index in range(len(self.slots)):
+            if index not in used:
+                return index
+        return None
+
+    def attach(self, index, names):
+        """the ThriftStats of a worker writing to slot index, names are
+        the methods that may get a row of their own."""
+        slot = self.slots[index]
+        ints = slot.ints
+        ints[SLOT_PID] = os.getpid()
+        ints[SLOT_IN_FLIGHT] = 0
+        ints[SLOT_CONNECTIONS] = 0
+        ints[SLOT_ACTIVE] = 0
+        for i in range(len(slot.names) + 1):
+            ints[SLOT_HEADER + i * METHOD_SIZE] = 0
+        return SharedStats(self, slot, names)
+
+    def collect(self):
+        """live workers, [connections, active connections],
+        {slot: (accepted shared, accepted reuseport)} and
+        {method: [in flight, {status: LatencyHistogram}, cache hits,
+        cache misses, coalesced calls]}
+        """
+        methods = {}
+        workers = 0
+        connections = [0, 0]
+        accepted = {}
+        for index, slot in enumerate(self.slots):
+            ints = slot.ints
+            if not ints[SLOT_PID]:
+                continue
+            alive = pid_alive(ints[SLOT_PID])
+            workers += alive
+            if alive:
+                connections[0] += ints[SLOT_CONNECTIONS]
+                connections[1] += ints[SLOT_ACTIVE]
+            accepted[index] = (ints[SLOT_ACCEPTED],
+                               ints[SLOT_ACCEPTED_REUSEPORT])
+            for i, name in enumerate([OTHER] + slot.names):
+                base = SLOT_HEADER + i * METHOD_SIZE
+                entry = methods.setdefault(name, [0, {}, 0, 0, 0])
+                if alive:
+                    entry[0] += ints[base + METHOD_IN_FLIGHT]
+                entry[2] += ints[base + METHOD_CACHE_HITS]
+                entry[3] += ints[base + METHOD_CACHE_MISSES]
+                entry[4] += ints[base + METHOD_COALESCED]
+                histograms = entry[1]
+                for s, status in enumerate(STATUSES):
+                    hist = base + METHOD_HEADER + s * HIST_SIZE
+                    count = ints[hist + HIST_COUNT]
+                    if not count:
+                        continue
+                    histogram = histograms.get(status)
+                    if histogram is None:
+                        histogram = histograms[status] = LatencyHistogram()
+                    histogram.count += count
+                    histogram.total += ints[hist + HIST_TOTAL]
+                    histogram.max = max(histogram.max, ints[hist + HIST_MAX])
+                    counts = histogram.counts
+                    buckets = ints[hist + 3:hist + 3 + BUCKETS]
+                    for b, n in enumerate(buckets):
+                        if n:
+                            counts[b] += n
+        return workers, connections, accepted, methods
+
+    def snapshot(self):
+        """the ThriftStats.snapshot of the whole server."""
+        workers, connections, accepted, methods = self.collect()
+        snapshot = {
+            "pid": os.getpid(),
+            "workers": workers,
+            "connections": {
+                "active": connections[1],
+                "idle": connections[0] - connections[1],
+                "accepted": {
+                    "shared": sum(a[0] for a in accepted.values()),
+                    "reuseport": sum(a[1] for a in accepted.values()),
+                },
+                "accepted_by_slot": dict((str(index), sum(a))
+                                         for index, a in accepted.items()),
+            },
+            "methods": {},
+        }
+        total_in_flight = 0
+        for name, (in_flight, histograms, hits, misses,
+                   coalesced) in methods.items():
+            if not in_flight and not histograms:
+                continue
+            total_in_flight += in_flight
+            summary = snapshot["methods"][name] = {
+                "in_flight": in_flight,
+                "errors": sum(h.count for status, h in histograms.items()
+                              if status != "OK"),
+                "statuses": dict((status, h.summary())
+                                 for status, h in histograms.items()),
+            }
+            if hits or misses:
+                summary["cache"] = cache_summary(hits, misses)
+            if coalesced:
+                summary["coalesced"] = coalesced
+        snapshot["in_flight"] = total_in_flight
+        return snapshot
+
+    def prometheus(self):
+        """the metrics of all the workers in the Prometheus text format."""
+        workers, connections, accepted, methods = self.collect()
+        lines = [
+            "# HELP thrift_workers Workers writing metrics.",
+            "# TYPE thrift_workers gauge",
+            "thrift_workers %d" % workers,
+            "# HELP thrift_connections Open connections, processing a "
+            "message or idle.",
+            "# TYPE thrift_connections gauge",
+            'thrift_connections{state="active"} %d' % connections[1],
+            'thrift_connections{state="idle"} %d'
+            % (connections[0] - connections[1]),
+            "# HELP thrift_connections_accepted_total Connections accepted "
+            "by worker slot and listener.",
+            "# TYPE thrift_connections_accepted_total counter",
+        ]
+        for index, counts in sorted(accepted.items()):
+            for listener, count in zip(("shared", "reuseport"), counts):
+                lines.append('thrift_connections_accepted_total'
+                             '{slot="%d",listener="%s"} %d'
+                             % (index, listener, count))
+        lines += [
+            "# HELP thrift_requests_in_flight Calls being processed.",
+            "# TYPE thrift_requests_in_flight gauge",
+        ]
+        for name, (in_flight, histograms, _, _, _) in sorted(methods.items()):
+            if in_flight or histograms:
+                lines.append('thrift_requests_in_flight{method="%s"} %d'
+                             % (escape(name), in_flight))
+        lines.extend([
+            "# HELP thrift_cache_requests_total Calls of cached methods by "
+            "cache result.",
+            "# TYPE thrift_cache_requests_total counter",
+        ])
+        for name, (_, _, hits, misses, _) in sorted(methods.items()):
+            if hits or misses:
+                for result, count in (("hit", hits), ("miss", misses)):
+                    lines.append('thrift_cache_requests_total'
+                                 '{method="%s",result="%s"} %d'
+                                 % (escape(name), result, count))
+        lines.extend([
+            "# HELP thrift_coalesced_requests_total Calls answered with the "
+            "handler run of an identical concurrent call.",
+            "# TYPE thrift_coalesced_requests_total counter",
+        ])
+        for name, (_, _, _, _, coalesced) in sorted(methods.items()):
+            if coalesced:
+                lines.append('thrift_coalesced_requests_total{method="%s"} %d'
+                             % (escape(name), coalesced))
+        lines.extend([
+            "# HELP thrift_request_duration_seconds Call latency by method "
+            "and status.",
+            "# TYPE thrift_request_duration_seconds histogram",
+        ])
+        bounds = [(le, int(le * 1000000)) for le in PROMETHEUS_BUCKETS]
+        for name, (_, histograms, _, _, _) in sorted(methods.items()):
+            for status, histogram in sorted(histograms.items()):
+                labels = 'method="%s",status="%s"' % (escape(name), status)
+                cumulative = 0
+                b = 0
+                for le, limit in bounds:
+                    # hdr buckets straddling a bound count above it
+                    while b < BUCKETS and bucket_value(b) <= limit:
+                        cumulative += histogram.counts[b]
+                        b += 1
+                    lines.append(
+                        'thrift_request_duration_seconds_bucket{%s,le="%s"} %d'
+                        % (labels, le, cumulative))
+                lines.append(
+                    'thrift_request_duration_seconds_bucket{%s,le="+Inf"} %d'
+                    % (labels, histogram.count))
+                lines.append('thrift_request_duration_seconds_sum{%s} %s'
+                             % (labels, histogram.total / 1000000.0))
+                lines.append('thrift_request_duration_seconds_count{%s} %d'
+                             % (labels, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, address, log):
+        """serve /metrics on address from a thread of the arbiter."""
+        metrics = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                try:
+                    body = metrics.prometheus().encode("utf-8")
+                except Exception:
+                    log.exception("Failed to collect the thrift metrics")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("metrics: " + format, *args)
+
+        self.server = BaseHTTPServer.HTTPServer(address, Handler)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        log.info("Serving thrift metrics on http://%s:%s/metrics" % address)
+
+    def close_server(self):
+        """close the listener a worker inherited from the arbiter."""
+        if self.server is not None:
+            self.server.socket.close()
+            self.server = None
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class SharedStats(ThriftStats):
+
+    """ThriftStats writing to a slot of the shared metrics.
+
+    snapshot covers all the workers of the server.
+    """
+
+    def __init__(self, metrics, slot, names):
+        ThriftStats.__init__(self)
+        self.metrics = metrics
+        self.slot = slot
+        self.ints = slot.ints
+        # the rows left by earlier workers of the slot are used again
+        self.offsets = dict((name, SLOT_HEADER + (i + 1) * METHOD_SIZE)
+                            for i, name in enumerate(slot.names))
+        self.other = SLOT_HEADER
+        # the methods that may get a row, names sent by clients do not
+        self.methods = set(names)
+        self.status_offsets = dict((status, METHOD_HEADER + s * HIST_SIZE)
+                                   for s, status in enumerate(STATUSES))
+
+    def row(self, name):
+        """the offset of the row of name, called with the lock held."""
+        base = self.offsets.get(name)
+        if base is None:
+            base = self.other
+            if name in self.methods:
+                self.methods.discard(name)
+                base = self.slot.add_row(name) or self.other
+                self.offsets[name] = base
+        return base
+
+    def start(self, name):
+        ints = self.ints
+        with self.lock:
+            ints[SLOT_IN_FLIGHT] += 1
+            ints[self.row(name)] += 1
+
+    def finish(self, name, status, duration):
+        ints = self.ints
+        value = min(max(int(duration * 1000000), 0), MAX_VALUE)
+        with self.lock:
+            base = self.row(name)
+            hist = base + self.status_offsets[status]
+            ints[SLOT_IN_FLIGHT] -= 1
+            ints[base] -= 1
+            ints[hist + HIST_COUNT] += 1
+            ints[hist + HIST_TOTAL] += value
+            if value > ints[hist + HIST_MAX]:
+                ints[hist + HIST_MAX] = value
+            ints[hist + 3 + bucket_index(value)] += 1
+
+    def cache(self, name, hit):
+        with self.lock:
+            self.ints[self.row(name) + (METHOD_CACHE_HITS if hit
+                                        else METHOD_CACHE_MISSES)] += 1
+
+    def coalesce(self, name):
+        with self.lock:
+            self.ints[self.row(name) + METHOD_COALESCED] += 1
+
+    def open_connection(self, delta=1):
+        with self.lock:
+            self.ints[SLOT_CONNECTIONS] += delta
+
+    def activate_connection(self, delta=1):
+        with self.lock:
+            self.ints[SLOT_ACTIVE] += delta
+
+    def accept_connection(self, reuseport=False):
+        with self.lock:
+            self.ints[SLOT_ACCEPTED_REUSEPORT if reuseport
+                      else SLOT_ACCEPTED] += 1
+
+    def snapshot(self):
+        return self.metrics.snapshot()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -
+"""sample the stacks of a worker for a while and write them to a file.
+
+the profiler samples on SIGPROF, sent by an ITIMER_PROF timer rate times
+per second of CPU time the worker uses. The signal interrupts whatever
+greenlet is running, so a handler keeping a core busy without yielding is
+sampled too. Samples are grouped by the method of the call whose
+_process_message frame is on the stack, the others under OUTSIDE_CALLS.
+
+    collapsed  one "method;frame;frame count" line per stack, the input
+               of flamegraph.pl and speedscope
+    pstats     a file for pstats.Stats, methods appear as "{call name}"
+
+gevent workers start a profile of thrift_profile_seconds on SIGUSR2, and
+with thrift_stats_endpoint on calls to PROFILE_METHOD::
+
+    kill -USR2 <worker pid>
+    python -m gunicorn_thrift.profiler 127.0.0.1:9090 --seconds 5
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import json
+import marshal
+import os
+import signal
+import sys
+import time
+
+from thrift.Thrift import TType
+
+PROFILE_METHOD = "gunicorn_thrift:profile"
+
+OUTSIDE_CALLS = "(outside calls)"
+
+
+def frame_key(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, directory, rate=100, format="collapsed",
+                 call_code=None):
+        """call_code is the code of the frames running a call, with the
+        method name in their name local."""
+        self.directory = directory
+        self.interval = 1.0 / rate
+        self.format = format
+        self.call_code = call_code
+        self.running = False
+        self.deadline = 0
+        self.started = 0
+        # (method, (frame key, ...) from the root) -> samples
+        self.stacks = {}
+        self.path = None
+        self.error = None
+        # a profile finished since the last poll
+        self.finished = False
+
+    def start(self, seconds):
+        """sample for seconds, False when already running."""
+        if self.running:
+            return False
+        self.stacks = {}
+        self.path = self.error = None
+        self.started = time.time()
+        self.deadline = self.started + seconds
+        self.running = True
+        signal.signal(signal.SIGPROF, self.sample)
+        # samples do not interrupt system calls
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return True
+
+    def sample(self, signum, frame):
+        if not self.running:
+            return
+        if time.time() >= self.deadline:
+            self.stop()
+            return
+        method = OUTSIDE_CALLS
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            if code is self.call_code:
+                method = frame.f_locals.get("name", method)
+            stack.append(frame_key(code))
+            frame = frame.f_back
+        stack.reverse()
+        key = (method, tuple(stack))
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def poll(self):
+        """stop once past the deadline, samples only come while the
+        worker uses CPU. True when a profile finished since the last
+        poll."""
+        if self.running and time.time() >= self.deadline:
+            self.stop()
+        finished, self.finished = self.finished, False
+        return finished
+
+    def stop(self):
+        """stop sampling and write the profile, return its path."""
+        if not self.running:
+            return self.path
+        self.running = False
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        # may run in the signal handler, errors are kept for the summary
+        try:
+            self.path = self.write()
+        except EnvironmentError as ex:
+            self.error = str(ex)
+        self.finished = True
+        return self.path
+
+    def write(self):
+        if not self.stacks:
+            # pstats can not load an empty profile
+            return None
+        name = "gunicorn_thrift-%s-%s.%s" % (
+            os.getpid(), time.strftime("%Y%m%d-%H%M%S",
+                                       time.localtime(self.started)),
+            self.format)
+        path = os.path.join(self.directory, name)
+        if self.format == "pstats":
+            with open(path, "wb") as f:
+                marshal.dump(pstats_dict(self.stacks, self.interval), f)
+        else:
+            with open(path, "w") as f:
+                f.writelines(collapsed_lines(self.stacks))
+        return path
+
+    def summary(self):
+        return {
+            "pid": os.getpid(),
+            "path": self.path,
+            "samples": sum(self.stacks.values()),
+            "rate": 1 / self.interval,
+            "format": self.format,
+            "error": self.error,
+        }
+
+
+def collapsed_lines(stacks):
+    for (method, stack), count in sorted(stacks.items()):
+        frames = ["%s (%s:%d)" % (name, filename, line)
+                  for filename, line, name in stack]
+        yield "%s %d\n" % (";".join([method] + frames), count)
+
+
+def pstats_dict(stacks, interval):
+    """{function: (cc, nc, tt, ct, callers)} as cProfile dumps it, with a
+    call of each sample."""
+    stats = {}
+
+    def entry(func):
+        if func not in stats:
+            stats[func] = [0, 0, 0.0, 0.0, {}]
+        return stats[func]
+
+    for (method, stack), count in stacks.items():
+        spent = count * interval
+        stack = (("~", 0, "<call %s>" % method),) + stack
+        seen = set()
+        for i, func in enumerate(stack):
+            stat = entry(func)
+            if func not in seen:
+                # recursive frames count once
+                seen.add(func)
+                stat[0] += count
+                stat[1] += count
+                stat[3] += spent
+            if i:
+                leaf = i == len(stack) - 1
+                caller = stack[i - 1]
+                cc, nc, tt, ct = stat[4].get(caller, (0, 0, 0.0, 0.0))
+                stat[4][caller] = (cc + count, nc + count,
+                                   tt + (spent if leaf else 0), ct + spent)
+        entry(stack[-1])[2] += spent
+    return dict((func, tuple(stat)) for func, stat in stats.items())
+
+
+def write_profile_args(oprot, seconds):
+    oprot.writeStructBegin("profile_args")
+    if seconds:
+        oprot.writeFieldBegin("seconds", TType.DOUBLE, 1)
+        oprot.writeDouble(seconds)
+        oprot.writeFieldEnd()
+    oprot.writeFieldStop()
+    oprot.writeStructEnd()
+
+
+def read_profile_args(iprot):
+    """the seconds of a PROFILE_METHOD call, None when not set."""
+    seconds = None
+    iprot.readStructBegin()
+    while True:
+        (fname, ftype, fid) = iprot.readFieldBegin()
+        if ftype == TType.STOP:
+            break
+        if fid == 1 and ftype == TType.DOUBLE:
+            seconds = iprot.readDouble()
+        else:
+            iprot.skip(ftype)
+        iprot.readFieldEnd()
+    iprot.readStructEnd()
+    iprot.readMessageEnd()
+    return seconds
+
+
+def main():
+    from gunicorn_thrift.stats import call_admin
+
+    parser = argparse.ArgumentParser(
+        prog="python -m gunicorn_thrift.profiler",
+        description="profile the worker answering the call.")
+    parser.add_argument("address", help="HOST:PORT")
+    parser.add_argument("--seconds", type=float,
+                        help="default thrift_profile_seconds")
+    parser.add_argument("--framed", action="store_true")
+    args = parser.parse_args()
+    host, port = args.address.rsplit(":", 1)
+    summary = call_admin(host, port, PROFILE_METHOD,
+                         lambda oprot: write_profile_args(oprot, args.seconds),
+                         framed=args.framed)
+    sys.stdout.write(json.dumps(summary, indent=2, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
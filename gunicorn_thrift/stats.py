@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -
+"""per-method latency histograms kept by each worker.
+
+timings go into fixed log-linear buckets (as in HdrHistogram): values
+below 2 ** SUB_BITS microseconds get a bucket each, above that every power
+of two is split in 2 ** (SUB_BITS - 1) buckets, so a percentile is off by
+at most 1 / 2 ** (SUB_BITS - 1) of its value.
+
+with thrift_stats_endpoint set, workers answer STATS_METHOD with the JSON
+snapshot of their stats as a string, see fetch_stats::
+
+    python -m gunicorn_thrift.stats 127.0.0.1:9090
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import sys
+import threading
+
+from thrift.Thrift import TMessageType, TType
+
+# a multiplexed name, reachable with TMultiplexedProtocol(.., "gunicorn_thrift")
+# and an IDL of ``service gunicorn_thrift { string stats() }``
+STATS_METHOD = "gunicorn_thrift:stats"
+
+SUB_BITS = 5
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+# 2 ** 36us, about 19 hours
+MAX_VALUE = (1 << 36) - 1
+
+PERCENTILES = (("p50", 50.0), ("p99", 99.0), ("p999", 99.9))
+
+
+def bucket_index(value):
+    if value < SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return (shift << (SUB_BITS - 1)) + (value >> shift)
+
+
+def bucket_value(index):
+    """the highest value counted in bucket index."""
+    if index < SUB_COUNT:
+        return index
+    shift = (index >> (SUB_BITS - 1)) - 1
+    return (((index & (HALF_COUNT - 1)) + HALF_COUNT + 1) << shift) - 1
+
+
+BUCKETS = bucket_index(MAX_VALUE) + 1
+
+
+class LatencyHistogram(object):
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        """record a value in microseconds."""
+        value = min(max(int(value), 0), MAX_VALUE)
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        rank = max(int(self.count * percent / 100.0 + 0.5), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    def summary(self):
+        """count, mean, max and percentiles, in milliseconds."""
+        summary = {
+            "count": self.count,
+            "mean": self.count and self.total / 1000.0 / self.count,
+            "max": self.max / 1000.0,
+        }
+        for name, percent in PERCENTILES:
+            summary[name] = self.percentile(percent) / 1000.0
+        return summary
+
+
+class MethodStats(object):
+
+    def __init__(self):
+        self.in_flight = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.coalesced = 0
+        # status -> LatencyHistogram
+        self.histograms = {}
+
+    def summary(self):
+        summary = {
+            "in_flight": self.in_flight,
+            "errors": self.errors,
+            "statuses": dict((status, histogram.summary())
+                             for status, histogram in self.histograms.items()),
+        }
+        if self.cache_hits or self.cache_misses:
+            summary["cache"] = cache_summary(self.cache_hits,
+                                             self.cache_misses)
+        if self.coalesced:
+            summary["coalesced"] = self.coalesced
+        return summary
+
+
+def cache_summary(hits, misses):
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": float(hits) / (hits + misses),
+    }
+
+
+class ThriftStats(object):
+
+    """latencies, in-flight and error counts by method of one worker."""
+
+    # unknown method names come from the clients
+    MAX_METHODS = 1024
+    OTHER = "<other>"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.methods = {}
+        # open connections, and those processing a message
+        self.connections = 0
+        self.active_connections = 0
+        # connections accepted on the shared and per-worker listeners
+        self.accepted = {"shared": 0, "reuseport": 0}
+
+    def method(self, name):
+        stats = self.methods.get(name)
+        if stats is None:
+            if len(self.methods) >= self.MAX_METHODS:
+                return self.method(self.OTHER)
+            stats = self.methods[name] = MethodStats()
+        return stats
+
+    def start(self, name):
+        with self.lock:
+            self.in_flight += 1
+            self.method(name).in_flight += 1
+
+    def finish(self, name, status, duration):
+        """count a call started with start, duration in seconds."""
+        with self.lock:
+            self.in_flight -= 1
+            stats = self.method(name)
+            stats.in_flight -= 1
+            if status != "OK":
+                stats.errors += 1
+            histogram = stats.histograms.get(status)
+            if histogram is None:
+                histogram = stats.histograms[status] = LatencyHistogram()
+            histogram.record(duration * 1000000)
+
+    def cache(self, name, hit):
+        """count a call answered from the response cache, or not."""
+        with self.lock:
+            stats = self.method(name)
+            if hit:
+                stats.cache_hits += 1
+            else:
+                stats.cache_misses += 1
+
+    def coalesce(self, name):
+        """count a call sharing the handler run of an identical one."""
+        with self.lock:
+            self.method(name).coalesced += 1
+
+    def open_connection(self, delta=1):
+        """count connections opened, or closed with a negative delta."""
+        with self.lock:
+            self.connections += delta
+
+    def activate_connection(self, delta=1):
+        """count connections starting, or done with a negative delta,
+        processing messages."""
+        with self.lock:
+            self.active_connections += delta
+
+    def accept_connection(self, reuseport=False):
+        """count a connection accepted, on a listener of this worker alone
+        when reuseport."""
+        with self.lock:
+            self.accepted["reuseport" if reuseport else "shared"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "in_flight": self.in_flight,
+                "connections": {
+                    "active": self.active_connections,
+                    "idle": self.connections - self.active_connections,
+                    "accepted": dict(self.accepted),
+                },
+                "methods": dict((name, stats.summary())
+                                for name, stats in self.methods.items()),
+            }
+
+
+def write_stats(snapshot, seqid, oprot):
+    """reply to a STATS_METHOD call with the JSON encoded snapshot."""
+    write_json(STATS_METHOD, snapshot, seqid, oprot)
+
+
+def write_json(name, value, seqid, oprot):
+    """reply to an admin call with a JSON string."""
+    oprot.writeMessageBegin(name, TMessageType.REPLY, seqid)
+    oprot.writeStructBegin("stats_result")
+    oprot.writeFieldBegin("success", TType.STRING, 0)
+    oprot.writeString(json.dumps(value, sort_keys=True))
+    oprot.writeFieldEnd()
+    oprot.writeFieldStop()
+    oprot.writeStructEnd()
+    oprot.writeMessageEnd()
+    oprot.trans.flush()
+
+
+def fetch_stats(host, port, framed=False, timeout=None):
+    """call STATS_METHOD on a server using the binary protocol.
+
+    each call is answered by the worker that accepted the connection.
+    """
+    return call_admin(host, port, STATS_METHOD, framed=framed,
+                      timeout=timeout)
+
+
+def write_empty_args(oprot):
+    oprot.writeStructBegin("args")
+    oprot.writeFieldStop()
+    oprot.writeStructEnd()
+
+
+def call_admin(host, port, name, write_args=write_empty_args, framed=False,
+               timeout=None):
+    """call an admin method answering a JSON string, return its value."""
+    from thrift.Thrift import TApplicationException
+    from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+    from thrift.transport.TSocket import TSocket
+    from thrift.transport.TTransport import TBufferedTransport
+    from thrift.transport.TTransport import TFramedTransport
+
+    sock = TSocket(host, int(port))
+    if timeout:
+        sock.setTimeout(timeout * 1000)
+    trans = TFramedTransport(sock) if framed else TBufferedTransport(sock)
+    prot = TBinaryProtocol(trans)
+    trans.open()
+    try:
+        prot.writeMessageBegin(name, TMessageType.CALL, 0)
+        write_args(prot)
+        prot.writeMessageEnd()
+        trans.flush()
+
+        (_, type, seqid) = prot.readMessageBegin()
+        if type == TMessageType.EXCEPTION:
+            x = TApplicationException()
+            x.read(prot)
+            raise x
+        data = None
+        prot.readStructBegin()
+        while True:
+            (fname, ftype, fid) = prot.readFieldBegin()
+            if ftype == TType.STOP:
+                break
+            if fid == 0 and ftype == TType.STRING:
+                data = prot.readString()
+            else:
+                prot.skip(ftype)
+            prot.readFieldEnd()
+        prot.readStructEnd()
+        prot.readMessageEnd()
+    finally:
+        trans.close()
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.stderr.write(
+            "usage: python -m gunicorn_thrift.stats HOST:PORT [framed]\n")
+        sys.exit(1)
+    host, port = sys.argv[1].rsplit(":", 1)
+    stats = fetch_stats(host, port, framed="framed" in sys.argv[2:])
+    sys.stdout.write(json.dumps(stats, indent=2, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -
+"""statsd client aggregating metrics in process.
+
+counters are summed and timers sampled (at most max_samples per metric
+and interval, sent with their sample rate) until a background flusher
+packs them into as few datagrams as the mtu allows.
+"""
+
+import atexit
+import os
+import random
+import socket
+import threading
+import time
+
+
+class StatsdClient(object):
+
+    def __init__(self, host, port, interval=1.0, mtu=1432, max_samples=100):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect((host, int(port)))
+        self.interval = interval
+        self.mtu = mtu
+        self.max_samples = max_samples
+        self.counters = {}
+        # name -> [count, samples]
+        self.timers = {}
+        # calls record from pool threads while the flusher swaps the dicts
+        self.lock = threading.Lock()
+        self._pid = None
+
+    def increment(self, name, value=1):
+        self._start()
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timing(self, name, value):
+        self._start()
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, []]
+            timer[0] += 1
+            samples = timer[1]
+            if len(samples) < self.max_samples:
+                samples.append(value)
+                return
+            # reservoir sampling keeps an even sample of the interval
+            i = random.randint(0, timer[0] - 1)
+            if i < self.max_samples:
+                samples[i] = value
+
+    def _start(self):
+        # the flusher belongs to the process recording the metrics, loggers
+        # are created in the arbiter before the workers fork.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.counters = {}
+        self.timers = {}
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        t.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def lines(self):
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            timers, self.timers = self.timers, {}
+        for name, value in counters.items():
+            yield "%s:%s|c" % (name, value)
+        for name, (count, samples) in timers.items():
+            if len(samples) < count:
+                fmt = "%s:%%g|ms|@%.4g" % (name, float(len(samples)) / count)
+            else:
+                fmt = "%s:%%g|ms" % name
+            for value in samples:
+                yield fmt % value
+
+    def flush(self):
+        packet = []
+        size = 0
+        for line in self.lines():
+            if packet and size + len(line) + 1 > self.mtu:
+                self.send("\n".join(packet))
+                packet = []
+                size = 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self.send("\n".join(packet))
+
+    def send(self, data):
+        try:
+            self.sock.send(data.encode("utf-8"))
+        except Exception:
+            pass
@@ -1,14 +1,162 @@
 # coding:utf8
+import copy
 import sys
 
+from thrift.Thrift import TType
 from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.protocol.TBinaryProtocol import TBinaryProtocolAccelerated
+from thrift.protocol.TCompactProtocol import TCompactProtocol, reader
+from thrift.protocol.TProtocol import TProtocolException
+from thrift.transport.TTransport import CReadableTransport
 
+try:
+    from thrift.protocol import fastbinary
+except ImportError:
+    fastbinary = None
 
-class TBinaryProtocolExt(TBinaryProtocol):
+# bytes read at once when skipping over data
+SKIP_CHUNK = 65536
+
+
+class SizeLimitExceeded(TProtocolException):
+
+    """a size read from the wire over its limit, or negative.
+
+    pending is the number of bytes of the value still unread on the
+    transport when they can be skipped, None otherwise.
+    """
+
+    def __init__(self, message, pending=None,
+                 type=TProtocolException.SIZE_LIMIT):
+        TProtocolException.__init__(self, type, message)
+        self.pending = pending
+
+
+def convert_strings(value, string_type, convert):
+    """value with convert applied to its strings of string_type, in
+    containers and the fields of thrift structs too. Structs are copied."""
+    if isinstance(value, string_type):
+        return convert(value)
+    if isinstance(value, (list, tuple)):
+        return [convert_strings(v, string_type, convert) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return value.__class__(convert_strings(v, string_type, convert)
+                               for v in value)
+    if isinstance(value, dict):
+        return dict((convert_strings(k, string_type, convert),
+                     convert_strings(v, string_type, convert))
+                    for k, v in value.items())
+    spec = getattr(value, "thrift_spec", None)
+    if spec is None:
+        return value
+    struct = copy.copy(value)
+    for field in spec:
+        if field and getattr(value, field[2], None) is not None:
+            setattr(struct, field[2], convert_strings(
+                getattr(value, field[2]), string_type, convert))
+    return struct
+
+
+def decode_strings(value):
+    """value with its utf8 str decoded to unicode, python 2 only."""
+    return convert_strings(value, str, lambda s: s.decode("utf8"))
+
+
+def encode_strings(value):
+    """value with its unicode encoded to utf8 str, python 2 only."""
+    return convert_strings(value, unicode, lambda s: s.encode("utf8"))
+
+
+def skip_bytes(trans, size):
+    """read past size bytes of trans, SKIP_CHUNK at most at a time."""
+    while size > 0:
+        data = trans.read(min(size, SKIP_CHUNK))
+        if not data:
+            raise EOFError()
+        size -= len(data)
+
+
+class SizeLimits:
+
+    """check the sizes a protocol reads before it allocates them.
+
+    strings and containers over string_limit and container_limit are
+    refused. message_limit bounds what the strings and containers of one
+    message add up to, containers counting a byte for each element. 0 does
+    not limit.
+    """
+
+    string_limit = container_limit = message_limit = 0
+    message_left = 0
+
+    def set_limits(self, string_limit=0, container_limit=0, message_limit=0):
+        self.string_limit = string_limit
+        self.container_limit = container_limit
+        self.message_limit = self.message_left = message_limit
+
+    def check_size(self, size, limit, what, cost=None):
+        if size < 0:
+            raise SizeLimitExceeded(
+                "Negative %s size: %d" % (what, size),
+                type=TProtocolException.NEGATIVE_SIZE)
+        if limit and size > limit:
+            raise SizeLimitExceeded("%s size %d over the limit of %d"
+                                    % (what.capitalize(), size, limit))
+        if self.message_limit:
+            self.message_left -= size if cost is None else cost
+            if self.message_left < 0:
+                raise SizeLimitExceeded("Message over the limit of %d bytes"
+                                        % self.message_limit)
+
+    def check_string(self, size):
+        self.check_size(size, self.string_limit, "string")
+
+    def check_list(self, size):
+        self.check_size(size, self.container_limit, "list")
+
+    def check_set(self, size):
+        self.check_size(size, self.container_limit, "set")
+
+    def check_map(self, size):
+        self.check_size(size, self.container_limit, "map", 2 * size)
+
+    def skip_string(self, size):
+        """skip a string without allocating it, only message_limit
+        applies."""
+        self.check_size(size, 0, "string")
+        skip_bytes(self.trans, size)
+
+
+class TBinaryProtocolExt(SizeLimits, TBinaryProtocol):
 
     """encode unicode to utf8 in python2.x,before send.
     """
 
+    def readMessageBegin(self):
+        self.message_left = self.message_limit
+        return TBinaryProtocol.readMessageBegin(self)
+
+    def readListBegin(self):
+        (etype, size) = TBinaryProtocol.readListBegin(self)
+        self.check_list(size)
+        return (etype, size)
+
+    def readSetBegin(self):
+        (etype, size) = TBinaryProtocol.readSetBegin(self)
+        self.check_set(size)
+        return (etype, size)
+
+    def readMapBegin(self):
+        (ktype, vtype, size) = TBinaryProtocol.readMapBegin(self)
+        self.check_map(size)
+        return (ktype, vtype, size)
+
+    def skip(self, ttype):
+        if ttype == TType.STRING:
+            self.skip_string(self.readI32())
+        else:
+            TBinaryProtocol.skip(self, ttype)
+
     def writeString(self, msg):
         if sys.version_info[0] >= 3 and not isinstance(msg, bytes):
             msg = msg.encode('utf-8')
@@ -19,13 +167,75 @@ class TBinaryProtocolExt(TBinaryProtocol):
 
     def readString(self):
         len = self.readI32()
+        self.check_string(len)
         s = self.trans.readAll(len)
         if sys.version_info[0] == 2 and isinstance(s, str):
             s = unicode(s, "utf8")
+        elif sys.version_info[0] >= 3:
+            s = s.decode("utf-8")
         return s
 
 
-class TBinaryProtocolFactoryExt(object):
+class TCompactProtocolExt(SizeLimits, TCompactProtocol):
+
+    def _readSize(self):
+        return self._TCompactProtocol__readSize()
+
+    def readMessageBegin(self):
+        self.message_left = self.message_limit
+        return TCompactProtocol.readMessageBegin(self)
+
+    def readCollectionBegin(self):
+        (etype, size) = TCompactProtocol.readCollectionBegin(self)
+        self.check_list(size)
+        return (etype, size)
+    readSetBegin = readCollectionBegin
+    readListBegin = readCollectionBegin
+
+    def readMapBegin(self):
+        (ktype, vtype, size) = TCompactProtocol.readMapBegin(self)
+        self.check_map(size)
+        return (ktype, vtype, size)
+
+    def _readString(self):
+        size = self._readSize()
+        self.check_string(size)
+        return self.trans.readAll(size)
+    readString = reader(_readString)
+
+    def _skipString(self):
+        self.skip_string(self._readSize())
+    _skipString = reader(_skipString)
+
+    def skip(self, ttype):
+        if ttype == TType.STRING:
+            self._skipString()
+        else:
+            TCompactProtocol.skip(self, ttype)
+
+
+class TLimitedProtocolFactory(object):
+
+    limits = (0, 0, 0)
+
+    def set_limits(self, string_limit=0, container_limit=0, message_limit=0):
+        """the limits of the protocols created from now on, see
+        SizeLimits."""
+        self.limits = (string_limit, container_limit, message_limit)
+
+    def limit(self, prot):
+        if self.limits != (0, 0, 0):
+            prot.set_limits(*self.limits)
+        return prot
+
+
+class TCompactProtocolFactoryExt(TLimitedProtocolFactory):
+
+    def getProtocol(self, trans):
+        return self.limit(TCompactProtocolExt(trans))
+
+
+class TBinaryProtocolFactoryExt(TLimitedProtocolFactory):
 
     def __init__(self, strictRead=False, strictWrite=True):
         self.strictRead = strictRead
@@ -33,4 +243,35 @@ class TBinaryProtocolFactoryExt(object):
 
     def getProtocol(self, trans):
         prot = TBinaryProtocolExt(trans, self.strictRead, self.strictWrite)
-        return prot
+        return self.limit(prot)
+
+
+class TBinaryProtocolAcceleratedFactoryExt(TBinaryProtocolFactoryExt):
+
+    """hand whole structs to fastbinary when it can be used.
+
+    generated code only takes the C path for an exact
+    TBinaryProtocolAccelerated over a CReadableTransport, so fall back to
+    TBinaryProtocolExt when fastbinary is missing or the transport can not
+    be read from C.
+
+    fastbinary reads strings as utf8 str and only encodes str on python 2,
+    the workers wrap the handlers of its processors in a Utf8Handler so
+    they get and return unicode as with TBinaryProtocolExt.
+
+    fastbinary can not check string and container sizes, with their limits
+    set the protocols are TBinaryProtocolExt too. message_limit alone is
+    left to the transports, see TSocketTransportExt.max_read.
+    """
+
+    def accelerated(self):
+        """whether its protocols may read and write with fastbinary."""
+        return fastbinary is not None and \
+            not self.limits[0] and not self.limits[1]
+
+    def getProtocol(self, trans):
+        if not self.accelerated() or \
+                not isinstance(trans, CReadableTransport):
+            return TBinaryProtocolFactoryExt.getProtocol(self, trans)
+        return TBinaryProtocolAccelerated(
+            trans, self.strictRead, self.strictWrite)
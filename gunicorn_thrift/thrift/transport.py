@@ -0,0 +1,157 @@
+# coding:utf8
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
+from thrift.transport.TTransport import TTransportBase, CReadableTransport
+from thrift.transport.TTransport import TTransportException
+
+from gunicorn_thrift.thrift.protocol import SizeLimitExceeded
+
+
+class TSocketTransportExt(TTransportBase, CReadableTransport):
+
+    """buffered transport over a connected socket.
+
+    reads are served as slices of one reusable bytearray filled with
+    recv_into, writes are joined and sent with a single sendall on flush.
+    A readAll of more than max_read bytes raises SizeLimitExceeded before
+    allocating them, these are whole frames and the strings fastbinary
+    reads.
+    """
+
+    DEFAULT_BUFFER = 8192
+    # 0 does not limit
+    max_read = 0
+
+    def __init__(self, sock, rbuf_size=DEFAULT_BUFFER):
+        self.sock = sock
+        self._rbuf = bytearray(rbuf_size)
+        self._rview = memoryview(self._rbuf)
+        self._rpos = 0
+        self._rend = 0
+        # set while fastbinary is reading from a cStringIO copy
+        self._cbuf = None
+        self._wbuf = []
+
+    def isOpen(self):
+        return self.sock is not None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def pending(self):
+        """return True if read-ahead data is waiting in the buffers."""
+        if self._cbuf is not None and \
+                self._cbuf.tell() < len(self._cbuf.getvalue()):
+            return True
+        return self._rpos < self._rend
+
+    def _recv_into(self, view):
+        n = self.sock.recv_into(view)
+        if not n:
+            raise TTransportException(
+                TTransportException.END_OF_FILE, "TSocket read 0 bytes")
+        return n
+
+    def _fill(self):
+        self._rend = self._recv_into(self._rview)
+        self._rpos = 0
+
+    def read(self, sz):
+        if self._cbuf is not None:
+            data = self._cbuf.read(sz)
+            if data:
+                return data
+            self._cbuf = None
+        if self._rpos == self._rend:
+            self._fill()
+        end = min(self._rend, self._rpos + sz)
+        data = self._rview[self._rpos:end].tobytes()
+        self._rpos = end
+        return data
+
+    def readAll(self, sz):
+        if self.max_read and sz > self.max_read:
+            raise SizeLimitExceeded("Read of %d bytes over the limit of %d"
+                                    % (sz, self.max_read), pending=sz)
+        if self._cbuf is None and self._rend - self._rpos >= sz:
+            end = self._rpos + sz
+            data = self._rview[self._rpos:end].tobytes()
+            self._rpos = end
+            return data
+
+        buf = bytearray(sz)
+        view = memoryview(buf)
+        got = 0
+        while got < sz:
+            if self._cbuf is not None:
+                chunk = self.read(sz - got)
+                view[got:got + len(chunk)] = chunk
+                got += len(chunk)
+            elif self._rpos < self._rend:
+                n = min(self._rend - self._rpos, sz - got)
+                view[got:got + n] = self._rview[self._rpos:self._rpos + n]
+                self._rpos += n
+                got += n
+            elif sz - got >= len(self._rbuf):
+                # large payloads skip the read buffer
+                got += self._recv_into(view[got:])
+            else:
+                self._fill()
+        return bytes(buf)
+
+    def write(self, buf):
+        self._wbuf.append(buf)
+
+    def flush(self):
+        if not self._wbuf:
+            return
+        if len(self._wbuf) == 1:
+            out = self._wbuf[0]
+        else:
+            out = b"".join(self._wbuf)
+        self._wbuf = []
+        self.sock.sendall(out)
+
+    # Implement the CReadableTransport interface.
+    @property
+    def cstringio_buf(self):
+        if self._cbuf is None:
+            self._cbuf = StringIO(
+                self._rview[self._rpos:self._rend].tobytes())
+            self._rpos = self._rend
+        return self._cbuf
+
+    def cstringio_refill(self, partialread, reqlen):
+        self._cbuf = None
+        data = partialread + self.readAll(max(reqlen - len(partialread), 0))
+        self._cbuf = StringIO(
+            data + self._rview[self._rpos:self._rend].tobytes())
+        self._rpos = self._rend
+        return self._cbuf
+
+
+class TCaptureTransport(TTransportBase):
+
+    """record the bytes read through another transport."""
+
+    def __init__(self, trans):
+        self.trans = trans
+        self._buf = []
+
+    def read(self, sz):
+        data = self.trans.read(sz)
+        self._buf.append(data)
+        return data
+
+    def readAll(self, sz):
+        data = self.trans.readAll(sz)
+        self._buf.append(data)
+        return data
+
+    def getvalue(self):
+        return b"".join(self._buf)
@@ -25,21 +25,36 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import atexit
 import traceback
 import os
 import sys
 import logging
-import socket
+import time
+
+from collections import deque
 
 from logging.config import fileConfig
 
 from gunicorn import util
 from gunicorn.glogging import Logger, CONFIG_DEFAULTS
 
+from gunicorn_thrift.statsd import StatsdClient
+
+try:
+    from gevent.monkey import get_original
+except ImportError:
+    def get_original(module, name):
+        return getattr(__import__(module), name)
+
+THREAD_MODULE = "thread" if sys.version_info[0] == 2 else "_thread"
+
 THRIFT_STATUS_CODE = {
     "TIMEOUT": 504,
     "SERVER_ERROR": 500,
     "FUNC_NOT_FOUND": 404,
+    "OVERLOADED": 503,
+    "TOO_LARGE": 413,
     "OK": 200,
 }
 
@@ -53,17 +68,45 @@ class ThriftLogger(Logger):
 
     """ThriftLogger class,log access info."""
 
+    # bounds the key cache, unknown method names come from the clients
+    MAX_STATSD_KEYS = 1024
+    # seconds between two writes of the buffered access log
+    ACCESS_LOG_INTERVAL = 0.1
+
     def __init__(self, cfg):
+        self.slow_log = logging.getLogger("gunicorn_thrift.slow")
+        self.slow_log.propagate = False
         Logger.__init__(self, cfg)
+        self._now = (None, None)
+        self.access_buffer = None
+        self.access_dropped = 0
+        self._access_dropped_reported = 0
+        self._access_dropped_ts = 0
+        self._access_writer_pid = None
+        size = getattr(cfg, "thrift_access_log_buffer", 0)
+        if size:
+            self.access_buffer = deque(maxlen=size)
+            self.access_drop_old = \
+                getattr(cfg, "thrift_access_log_overflow", None) == "drop_old"
         self.is_statsd = False
-        statsd_server = os.environ.get("statsd")
+        self.statsd = None
+        self.statsd_keys = {}
+        statsd_server = getattr(cfg, "thrift_statsd_host", None)
+        if statsd_server is None and os.environ.get("statsd"):
+            try:
+                host, port = os.environ["statsd"].split(":")
+                statsd_server = (host, int(port))
+            except ValueError:
+                statsd_server = None
         if statsd_server:
             try:
-                host, port = statsd_server.split(":")
-                self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                self.sock.connect((host, int(port)))
+                self.statsd = StatsdClient(
+                    statsd_server[0], statsd_server[1],
+                    interval=getattr(cfg, "thrift_statsd_interval", 1.0),
+                    mtu=getattr(cfg, "thrift_statsd_mtu", 1432),
+                    max_samples=getattr(cfg, "thrift_statsd_max_samples", 100))
             except Exception:
-                self.sock = None
+                self.statsd = None
             else:
                 self.is_statsd = True
 
@@ -83,6 +126,14 @@ class ThriftLogger(Logger):
                 self.access_log, cfg.accesslog,
                 logging.Formatter(self.access_fmt), "access")
 
+        # set gunicorn_thrift.slow handler
+        slow_log = getattr(cfg, "thrift_slow_log", None)
+        if slow_log is not None:
+            self.slow_log.setLevel(logging.INFO)
+            self._set_handler(
+                self.slow_log, slow_log,
+                logging.Formatter(self.access_fmt), "error")
+
         # set syslog handler
         if cfg.syslog:
             self._set_syslog_handler(
@@ -121,10 +172,22 @@ class ThriftLogger(Logger):
             h._gunicorn = True
             log.addHandler(h)
 
-    def atoms(self, address, func_name, status, finish):
+    def now(self, timestamp=None):
+        """ return date in Apache Common Log Format, formatted once a second
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        second = int(timestamp)
+        cached = self._now
+        if cached[0] != second:
+            cached = self._now = (second, time.strftime(
+                '[%d/%b/%Y:%H:%M:%S %z]', time.localtime(second)))
+        return cached[1]
+
+    def atoms(self, address, func_name, status, finish, timestamp=None):
         atoms = {
             'h': address[0],
-            't': self.now(),
+            't': self.now(timestamp),
             'n': func_name,
             's': THRIFT_STATUS_CODE[status],
             'T': finish * 1000,
@@ -133,32 +196,114 @@ class ThriftLogger(Logger):
         return atoms
 
     def access(self, address, func_name, status, finish):
+        if self.is_statsd:
+            self.statsd_access(func_name, status, finish)
         # logger_config_from_dict is used for on_staring-hook load logging-config from dict.
         if not self.cfg.accesslog and not self.cfg.logconfig and not getattr(self, "logger_config_from_dict", None):
             return
-        atoms = self.atoms(address, func_name, status, finish)
+        record = (address, func_name, status, finish, time.time())
+        buf = self.access_buffer
+        if buf is None:
+            self.write_access((record,))
+            return
+        self._start_access_writer()
+        if len(buf) == buf.maxlen:
+            # with drop_old the deque pushes out its oldest record itself
+            self.access_dropped += 1
+            if not self.access_drop_old:
+                return
+        buf.append(record)
+
+    def slow(self, address, func_name, finish, phases, stack=None):
+        """log a call slower than thrift_slow_threshold.
+
+        phases is [(phase, seconds)], stack (seconds, formatted stack) of
+        the handler at the threshold.
+        """
+        lines = ["%s %s %s %.3f %s <%s>" % (
+            address[0], self.now(), func_name, finish * 1000,
+            " ".join("%s=%.3f" % (phase, seconds * 1000)
+                     for phase, seconds in phases),
+            os.getpid())]
+        if stack is not None:
+            lines.append("  stack at %.3f:" % (stack[0] * 1000))
+            lines.append(stack[1].rstrip("\n"))
+        else:
+            lines.append("  no stack, the hub did not run between the "
+                         "threshold and the end of the call")
+        self.slow_log.info("\n".join(lines))
+
+    def write_access(self, records):
         access_log_format = "%(h)s %(t)s %(n)s %(s)s %(T)s %(p)s"
+        for record in records:
+            try:
+                self.access_log.info(access_log_format % self.atoms(*record))
+            except:
+                self.error(traceback.format_exc())
+
+    def _start_access_writer(self):
+        # like the statsd flusher the writer belongs to the worker process.
+        # It runs on an OS thread even once gevent patched threading, so a
+        # stalled disk does not block the hub.
+        if self._access_writer_pid == os.getpid():
+            return
+        self._access_writer_pid = os.getpid()
+        self.access_buffer.clear()
+        start_new_thread = get_original(THREAD_MODULE, "start_new_thread")
+        start_new_thread(self._run_access_writer,
+                         (get_original("time", "sleep"),))
+        atexit.register(self.flush_access)
+
+    def _run_access_writer(self, sleep):
+        while True:
+            sleep(self.ACCESS_LOG_INTERVAL)
+            self.flush_access()
+
+    def flush_access(self):
+        """write the buffered access records out."""
+        buf = self.access_buffer
+        records = []
         try:
-            self.access_log.info(access_log_format % atoms)
+            while buf:
+                records.append(buf.popleft())
+        except IndexError:
+            pass
+        self.write_access(records)
+
+        # report drops at most once a second
+        dropped = self.access_dropped - self._access_dropped_reported
+        if dropped and time.time() - self._access_dropped_ts >= 1:
+            self._access_dropped_ts = time.time()
+            self._access_dropped_reported += dropped
+            self.warning("Access log buffer full, %s lines dropped", dropped)
             if self.is_statsd:
                 project_name = self.cfg.proc_name.split(":")[0]
-                statsd_key_base = "thrift.{0}.{1}".format(project_name, func_name)
-                self.increment("{0}.{1}".format(statsd_key_base, atoms["s"]), 1)
-                self.histogram(statsd_key_base, atoms["T"])
+                self.statsd.increment(
+                    "thrift.{0}.access_log.dropped".format(project_name),
+                    dropped)
+
+    def statsd_access(self, func_name, status, finish):
+        keys = self.statsd_keys.get(func_name)
+        if keys is None:
+            project_name = self.cfg.proc_name.split(":")[0]
+            statsd_key_base = "thrift.{0}.{1}".format(project_name, func_name)
+            keys = (statsd_key_base, dict(
+                (name, "{0}.{1}".format(statsd_key_base, code))
+                for name, code in THRIFT_STATUS_CODE.items()))
+            if len(self.statsd_keys) < self.MAX_STATSD_KEYS:
+                self.statsd_keys[func_name] = keys
+        try:
+            self.statsd.increment(keys[1][status], 1)
+            self.statsd.timing(keys[0], finish * 1000)
         except:
             self.error(traceback.format_exc())
 
     def increment(self, name, value, sampling_rate=1.0):
-        try:
-            if self.sock:
-                self.sock.send(
-                    "{0}:{1}|c|@{2}".format(name, value, sampling_rate))
-        except Exception:
-            pass
+        if self.statsd:
+            if sampling_rate != 1.0:
+                value = value / float(sampling_rate)
+            self.statsd.increment(name, value)
 
     def histogram(self, name, value):
-        try:
-            if self.sock:
-                self.sock.send("{0}:{1}|ms".format(name, value))
-        except Exception:
-            pass
+        if self.statsd:
+            self.statsd.timing(name, value)
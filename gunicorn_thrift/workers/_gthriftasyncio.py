@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -
+"""asyncio worker, handler methods may be coroutines.
+
+the generated processors call their handler synchronously, so each method
+is driven by an AsyncProcess built from the generated <method>_args and
+<method>_result structs instead.
+"""
+
+import asyncio
+import inspect
+import os
+import sys
+import time
+import traceback
+
+from gunicorn.workers import base
+
+from thrift.Thrift import TMessageType, TType
+from thrift.transport.TTransport import TMemoryBuffer, TTransportException
+from thrift.transport.TTransport import TFramedTransportFactory
+from thrift.transport.TTransport import TTransportBase
+
+from gunicorn_thrift.thrift.protocol import SKIP_CHUNK, SizeLimitExceeded
+from gunicorn_thrift.thrift.transport import TCaptureTransport
+from gunicorn_thrift.workers.base import ThriftFuncNotFound, ThriftWorkerMixin
+
+# unframed messages past this many bytes are read through a TStreamTransport
+STREAM_AFTER = 65536
+# bytes of an oversized frame read for its message header
+FRAME_HEAD = 1024
+
+
+class TStreamTransport(TTransportBase):
+
+    """blocking reads of an asyncio StreamReader, from an executor thread.
+
+    the bytes already buffered are read first. More than limit bytes read
+    raise SizeLimitExceeded, 0 does not limit.
+    """
+
+    def __init__(self, reader, loop, data=b"", limit=0):
+        self.reader = reader
+        self.loop = loop
+        self.data = data
+        self.pos = 0
+        self.limit = limit
+        self.total = len(data)
+
+    def _fill(self):
+        self.data = asyncio.run_coroutine_threadsafe(
+            self.reader.read(STREAM_AFTER), self.loop).result()
+        self.pos = 0
+        if not self.data:
+            raise EOFError()
+        self.total += len(self.data)
+
+    def read(self, sz):
+        if self.pos == len(self.data):
+            self._fill()
+        end = min(len(self.data), self.pos + sz)
+        if self.limit and self.total - len(self.data) + end > self.limit:
+            raise SizeLimitExceeded("Message over the limit of %d bytes"
+                                    % self.limit)
+        data = self.data[self.pos:end]
+        self.pos = end
+        return data
+
+    def readAll(self, sz):
+        chunks = []
+        while sz > 0:
+            chunk = self.read(sz)
+            chunks.append(chunk)
+            sz -= len(chunk)
+        return b"".join(chunks)
+
+    def rest(self):
+        """the bytes read from the StreamReader past the last read."""
+        return self.data[self.pos:]
+
+
+class AsyncProcess(object):
+
+    """the generated process_<method> function, awaiting the handler."""
+
+    def __init__(self, processor, name):
+        module = sys.modules[processor.__class__.__module__]
+        self.name = name
+        self.handler = getattr(processor._handler, name)
+        self.args_cls = getattr(module, name + "_args")
+        self.arg_names = [spec[2] for spec in self.args_cls.thrift_spec
+                          if spec]
+        # oneway methods have no result struct and send no reply
+        self.result_cls = getattr(module, name + "_result", None)
+        self.exceptions = []
+        if self.result_cls is not None:
+            self.exceptions = [(spec[3][0], spec[2])
+                               for spec in self.result_cls.thrift_spec
+                               if spec and spec[0] != 0]
+
+    async def __call__(self, seqid, iprot, oprot):
+        await self.call(seqid, self.read_args(iprot), oprot)
+
+    def read_args(self, iprot):
+        args = self.args_cls()
+        args.read(iprot)
+        iprot.readMessageEnd()
+        return args
+
+    async def call(self, seqid, args, oprot):
+        try:
+            value = self.handler(
+                **dict((name, getattr(args, name)) for name in self.arg_names))
+            if inspect.isawaitable(value):
+                value = await value
+        except Exception as ex:
+            for cls, field in self.exceptions:
+                if isinstance(ex, cls):
+                    result = self.result_cls()
+                    setattr(result, field, ex)
+                    break
+            else:
+                raise
+        else:
+            if self.result_cls is None:
+                return
+            result = self.result_cls()
+            result.success = value
+        oprot.writeMessageBegin(self.name, TMessageType.REPLY, seqid)
+        result.write(oprot)
+        oprot.writeMessageEnd()
+        oprot.trans.flush()
+
+
+class ThriftAsyncioWorker(base.Worker, ThriftWorkerMixin):
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+
+        self.servers = []
+        # writer -> True while a message is being processed
+        self.connections = {}
+
+    def init_process(self):
+        # create new event_loop after fork
+        asyncio.get_event_loop().close()
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        super().init_process()
+
+    def build_dispatch(self, app):
+        return dict((message, AsyncProcess(processor, name))
+                    for message, name, processor, func
+                    in self.iter_process_map(app))
+
+    async def process_stats(self, seqid, iprot, oprot):
+        ThriftWorkerMixin.process_stats(self, seqid, iprot, oprot)
+
+    def run(self):
+        self.init_thrift()
+        self.framed = isinstance(self.tfactory, TFramedTransportFactory)
+
+        try:
+            self.loop.run_until_complete(self._run())
+        finally:
+            self.loop.close()
+
+    async def _run(self):
+        for sock in self.sockets:
+            self.servers.append(
+                await asyncio.start_server(self.handle, sock=sock.sock))
+
+        try:
+            while self.alive:
+                self.notify()
+                if self.ppid != os.getppid():
+                    self.log.info("Parent changed, shutting down: %s", self)
+                    break
+                await asyncio.sleep(0.1)
+        except KeyboardInterrupt:
+            pass
+
+        # Stop accepting requests
+        self.alive = False
+        for server in self.servers:
+            server.close()
+
+        # idle connections are closed now, busy ones after their current
+        # message, until graceful_timeout
+        ts = time.time()
+        while self.connections and \
+                time.time() - ts <= self.cfg.graceful_timeout:
+            for writer, busy in list(self.connections.items()):
+                if not busy:
+                    writer.close()
+            self.notify()
+            await asyncio.sleep(0.1)
+
+        if self.connections:
+            self.log.warning("Worker graceful timeout (pid:%s)" % self.pid)
+            for writer in list(self.connections):
+                writer.close()
+
+    async def handle(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        self.connections[writer] = False
+        self.stats.open_connection()
+        buf = bytearray()
+        idle_timeout = self.cfg.thrift_idle_timeout or None
+        max_requests = self.cfg.thrift_max_requests_per_connection
+        requests = 0
+        try:
+            while self.alive:
+                # idle until the first bytes of the next message only
+                if not buf:
+                    try:
+                        data = await asyncio.wait_for(
+                            reader.read(1 if self.framed else STREAM_AFTER),
+                            idle_timeout)
+                    except asyncio.TimeoutError:
+                        self.log.debug("Closing idle connection from %s",
+                                       addr)
+                        break
+                    if not data:
+                        break
+                    buf.extend(data)
+                received = await self.read_message(addr, reader, writer, buf)
+                if received is None:
+                    break
+                message, call = received
+                if message is None:
+                    # an oversized frame, answered already
+                    continue
+                self.connections[writer] = True
+                self.stats.activate_connection()
+                try:
+                    ok = await self._process_message(addr, message, writer,
+                                                     call)
+                finally:
+                    self.stats.activate_connection(-1)
+                requests += 1
+                if not ok or requests == max_requests:
+                    break
+                self.connections[writer] = False
+        except Exception:
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            self.stats.open_connection(-1)
+            writer.close()
+
+    async def read_message(self, addr, reader, writer, buf):
+        """return the next message and its call as read by read_call (None
+        when not decoded yet), starting with the bytes in buf.
+
+        the message is None for a frame over thrift_max_message_size that
+        was skipped and answered. None at the end of the stream or after
+        answering a message over the limit that can not be skipped.
+        """
+        limit = self.message_limit
+        if self.framed:
+            try:
+                head = bytes(buf) + await reader.readexactly(4 - len(buf))
+                del buf[:]
+                size = int.from_bytes(head, "big")
+                if not limit or size <= limit:
+                    return await reader.readexactly(size), None
+                if not await self.skip_frame(addr, reader, writer, size):
+                    return None
+                return None, None
+            except asyncio.IncompleteReadError:
+                return None
+
+        # small messages are parsed from buf again after each read
+        while len(buf) < STREAM_AFTER:
+            try:
+                parsed = self.parse_message(bytes(buf)) if buf else None
+            except SizeLimitExceeded as ex:
+                self.write_too_large(addr, bytes(buf), writer, ex)
+                return None
+            if parsed is not None:
+                size, call = parsed
+                message = bytes(buf[:size])
+                del buf[:size]
+                return message, call
+            if limit and len(buf) > limit:
+                self.write_too_large(
+                    addr, bytes(buf), writer,
+                    SizeLimitExceeded("Message over the limit of %d bytes"
+                                      % limit))
+                return None
+            data = await reader.read(STREAM_AFTER)
+            if not data:
+                return None
+            buf.extend(data)
+
+        # larger ones are read once, through a transport over the reader
+        trans = TStreamTransport(reader, self.loop, bytes(buf), limit)
+        del buf[:]
+        capture = TCaptureTransport(trans)
+        try:
+            call = await self.loop.run_in_executor(
+                None, self.read_call, self.pfactory.getProtocol(capture))
+        except SizeLimitExceeded as ex:
+            self.write_too_large(addr, capture.getvalue(), writer, ex)
+            return None
+        except (EOFError, TTransportException):
+            return None
+        buf.extend(trans.rest())
+        return capture.getvalue(), call
+
+    def read_call(self, iprot):
+        """read past a message, return its header and the arguments read
+        by its AsyncProcess, None when another process reads them."""
+        header = iprot.readMessageBegin()
+        process = self.dispatch.get(header[0])
+        if isinstance(process, AsyncProcess):
+            return header, process.read_args(iprot)
+        iprot.skip(TType.STRUCT)
+        iprot.readMessageEnd()
+        return header, None
+
+    def parse_message(self, data):
+        """size and call of the first message in data, None if it is
+        incomplete."""
+        trans = TMemoryBuffer(data)
+        try:
+            call = self.read_call(self.pfactory.getProtocol(trans))
+        except (EOFError, TTransportException):
+            return None
+        return trans.cstringio_buf.tell(), call
+
+    async def skip_frame(self, addr, reader, writer, size):
+        """read past a frame over thrift_max_message_size and answer its
+        call, return False if it does not start with a message header."""
+        head = await reader.readexactly(
+            min(size, self.message_limit, FRAME_HEAD))
+        left = size - len(head)
+        while left > 0:
+            left -= len(await reader.readexactly(min(left, SKIP_CHUNK)))
+        if not self.write_too_large(
+                addr, head, writer,
+                SizeLimitExceeded("Frame of %d bytes over the limit of %d"
+                                  % (size, self.message_limit))):
+            return False
+        await writer.drain()
+        return True
+
+    def write_too_large(self, addr, data, writer, ex):
+        """answer the call data starts with, return False if it does not
+        start with a message header."""
+        try:
+            header = self.pfactory.getProtocol(
+                TMemoryBuffer(data)).readMessageBegin()
+        except Exception:
+            return False
+        obuf = TMemoryBuffer()
+        self.reject_too_large(
+            addr, header,
+            self.pfactory.getProtocol(self.tfactory.getTransport(obuf)), ex)
+        writer.write(obuf.getvalue())
+        return True
+
+    async def _process_message(self, addr, message, writer, call=None):
+        obuf = TMemoryBuffer()
+        oprot = self.pfactory.getProtocol(self.tfactory.getTransport(obuf))
+        if call is None:
+            iprot = self.pfactory.getProtocol(TMemoryBuffer(message))
+            (name, type, seqid) = iprot.readMessageBegin()
+            args = None
+        else:
+            (name, type, seqid), args = call
+        request_start = self.begin_request(name)
+        try:
+            process = self.dispatch.get(name)
+            if process is None:
+                self.process_unknown(name, seqid, iprot, oprot)
+            else:
+                if args is None:
+                    coro = process(seqid, iprot, oprot)
+                else:
+                    coro = process.call(seqid, args, oprot)
+                await asyncio.wait_for(coro,
+                                       self.method_timeout(name) or None)
+            writer.write(obuf.getvalue())
+            await writer.drain()
+        except ThriftFuncNotFound:
+            writer.write(obuf.getvalue())
+            self.log.error("Unknown function %s" % (name))
+            self.access(addr, name, "FUNC_NOT_FOUND", request_start)
+            return False
+        except asyncio.TimeoutError:
+            self.log.error("A coroutine process timeout.")
+            self.access(addr, name, "TIMEOUT", request_start)
+            return False
+        except SizeLimitExceeded as ex:
+            self.log.debug("Call of %s refused: %s", name, ex)
+            try:
+                obuf = TMemoryBuffer()
+                self.process_too_large(
+                    name, seqid,
+                    self.pfactory.getProtocol(
+                        self.tfactory.getTransport(obuf)), ex)
+                writer.write(obuf.getvalue())
+            finally:
+                self.access(addr, name, "TOO_LARGE", request_start)
+            return False
+        except Exception as ex:
+            self.log.error(str(ex) + traceback.format_exc())
+            self.access(addr, name, "SERVER_ERROR", request_start)
+            return False
+        else:
+            self.access(addr, name, "OK", request_start)
+            return True
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -
+"""admission control, calls over the limits are rejected at once.
+
+two limits apply: a fixed cap on the calls in flight, and with a target
+queueing delay, the share of calls admitted. When the lowest delay seen
+during an INTERVAL stays above target (a standing queue as in CoDel,
+rather than a burst) the share is cut by DECREASE, otherwise it grows by
+INCREASE back to all calls. The share matters for CPU-bound handlers,
+which queue in the event loop without ever being in flight together.
+
+a Bulkhead limits the concurrent calls of one method.
+"""
+
+import random
+import time
+
+from gevent.lock import Semaphore
+
+
+class AdmissionControl(object):
+
+    INTERVAL = 0.1
+    DECREASE = 0.8
+    INCREASE = 0.05
+    MIN_RATIO = 0.01
+
+    def __init__(self, max_in_flight=0, target=0):
+        self.max_in_flight = max_in_flight
+        self.target = target
+        self.ratio = 1.0
+        self.in_flight = 0
+        self.rejected = 0
+        self.min_delay = None
+        self.interval_start = time.time()
+
+    def admit(self):
+        """count a call in flight, False when it must be rejected."""
+        if (self.max_in_flight and self.in_flight >= self.max_in_flight) or \
+                (self.ratio < 1.0 and random.random() >= self.ratio):
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    def observe(self, delay):
+        """feed a queueing delay sample, in seconds."""
+        if self.min_delay is None or delay < self.min_delay:
+            self.min_delay = delay
+        now = time.time()
+        if now - self.interval_start < self.INTERVAL:
+            return
+        if self.min_delay > self.target:
+            self.ratio = max(self.MIN_RATIO, self.ratio * self.DECREASE)
+        elif self.ratio < 1.0:
+            self.ratio = min(1.0, self.ratio + self.INCREASE)
+        self.min_delay = None
+        self.interval_start = now
+
+
+class Bulkhead(object):
+
+    def __init__(self, limit, queue=0):
+        self.semaphore = Semaphore(limit)
+        self.queue = queue
+        self.waiting = 0
+
+    def acquire(self):
+        """wait for a slot, False when the queue is full."""
+        if self.semaphore.acquire(blocking=False):
+            return True
+        if self.waiting >= self.queue:
+            return False
+        self.waiting += 1
+        try:
+            self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        return True
+
+    def release(self):
+        self.semaphore.release()
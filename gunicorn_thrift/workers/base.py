@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -
+"""message dispatch shared by the thrift workers."""
+
+import copy
+import sys
+import time
+from functools import partial
+
+from thrift.Thrift import TApplicationException, TMessageType, TType
+
+from gunicorn_thrift.stats import STATS_METHOD, ThriftStats, write_stats
+from gunicorn_thrift.thrift.protocol import decode_strings, encode_strings
+from gunicorn_thrift.workers.cache import ResponseCache
+from gunicorn_thrift.workers.coalesce import SingleFlight
+
+
+class ThriftFuncNotFound(Exception):
+    pass
+
+
+class ThriftOverloaded(Exception):
+    pass
+
+
+class Utf8Handler(object):
+
+    """a handler getting unicode arguments and returning unicode results
+    through fastbinary, which reads and writes utf8 str on python 2.
+
+    strings are converted in the arguments, the results and the thrift
+    exceptions raised, as TBinaryProtocolExt does while reading and writing
+    them.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def __getattr__(self, name):
+        method = getattr(self.handler, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kw):
+            args = decode_strings(args)
+            kw = dict((k, decode_strings(v)) for k, v in kw.items())
+            try:
+                result = method(*args, **kw)
+            except Exception as ex:
+                converted = encode_strings(ex)
+                if converted is ex:
+                    raise
+                raise converted
+            return encode_strings(result)
+        # later lookups skip __getattr__
+        setattr(self, name, call)
+        return call
+
+
+class ThriftWorkerMixin(object):
+
+    cache = None
+    pfactory = None
+
+    def init_thrift(self):
+        # init thrift transport&protocol objects
+        self.tfactory = self.cfg.thrift_transport_factory
+        self.pfactory = self.cfg.thrift_protocol_factory
+        self.init_limits()
+
+        self.dispatch = self.build_dispatch(self.wsgi)
+        self.method_timeouts = self.cfg.thrift_method_timeouts
+
+        # before the metrics rows are attached
+        if self.cfg.thrift_stats_endpoint:
+            self.dispatch.update(self.admin_dispatch())
+
+        self.stats = ThriftStats()
+        metrics = getattr(self.app, "metrics", None)
+        if metrics is not None:
+            metrics.close_server()
+            slot = getattr(self, "thrift_metrics_slot", None)
+            if slot is None:
+                self.log.warning("No free metrics slot, the metrics of "
+                                 "worker %s are not shared." % self.pid)
+            else:
+                self.stats = metrics.attach(slot, sorted(self.dispatch))
+
+    def init_limits(self):
+        """pass the thrift_max_* sizes to the protocol factory."""
+        self.message_limit = self.cfg.thrift_max_message_size
+        limits = (self.cfg.thrift_max_string_size,
+                  self.cfg.thrift_max_container_size, self.message_limit)
+        if hasattr(self.pfactory, "set_limits"):
+            self.pfactory.set_limits(*limits)
+        elif limits[0] or limits[1]:
+            self.log.warning("%s does not check string and container sizes."
+                             % self.pfactory.__class__.__name__)
+
+    def init_cache(self):
+        """share the runs of thrift_coalesce_methods between identical
+        concurrent calls, answer thrift_cache_methods from a ResponseCache.
+
+        called once the dispatch entries are final.
+        """
+        if self.cfg.thrift_coalesce_methods:
+            flights = SingleFlight(self.pfactory, self.stats)
+            for name in self.cfg.thrift_coalesce_methods:
+                if name not in self.dispatch:
+                    self.log.warning("Coalesced method %s not found." % name)
+                    continue
+                self.dispatch[name] = flights.wrap(name, self.dispatch[name])
+
+        ttls = self.cfg.thrift_cache_methods
+        if not ttls:
+            return
+        self.cache = ResponseCache(self.pfactory, ttls,
+                                   self.cfg.thrift_cache_max_bytes, self.stats)
+        for name in ttls:
+            if name not in self.dispatch:
+                self.log.warning("Cached method %s not found." % name)
+                continue
+            self.dispatch[name] = self.cache.wrap(name, self.dispatch[name])
+
+    def iter_process_map(self, app):
+        """yield (message name, method, processor, process function).
+
+        app is a processor, or a dict of service name to processor for
+        multiplexed services named "Service:method" on the wire.
+        """
+        if isinstance(app, dict):
+            processors = [("%s:" % service, processor)
+                          for service, processor in app.items()]
+        else:
+            processors = [("", app)]
+        accelerated = getattr(self.pfactory, "accelerated", None)
+        utf8 = sys.version_info[0] == 2 and accelerated and accelerated()
+        for prefix, processor in processors:
+            if utf8:
+                processor = copy.copy(processor)
+                processor._handler = Utf8Handler(processor._handler)
+            for name, func in processor._processMap.items():
+                yield prefix + name, name, processor, func
+
+    def build_dispatch(self, app):
+        """flatten the processors into one {message name: process} dict."""
+        dispatch = {}
+        for message, name, processor, func in self.iter_process_map(app):
+            dispatch[message] = partial(func, processor)
+        return dispatch
+
+    def process_unknown(self, name, seqid, iprot, oprot):
+        """answer an unknown method and raise ThriftFuncNotFound."""
+        iprot.skip(TType.STRUCT)
+        iprot.readMessageEnd()
+        x = TApplicationException(
+            TApplicationException.UNKNOWN_METHOD, "Unknown function %s" % (name))
+        oprot.writeMessageBegin(
+            name, TMessageType.EXCEPTION, seqid)
+        x.write(oprot)
+        oprot.writeMessageEnd()
+        oprot.trans.flush()
+        raise ThriftFuncNotFound
+
+    def admin_dispatch(self):
+        """the admin methods answered with thrift_stats_endpoint."""
+        return {STATS_METHOD: self.process_stats}
+
+    def process_stats(self, seqid, iprot, oprot):
+        """answer STATS_METHOD with the stats of this worker."""
+        iprot.skip(TType.STRUCT)
+        iprot.readMessageEnd()
+        snapshot = self.stats.snapshot()
+        if self.cache is not None:
+            # a snapshot of shared metrics covers every worker, the cache
+            # only this one
+            snapshot["worker_cache"] = dict(self.cache.summary(),
+                                            pid=self.pid)
+        write_stats(snapshot, seqid, oprot)
+
+    def method_timeout(self, name):
+        """seconds a call to name may take, 0 for no limit."""
+        return self.method_timeouts.get(name, self.cfg.timeout)
+
+    def begin_request(self, name):
+        """count a call in flight, return its start time."""
+        self.stats.start(name)
+        return time.time()
+
+    def access(self, addr, name, status, request_start):
+        """count a call started with begin_request and log it."""
+        finish = time.time() - request_start
+        self.stats.finish(name, status, finish)
+        self.log.access(addr, name, status, finish)
+
+    def process_too_large(self, name, seqid, oprot, ex):
+        """answer a call over a thrift_max_* size, its arguments are left
+        unread."""
+        x = TApplicationException(
+            TApplicationException.PROTOCOL_ERROR, str(ex))
+        oprot.writeMessageBegin(name, TMessageType.EXCEPTION, seqid)
+        x.write(oprot)
+        oprot.writeMessageEnd()
+        oprot.trans.flush()
+
+    def reject_too_large(self, addr, header, oprot, ex):
+        """answer the call of a skipped message."""
+        (name, type, seqid) = header
+        request_start = self.begin_request(name)
+        self.log.debug("Call of %s refused: %s", name, ex)
+        try:
+            self.process_too_large(name, seqid, oprot, ex)
+        finally:
+            self.access(addr, name, "TOO_LARGE", request_start)
+
+    def process_overloaded(self, name, seqid, iprot, oprot):
+        """answer a call there is no room for and raise ThriftOverloaded."""
+        iprot.skip(TType.STRUCT)
+        iprot.readMessageEnd()
+        x = TApplicationException(
+            TApplicationException.INTERNAL_ERROR, "Server overloaded")
+        oprot.writeMessageBegin(name, TMessageType.EXCEPTION, seqid)
+        x.write(oprot)
+        oprot.writeMessageEnd()
+        oprot.trans.flush()
+        raise ThriftOverloaded
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -
+"""cache the replies of idempotent methods in the worker.
+
+calls are keyed on their method name and the raw bytes of their argument
+struct. A hit skips decoding, the handler and encoding: the reply message
+header is written with the name of the cached reply and the seqid of the
+call, followed by the cached body.
+Only REPLY messages are cached, application exceptions are not.
+
+entries expire after the TTL of their method and the least recently used
+are evicted once the cache holds more than max_bytes. Handlers drop stale
+entries of their worker with invalidate::
+
+    from gunicorn_thrift.workers.cache import invalidate
+
+    invalidate("get_user", UserService.get_user_args(user_id=1))
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from thrift.Thrift import TMessageType, TType
+from thrift.transport.TTransport import TMemoryBuffer
+
+from gunicorn_thrift.thrift.transport import TCaptureTransport
+
+# the caches of this process, one per worker
+CACHES = []
+
+
+def read_args(iprot):
+    """skip the argument struct of a call, return its raw bytes."""
+    trans = iprot.trans
+    iprot.trans = capture = TCaptureTransport(trans)
+    try:
+        iprot.skip(TType.STRUCT)
+    finally:
+        iprot.trans = trans
+    iprot.readMessageEnd()
+    return capture.getvalue()
+
+
+def message_header(pfactory, name, type, seqid):
+    otrans = TMemoryBuffer()
+    pfactory.getProtocol(otrans).writeMessageBegin(name, type, seqid)
+    return otrans.getvalue()
+
+
+def split_message(pfactory, data):
+    """the (name, type, seqid) header of an encoded message and the bytes
+    following it, None when data does not start with a header."""
+    trans = TCaptureTransport(TMemoryBuffer(data))
+    try:
+        header = pfactory.getProtocol(trans).readMessageBegin()
+    except Exception:
+        return None
+    return header, data[len(trans.getvalue()):]
+
+
+def invalidate(name=None, args=None):
+    """drop the cached replies of a call, of a method or of all methods.
+
+    args is the <method>_args struct of the call, it is encoded as the
+    generated clients do to find its entry.
+    """
+    for cache in CACHES:
+        cache.invalidate(name, args)
+
+
+class ResponseCache(object):
+
+    # bookkeeping bytes counted for each entry
+    OVERHEAD = 200
+
+    def __init__(self, pfactory, ttls, max_bytes, stats=None):
+        self.pfactory = pfactory
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.stats = stats
+        self.lock = threading.Lock()
+        # (name, args) -> (expires, reply name, body)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.evictions = 0
+        CACHES.append(self)
+
+    def wrap(self, name, process):
+        """a dispatch entry answering name from the cache."""
+        def cached_process(seqid, iprot, oprot):
+            self.process(name, process, seqid, iprot, oprot)
+        return cached_process
+
+    def header(self, name, seqid):
+        return message_header(self.pfactory, name, TMessageType.REPLY, seqid)
+
+    def process(self, name, process, seqid, iprot, oprot):
+        key = (name, read_args(iprot))
+
+        reply = self.get(key)
+        if self.stats is not None:
+            self.stats.cache(name, reply is not None)
+        if reply is not None:
+            oprot.trans.write(self.header(reply[0], seqid))
+            oprot.trans.write(reply[1])
+            oprot.trans.flush()
+            return
+
+        otrans = TMemoryBuffer()
+        process(seqid, self.pfactory.getProtocol(TMemoryBuffer(key[1])),
+                self.pfactory.getProtocol(otrans))
+        data = otrans.getvalue()
+        oprot.trans.write(data)
+        oprot.trans.flush()
+        # hits answer with the name of this reply, processors of
+        # multiplexed services reply with the bare method name
+        message = split_message(self.pfactory, data)
+        if message is not None and message[0][1] == TMessageType.REPLY:
+            self.put(key, message[0][0], message[1], self.ttls[name])
+
+    def get(self, key):
+        """the (reply name, body) cached for key, None on a miss."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self.size -= self.entry_size(key, entry[2])
+                return None
+            # back to the most recently used end
+            self.entries[key] = entry
+            return entry[1:]
+
+    def put(self, key, reply_name, body, ttl):
+        size = self.entry_size(key, body)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= self.entry_size(key, old[2])
+            self.entries[key] = (time.time() + ttl, reply_name, body)
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, old = self.entries.popitem(last=False)
+                self.size -= self.entry_size(old_key, old[2])
+                self.evictions += 1
+
+    def entry_size(self, key, body):
+        return len(key[0]) + len(key[1]) + len(body) + self.OVERHEAD
+
+    def invalidate(self, name=None, args=None):
+        with self.lock:
+            if name is None:
+                self.entries.clear()
+                self.size = 0
+                return
+            if args is not None:
+                otrans = TMemoryBuffer()
+                args.write(self.pfactory.getProtocol(otrans))
+                keys = [(name, otrans.getvalue())]
+            else:
+                keys = [key for key in self.entries if key[0] == name]
+            for key in keys:
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.size -= self.entry_size(key, entry[2])
+
+    def summary(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -
+"""share one handler run between identical concurrent calls.
+
+calls are identical when their method name and the raw bytes of their
+argument struct are. The first one runs the handler, the others wait for
+its reply and answer it with their own seqid in the message header. When
+the handler fails, the waiting calls fail too.
+"""
+
+import threading
+
+from thrift.Thrift import TMessageType
+from thrift.transport.TTransport import TMemoryBuffer
+
+from gunicorn_thrift.workers.cache import message_header, read_args
+from gunicorn_thrift.workers.cache import split_message
+
+
+class CoalescedCallFailed(Exception):
+    pass
+
+
+class Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    def __init__(self, pfactory, stats=None):
+        self.pfactory = pfactory
+        self.stats = stats
+        self.lock = threading.Lock()
+        # (name, args) -> Flight
+        self.flights = {}
+
+    def wrap(self, name, process):
+        """a dispatch entry sharing the runs of name."""
+        def coalesced_process(seqid, iprot, oprot):
+            self.process(name, process, seqid, iprot, oprot)
+        return coalesced_process
+
+    def process(self, name, process, seqid, iprot, oprot):
+        key = (name, read_args(iprot))
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if leader:
+            data = self.run(key, flight, process, seqid)
+        else:
+            flight.done.wait()
+            if flight.error is not None:
+                raise CoalescedCallFailed(
+                    "shared call of %s failed: %s" % (name, flight.error))
+            data = self.rewrite(flight, seqid)
+            if data is None:
+                # no message header we know how to rewrite
+                data = self.run_alone(key, process, seqid)
+            elif self.stats is not None:
+                self.stats.coalesce(name)
+        oprot.trans.write(data)
+        oprot.trans.flush()
+
+    def run(self, key, flight, process, seqid):
+        try:
+            data = flight.data = self.run_alone(key, process, seqid)
+        except BaseException as ex:
+            # deadlines are BaseExceptions
+            flight.error = ex
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return data
+
+    def run_alone(self, key, process, seqid):
+        otrans = TMemoryBuffer()
+        process(seqid, self.pfactory.getProtocol(TMemoryBuffer(key[1])),
+                self.pfactory.getProtocol(otrans))
+        return otrans.getvalue()
+
+    def rewrite(self, flight, seqid):
+        """the reply of flight with seqid in its header."""
+        message = split_message(self.pfactory, flight.data)
+        if message is None:
+            return None
+        # the name of the reply, multiplexed processors answer with the
+        # bare method name
+        (reply_name, type, _), body = message
+        if type not in (TMessageType.REPLY, TMessageType.EXCEPTION):
+            return None
+        return message_header(self.pfactory, reply_name, type, seqid) + body
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -
+import sys
+
+if sys.version_info >= (3, 5):
+    from gunicorn_thrift.workers._gthriftasyncio import ThriftAsyncioWorker
+    __all__ = ['ThriftAsyncioWorker']
+else:
+    raise RuntimeError("You need Python >= 3.5 to use the asyncio worker")
@@ -24,11 +24,15 @@ THE SOFTWARE.
 """
 
 import errno
+import multiprocessing
 import os
+import signal
 import sys
+import tempfile
 import traceback
 import time
 from functools import partial
+from struct import pack, unpack
 
 _socket = __import__("socket")
 
@@ -40,29 +44,41 @@ try:
     import gevent
 except ImportError:
     raise RuntimeError("You need gevent installed to use this worker.")
+from gevent.hub import get_hub
+from gevent.lock import Semaphore
 from gevent.pool import Pool
 from gevent.server import StreamServer
-from gevent.socket import socket
-from gevent.timeout import Timeout
+from gevent.socket import socket, wait_read
 
 import gunicorn
 from gunicorn import util
 from gunicorn.workers.async import AsyncWorker
 
-from thrift.transport import TTransport
-from thrift.transport.TTransport import TFileObjectTransport
-from thrift.Thrift import TApplicationException, TMessageType, TType
-
-from gunicorn_thrift.thrift.protocol import TBinaryProtocolFactoryExt
+from thrift.transport.TTransport import TMemoryBuffer, TFramedTransportFactory
+
+from gunicorn_thrift.capture import CaptureWriter
+from gunicorn_thrift.profiler import PROFILE_METHOD, SamplingProfiler
+from gunicorn_thrift.profiler import read_profile_args
+from gunicorn_thrift.stats import STATS_METHOD, write_json
+from gunicorn_thrift.thrift.protocol import SizeLimitExceeded, skip_bytes
+from gunicorn_thrift.thrift.transport import TSocketTransportExt
+from gunicorn_thrift.workers.admission import AdmissionControl, Bulkhead
+from gunicorn_thrift.workers.cache import read_args
+from gunicorn_thrift.workers.offload import ProcessOffloadPool
+from gunicorn_thrift.workers.slowlog import PhaseClock, SlowLog
+from gunicorn_thrift.workers.timer import Deadline, TimerWheel
+from gunicorn_thrift.workers.base import ThriftFuncNotFound, ThriftOverloaded
+from gunicorn_thrift.workers.base import ThriftWorkerMixin
 
 VERSION = "gevent/%s gunicorn/%s" % (gevent.__version__, gunicorn.__version__)
 
+# bytes of an oversized frame read for its message header
+FRAME_HEAD = 1024
 
-class ThriftFuncNotFound(Exception):
-    pass
 
+class ThriftGeventWorker(AsyncWorker, ThriftWorkerMixin):
 
-class ThriftGeventWorker(AsyncWorker):
+    profiler = None
 
     def patch(self):
         from gevent import monkey
@@ -87,24 +103,109 @@ class ThriftGeventWorker(AsyncWorker):
             self.log.info("Parent changed, shutting down: %s", self)
             sys.exit(0)
 
+    def init_signals(self):
+        super(ThriftGeventWorker, self).init_signals()
+        # a python handler, it runs even while a greenlet keeps the hub
+        # from running
+        signal.signal(signal.SIGUSR2, self.handle_profile)
+        signal.siginterrupt(signal.SIGUSR2, False)
+
+    def handle_profile(self, sig, frame):
+        if self.profiler is not None:
+            self.profiler.start(self.cfg.thrift_profile_seconds)
+
     def run(self):
         servers = []
 
-        # init thrift transport&protocol objects
-        self.tfactory = TTransport.TTransportFactoryBase()
-        self.pfactory = TBinaryProtocolFactoryExt()
-
+        self.init_thrift()
+
+        self.offload = None
+        if self.cfg.thrift_offload_methods:
+            # by default the workers share the CPUs
+            size = self.cfg.thrift_offload_workers or max(
+                multiprocessing.cpu_count() // self.cfg.workers, 1)
+            self.offload = ProcessOffloadPool(
+                self.app.app_uri, self.pfactory, size)
+            for name in self.cfg.thrift_offload_methods:
+                if name not in self.dispatch:
+                    self.log.warning("Offload method %s not found." % name)
+                    continue
+                self.dispatch[name] = partial(self.offload.process, name)
+
+        self.init_cache()
+
+        self.profiler = SamplingProfiler(
+            self.cfg.thrift_profile_dir or tempfile.gettempdir(),
+            self.cfg.thrift_profile_rate, self.cfg.thrift_profile_format,
+            self._process_message.__func__.__code__)
+
+        self.timer = TimerWheel()
+
+        self.slowlog = None
+        if self.cfg.thrift_slow_log:
+            if hasattr(self.log, "slow"):
+                self.slowlog = SlowLog(
+                    self.log, self.cfg.thrift_slow_threshold, self.timer)
+            else:
+                self.log.warning("thrift_slow_log needs the ThriftLogger "
+                                 "logger class.")
+
+        self.admission = None
+        target = self.cfg.thrift_queue_target
+        if self.cfg.thrift_max_in_flight or target:
+            self.admission = AdmissionControl(
+                self.cfg.thrift_max_in_flight, target)
+            if target:
+                gevent.spawn(self._watch_queue_delay)
+
+        self.bulkheads = {}
+        for name, limit in self.cfg.thrift_method_concurrency.items():
+            if name not in self.dispatch:
+                self.log.warning("Concurrency limited method %s not found."
+                                 % name)
+                continue
+            self.bulkheads[name] = Bulkhead(
+                limit, self.cfg.thrift_bulkhead_queue)
+
+        # greenlets of the connections waiting for their next message
+        self.idle = set()
+
+        self.capture = None
+        if self.cfg.thrift_capture_file:
+            self.capture = CaptureWriter(
+                self.cfg.thrift_capture_file, self.pfactory,
+                isinstance(self.tfactory, TFramedTransportFactory),
+                self.cfg.thrift_capture_rate,
+                self.cfg.thrift_capture_max_bytes)
+            gevent.spawn(self._flush_capture)
+
+        self.pipeline = self.cfg.thrift_pipeline
+        if self.pipeline and not isinstance(
+                self.tfactory, TFramedTransportFactory):
+            self.log.warning("thrift_pipeline needs the framed transport, "
+                             "processing one message at a time.")
+            self.pipeline = 0
+
+        self.reuseport = set()
         for s in self.sockets:
             s.setblocking(1)
             pool = Pool(self.worker_connections)
-            hfun = partial(self.handle, s)
-            server = StreamServer(s, handle=hfun, spawn=pool)
-            server.start()
-            servers.append(server)
+            listeners = [s]
+            if self.cfg.thrift_reuse_port:
+                listener = self.bind_reuseport(s)
+                if listener is not None:
+                    self.reuseport.add(listener)
+                    listeners.append(listener)
+            for listener in listeners:
+                hfun = partial(self.handle, listener)
+                server = StreamServer(listener, handle=hfun, spawn=pool)
+                server.start()
+                servers.append(server)
 
         try:
             while self.alive:
                 self.notify()
+                self.poll_profiler()
                 gevent.sleep(0.1)
 
         except KeyboardInterrupt:
@@ -125,28 +226,66 @@ class ThriftGeventWorker(AsyncWorker):
                 if hasattr(server, 'kill'):  # gevent < 1.0
                     server.kill()
 
+            # close the idle connections, busy ones are closed once their
+            # current message is answered
+            for greenlet in list(self.idle):
+                get_hub().loop.run_callback(self._close_idle, greenlet)
+
             # Handle current requests until graceful_timeout
             ts = time.time()
-            while time.time() - ts <= self.cfg.graceful_timeout:
-                accepting = 0
-                for server in servers:
-                    if server.pool.free_count() != server.pool.size:
-                        accepting += 1
-
-                # if no server is accepting a connection, we can exit
-                if not accepting:
-                    return
-
-                self.notify()
-                gevent.sleep(1.0)
+            for server in servers:
+                while server.pool.free_count() != server.pool.size:
+                    remaining = ts + self.cfg.graceful_timeout - time.time()
+                    if remaining <= 0:
+                        break
+                    self.notify()
+                    server.pool.join(timeout=min(remaining, 1.0))
+
+            # if no server is handling a connection, we can exit
+            if all(server.pool.free_count() == server.pool.size
+                   for server in servers):
+                return
 
             # Force kill all active the handlers
             self.log.warning("Worker graceful timeout (pid:%s)" % self.pid)
             [server.stop(timeout=1) for server in servers]
         except:
             pass
+        finally:
+            if self.offload is not None:
+                self.offload.close()
+            if self.capture is not None:
+                self.capture.close()
+            self.profiler.stop()
+            self.poll_profiler()
+
+    def bind_reuseport(self, shared):
+        """a listener of this worker alone on the address of shared."""
+        if shared.family not in (_socket.AF_INET, _socket.AF_INET6):
+            return None
+        if not hasattr(_socket, "SO_REUSEPORT"):
+            self.log.warning("SO_REUSEPORT is not supported, using the "
+                             "shared listeners only.")
+            return None
+        address = shared.getsockname()
+        listener = socket(shared.family, _socket.SOCK_STREAM)
+        try:
+            # the shared listener joins the group, every socket bound to
+            # the address needs the option
+            shared.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEPORT, 1)
+            listener.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+            listener.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEPORT, 1)
+            listener.bind(address)
+            listener.listen(self.cfg.backlog)
+        except _socket.error, ex:
+            self.log.warning("Can not listen on %s:%s with SO_REUSEPORT: %s"
+                             % (address[0], address[1], ex))
+            listener.close()
+            return None
+        return listener
 
     def handle(self, listener, client, addr):
+        self.stats.accept_connection(listener in self.reuseport)
         try:
             listener_name = listener.getsockname()
             self.handle_request(listener_name, client, addr)
@@ -172,60 +311,313 @@ class ThriftGeventWorker(AsyncWorker):
             pass
 
     def _handle_request(self, listener_name, sock, addr):
-        client = TFileObjectTransport(sock.makefile())
+        client = TSocketTransportExt(sock)
+        client.max_read = self.message_limit
+        self.stats.open_connection()
+        try:
+            if self.pipeline:
+                return self._handle_pipeline(client, sock, addr)
+            return self._handle_messages(client, sock, addr)
+        finally:
+            self.stats.open_connection(-1)
+
+    def _handle_messages(self, client, sock, addr):
         itrans = self.tfactory.getTransport(client)
         otrans = self.tfactory.getTransport(client)
         iprot = self.pfactory.getProtocol(itrans)
         oprot = self.pfactory.getProtocol(otrans)
+        max_requests = self.cfg.thrift_max_requests_per_connection
+        requests = 0
+        framed = isinstance(self.tfactory, TFramedTransportFactory)
+        clock = None
+        if self.slowlog is not None:
+            clock = PhaseClock(iprot, oprot)
         try:
-            while True:
-                (name, type, seqid) = iprot.readMessageBegin()
-                request_start = time.time()
+            while self.wait_message(client, sock, addr):
+                if clock is not None:
+                    self.slowlog.begin(clock)
                 try:
-                    timeout_con = Timeout(self.cfg.timeout, Timeout)
-                    timeout_con.start()
-                    if name not in self.wsgi._processMap:
-                        iprot.skip(TType.STRUCT)
-                        iprot.readMessageEnd()
-                        x = TApplicationException(
-                            TApplicationException.UNKNOWN_METHOD, "Unknown function %s" % (name))
-                        oprot.writeMessageBegin(
-                            name, TMessageType.EXCEPTION, seqid)
-                        x.write(oprot)
-                        oprot.writeMessageEnd()
-                        oprot.trans.flush()
-                        raise ThriftFuncNotFound
-                    else:
-                        self.wsgi._processMap[name](self.wsgi, seqid, iprot, oprot)
-                except ThriftFuncNotFound, ex:
-                    self.log.error("Unknown function %s" % (name))
-                    self.log.access(
-                        addr, name, "FUNC_NOT_FOUND", time.time() - request_start)
-                    break
-                except Timeout, ex:
-                    self.log.error("A greenlet process timeout.")
-                    self.log.access(
-                        addr, name, "TIMEOUT", time.time() - request_start)
-                    break
-                except Exception, ex:
-                    self.log.error(str(ex) + traceback.format_exc())
-                    self.log.access(
-                        addr, name, "SERVER_ERROR", time.time() - request_start)
-                    break
-                else:
-                    self.log.access(
-                        addr, name, "OK", time.time() - request_start)
+                    (name, type, seqid) = iprot.readMessageBegin()
+                except SizeLimitExceeded, ex:
+                    # a frame over thrift_max_message_size, still unread
+                    if not framed or not ex.pending:
+                        raise
+                    header = self.skip_frame(client, ex.pending)
+                    if header is None:
+                        break
+                    self.reject_too_large(addr, header, oprot, ex)
+                    continue
+                self.stats.activate_connection()
+                try:
+                    ok = self._process_message(
+                        addr, name, seqid,
+                        self.capture_message(name, type, iprot), oprot)
                 finally:
-                    timeout_con.cancel()
+                    self.stats.activate_connection(-1)
+                    if clock is not None:
+                        self.slowlog.end(clock, addr, name)
+                requests += 1
+                if not ok or requests == max_requests:
+                    break
         except EOFError:
             pass
         except Exception, ex:
             pass
         finally:
+            if clock is not None:
+                self.slowlog.cancel()
             itrans.close()
             otrans.close()
         return True
 
+    def wait_message(self, client, sock, addr, busy=False):
+        """wait for the next message, False once idle for
+        thrift_idle_timeout or when the worker stops.
+
+        the connection is not idle while busy (calls in flight).
+        """
+        if not self.alive:
+            return False
+        if client.pending():
+            return True
+        timeout = self.cfg.thrift_idle_timeout or None
+        current = gevent.getcurrent()
+        self.idle.add(current)
+        try:
+            while True:
+                try:
+                    wait_read(sock.fileno(), timeout)
+                    return True
+                except _socket.timeout:
+                    if not busy or not busy():
+                        self.log.debug("Closing idle connection from %s",
+                                       addr)
+                        return False
+        finally:
+            self.idle.discard(current)
+
+    def _close_idle(self, greenlet):
+        # the connection may have received a message since
+        if greenlet in self.idle:
+            greenlet.throw(gevent.GreenletExit)
+
+    def _handle_pipeline(self, client, sock, addr):
+        """read frames ahead and process each one in its own greenlet.
+
+        responses are framed and written back as soon as they are done,
+        clients match them to calls by seqid.
+        """
+        pool = Pool(self.pipeline)
+        wlock = Semaphore()
+        max_requests = self.cfg.thrift_max_requests_per_connection
+        requests = 0
+        # calls in flight, the pool drops finished greenlets a bit later
+        busy = [0]
+
+        def process(frame, received):
+            try:
+                respond(frame, received)
+            finally:
+                busy[0] -= 1
+                if not busy[0]:
+                    self.stats.activate_connection(-1)
+
+        def send(data):
+            with wlock:
+                client.write(pack("!i", len(data)))
+                client.write(data)
+                client.flush()
+
+        def respond(frame, received):
+            iprot = self.pfactory.getProtocol(TMemoryBuffer(frame))
+            otrans = TMemoryBuffer()
+            oprot = self.pfactory.getProtocol(otrans)
+            clock = name = None
+            if self.slowlog is not None:
+                clock = PhaseClock(iprot, oprot)
+                self.slowlog.begin(clock, received)
+            ok = True
+            try:
+                (name, type, seqid) = iprot.readMessageBegin()
+                iprot = self.capture_message(name, type, iprot)
+                ok = self._process_message(addr, name, seqid, iprot, oprot)
+                data = otrans.getvalue()
+                if data:
+                    send(data)
+            finally:
+                if clock is not None:
+                    self.slowlog.end(clock, addr, name)
+                if not ok:
+                    # stop reading, in-flight calls still get answered
+                    try:
+                        sock.shutdown(_socket.SHUT_RD)
+                    except _socket.error:
+                        pass
+
+        try:
+            while self.wait_message(client, sock, addr,
+                                    busy=lambda: busy[0]):
+                size, = unpack("!i", client.readAll(4))
+                if self.message_limit and size > self.message_limit:
+                    header = self.skip_frame(client, size)
+                    if header is None:
+                        break
+                    otrans = TMemoryBuffer()
+                    self.reject_too_large(
+                        addr, header, self.pfactory.getProtocol(otrans),
+                        SizeLimitExceeded(
+                            "Frame of %d bytes over the limit of %d"
+                            % (size, self.message_limit)))
+                    send(otrans.getvalue())
+                    continue
+                frame = client.readAll(size)
+                if not busy[0]:
+                    self.stats.activate_connection()
+                busy[0] += 1
+                pool.spawn(process, frame, time.time())
+                requests += 1
+                if requests == max_requests:
+                    break
+        except EOFError:
+            pass
+        except Exception, ex:
+            pass
+        finally:
+            pool.join()
+            client.close()
+        return True
+
+    def poll_profiler(self):
+        if not self.profiler.poll():
+            return
+        summary = self.profiler.summary()
+        if summary["error"]:
+            self.log.error("Can not write the profile: %s" % summary["error"])
+        elif summary["path"] is None:
+            self.log.info("The profile has no samples, the worker was idle.")
+        else:
+            self.log.info("Wrote the profile %s, %s samples"
+                          % (summary["path"], summary["samples"]))
+
+    def admin_dispatch(self):
+        dispatch = super(ThriftGeventWorker, self).admin_dispatch()
+        dispatch[PROFILE_METHOD] = self.process_profile
+        return dispatch
+
+    def method_timeout(self, name):
+        # a profile call lasts as long as the profile it asks for
+        if name == PROFILE_METHOD:
+            return 0
+        return super(ThriftGeventWorker, self).method_timeout(name)
+
+    def process_profile(self, seqid, iprot, oprot):
+        """answer PROFILE_METHOD once a profile of this worker finished,
+        joining one already running."""
+        seconds = read_profile_args(iprot)
+        self.profiler.start(seconds or self.cfg.thrift_profile_seconds)
+        try:
+            # the worker loop stops it
+            while self.profiler.running:
+                gevent.sleep(0.1)
+        finally:
+            # a call cut short does not leave the profiler running
+            self.profiler.stop()
+        write_json(PROFILE_METHOD, self.profiler.summary(), seqid, oprot)
+
+    def skip_frame(self, client, size):
+        """read past a frame over thrift_max_message_size without holding
+        it in memory, return the (name, type, seqid) it starts with."""
+        head = client.readAll(min(size, self.message_limit, FRAME_HEAD))
+        skip_bytes(client, size - len(head))
+        try:
+            return self.pfactory.getProtocol(
+                TMemoryBuffer(head)).readMessageBegin()
+        except Exception:
+            return None
+
+    def capture_message(self, name, type, iprot):
+        """record the arguments of a sampled call with thrift_capture_file,
+        return the protocol to read them from."""
+        if self.capture is None or name in (STATS_METHOD, PROFILE_METHOD) or \
+                not self.capture.sample():
+            return iprot
+        args = read_args(iprot)
+        self.capture.record(name, type, args)
+        return self.pfactory.getProtocol(TMemoryBuffer(args))
+
+    def _flush_capture(self, interval=1.0):
+        while True:
+            gevent.sleep(interval)
+            self.capture.flush()
+
+    def _watch_queue_delay(self, interval=0.01):
+        # how late the hub wakes this greenlet is how long ready greenlets
+        # wait for their turn
+        while True:
+            start = time.time()
+            gevent.sleep(interval)
+            self.admission.observe(max(time.time() - start - interval, 0))
+
+    def _process_message(self, addr, name, seqid, iprot, oprot):
+        request_start = self.begin_request(name)
+        admission = bulkhead = None
+        timeout = self.method_timeout(name)
+        if timeout:
+            current = gevent.getcurrent()
+            self.timer.add(current, timeout)
+        try:
+            try:
+                if self.admission is not None:
+                    if not self.admission.admit():
+                        self.process_overloaded(name, seqid, iprot, oprot)
+                    admission = self.admission
+                if name in self.bulkheads:
+                    # set once acquired, a deadline may hit while waiting
+                    if not self.bulkheads[name].acquire():
+                        self.process_overloaded(name, seqid, iprot, oprot)
+                    bulkhead = self.bulkheads[name]
+                process = self.dispatch.get(name)
+                if process is None:
+                    self.process_unknown(name, seqid, iprot, oprot)
+                else:
+                    process(seqid, iprot, oprot)
+            finally:
+                # a deadline thrown past here would escape the handlers
+                # below and leave the call counted in flight
+                if timeout:
+                    self.timer.cancel(current)
+        except ThriftOverloaded, ex:
+            self.access(addr, name, "OVERLOADED", request_start)
+            return True
+        except SizeLimitExceeded, ex:
+            # the rest of the message is unread, the connection closes
+            self.log.debug("Call of %s refused: %s", name, ex)
+            try:
+                self.process_too_large(name, seqid, oprot, ex)
+            finally:
+                self.access(addr, name, "TOO_LARGE", request_start)
+            return False
+        except ThriftFuncNotFound, ex:
+            self.log.error("Unknown function %s" % (name))
+            self.access(addr, name, "FUNC_NOT_FOUND", request_start)
+            return False
+        except Deadline, ex:
+            self.log.error("A greenlet process timeout.")
+            self.access(addr, name, "TIMEOUT", request_start)
+            return False
+        except Exception, ex:
+            self.log.error(str(ex) + traceback.format_exc())
+            self.access(addr, name, "SERVER_ERROR", request_start)
+            return False
+        else:
+            self.access(addr, name, "OK", request_start)
+            return True
+        finally:
+            if admission is not None:
+                admission.release()
+            if bulkhead is not None:
+                bulkhead.release()
+
     if gevent.version_info[0] == 0:
 
         def init_process(self):
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -
+"""Based on gunicorn.workers.gthread module under MIT license:
+
+2009-2013 (c) Benoît Chesneau <benoitc@e-engura.org>
+2009-2013 (c) Paul J. Davis <paul.joseph.davis@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+# design:
+# connections are accepted and watched in the main loop. When a connection
+# becomes readable one message is read, processed and answered in the thread
+# pool, then its future is handed back to the main loop through a wakeup
+# pipe and the connection waits for its next message. Only the main loop
+# touches the futures and the poller.
+
+from collections import deque
+import os
+import socket
+import time
+import traceback
+from functools import partial
+
+try:
+    import concurrent.futures as futures
+except ImportError:
+    raise RuntimeError("""
+    You need 'futures' installed to use this worker with this python
+    version.
+    """)
+
+try:
+    from asyncio import selectors
+except ImportError:
+    try:
+        from trollius import selectors
+    except ImportError:
+        raise RuntimeError("""
+        You need 'trollius' installed to use this worker with this python
+        version.
+        """)
+
+from gunicorn import util
+from gunicorn.workers import base
+
+from thrift.transport.TTransport import TMemoryBuffer
+
+from gunicorn_thrift.thrift.protocol import SizeLimitExceeded
+from gunicorn_thrift.thrift.transport import TSocketTransportExt
+from gunicorn_thrift.workers.base import ThriftFuncNotFound, ThriftWorkerMixin
+
+
+class ThriftTimeout(Exception):
+    pass
+
+
+class TConn(object):
+
+    def __init__(self, worker, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.client = TSocketTransportExt(sock)
+        self.client.max_read = worker.message_limit
+        self.iprot = worker.pfactory.getProtocol(
+            worker.tfactory.getTransport(self.client))
+        self.stats = worker.stats
+        self.stats.open_connection()
+        self.requests = 0
+        self.idle_since = time.time()
+        self.closed = False
+
+        # reads and writes of one message must finish within cfg.timeout
+        self.sock.settimeout(worker.cfg.timeout or None)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.stats.open_connection(-1)
+        util.close(self.sock)
+
+
+class ThriftThreadWorker(base.Worker, ThriftWorkerMixin):
+
+    """run thrift calls on a bounded thread pool.
+
+    handlers may block in C extensions without stalling other
+    connections. A thread can not be interrupted, so a call running longer
+    than cfg.timeout gets its reply dropped and its connection closed once
+    the handler returns.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ThriftThreadWorker, self).__init__(*args, **kwargs)
+        self.worker_connections = self.cfg.worker_connections
+
+        # initialise the pool
+        self.tpool = None
+        self.poller = None
+        self.futures = deque()
+        # idle connections registered in the poller
+        self._keep = set()
+        # futures finished by the pool threads
+        self._done = deque()
+        self._wake_r, self._wake_w = os.pipe()
+
+    def init_process(self):
+        self.tpool = futures.ThreadPoolExecutor(max_workers=self.cfg.threads)
+        self.poller = selectors.DefaultSelector()
+        super(ThriftThreadWorker, self).init_process()
+
+    def accept(self, listener):
+        try:
+            sock, addr = listener.accept()
+        except socket.error:
+            return
+        self.wait_client(TConn(self, sock, addr))
+
+    def wait_client(self, conn):
+        conn.idle_since = time.time()
+        self._keep.add(conn)
+        self.poller.register(conn.sock, selectors.EVENT_READ,
+                             partial(self.handle_client, conn))
+
+    def handle_client(self, conn, client):
+        # unregister the client from the poller
+        self.poller.unregister(client)
+        self._keep.discard(conn)
+        self.submit(conn)
+
+    def submit(self, conn):
+        fs = self.tpool.submit(self.handle, conn)
+        fs.conn = conn
+        self.futures.append(fs)
+        fs.add_done_callback(self.finish_request)
+
+    def wakeup(self, fd):
+        os.read(self._wake_r, 4096)
+        while self._done:
+            self.finish(self._done.popleft())
+
+    def close_idle(self):
+        """close the connections idle for thrift_idle_timeout."""
+        deadline = time.time() - self.cfg.thrift_idle_timeout
+        for conn in [c for c in self._keep if c.idle_since < deadline]:
+            self.log.debug("Closing idle connection from %s", conn.addr)
+            self.poller.unregister(conn.sock)
+            self._keep.discard(conn)
+            conn.close()
+
+    def run(self):
+        self.init_thrift()
+        self.init_cache()
+
+        # init listeners, add them to the event loop
+        for s in self.sockets:
+            s.setblocking(False)
+            self.poller.register(s, selectors.EVENT_READ, self.accept)
+        self.poller.register(self._wake_r, selectors.EVENT_READ, self.wakeup)
+
+        timeout = self.cfg.timeout or 0.5
+        idle_timeout = self.cfg.thrift_idle_timeout
+        next_idle_check = time.time()
+
+        while self.alive:
+            # If our parent changed then we shut down.
+            if self.ppid != os.getppid():
+                self.log.info("Parent changed, shutting down: %s", self)
+                break
+
+            # notify the arbiter we are alive
+            self.notify()
+
+            events = self.poller.select(0.5)
+            for key, mask in events:
+                callback = key.data
+                callback(key.fileobj)
+
+            # idle connections are looked for twice a second at most
+            if idle_timeout and time.time() >= next_idle_check:
+                self.close_idle()
+                next_idle_check = time.time() + min(idle_timeout, 0.5)
+
+            # bound the queue of the thread pool
+            if len(self.futures) >= self.worker_connections:
+                futures.wait(list(self.futures), timeout=timeout,
+                             return_when=futures.FIRST_COMPLETED)
+
+        # stop accepting and close the idle connections, busy ones are
+        # closed by finish once their current message is answered
+        self.alive = False
+        for conn in list(self._keep):
+            conn.close()
+        self.poller.close()
+
+        # wait for the current messages until graceful_timeout
+        futures.wait(list(self.futures), timeout=self.cfg.graceful_timeout)
+        while self._done:
+            self.finish(self._done.popleft())
+        self.tpool.shutdown(False)
+        for fs in list(self.futures):
+            fs.cancel()
+            fs.conn.close()
+
+    def finish_request(self, fs):
+        # called in the pool thread, the main loop finishes the request
+        self._done.append(fs)
+        os.write(self._wake_w, b".")
+
+    def finish(self, fs):
+        """keep the connection of a finished future or close it."""
+        try:
+            keepalive = not fs.cancelled() and fs.result()
+        except Exception:
+            keepalive = False
+        try:
+            self.futures.remove(fs)
+        except ValueError:
+            pass
+
+        conn = fs.conn
+        if not keepalive or not self.alive:
+            conn.close()
+        elif conn.client.pending():
+            # the next message is already buffered
+            self.submit(conn)
+        else:
+            self.wait_client(conn)
+
+    def handle(self, conn):
+        try:
+            (name, type, seqid) = conn.iprot.readMessageBegin()
+        except Exception:
+            return False
+        self.stats.activate_connection()
+        try:
+            ok = self._process_message(conn, name, seqid)
+        except Exception:
+            return False
+        finally:
+            self.stats.activate_connection(-1)
+        conn.requests += 1
+        return ok and \
+            conn.requests != self.cfg.thrift_max_requests_per_connection
+
+    def _send(self, conn, otrans):
+        conn.client.write(otrans.getvalue())
+        conn.client.flush()
+
+    def _process_message(self, conn, name, seqid):
+        request_start = self.begin_request(name)
+        otrans = TMemoryBuffer()
+        oprot = self.pfactory.getProtocol(self.tfactory.getTransport(otrans))
+        try:
+            process = self.dispatch.get(name)
+            if process is None:
+                try:
+                    self.process_unknown(name, seqid, conn.iprot, oprot)
+                finally:
+                    self._send(conn, otrans)
+            else:
+                process(seqid, conn.iprot, oprot)
+                timeout = self.method_timeout(name)
+                if timeout and time.time() - request_start > timeout:
+                    raise ThriftTimeout
+                self._send(conn, otrans)
+        except ThriftFuncNotFound, ex:
+            self.log.error("Unknown function %s" % (name))
+            self.access(conn.addr, name, "FUNC_NOT_FOUND", request_start)
+            return False
+        except (ThriftTimeout, socket.timeout), ex:
+            self.log.error("A thread process timeout.")
+            self.access(conn.addr, name, "TIMEOUT", request_start)
+            return False
+        except SizeLimitExceeded, ex:
+            # the rest of the message is unread, the connection closes
+            self.log.debug("Call of %s refused: %s", name, ex)
+            try:
+                self.process_too_large(name, seqid, oprot, ex)
+                self._send(conn, otrans)
+            finally:
+                self.access(conn.addr, name, "TOO_LARGE", request_start)
+            return False
+        except Exception, ex:
+            self.log.error(str(ex) + traceback.format_exc())
+            self.access(conn.addr, name, "SERVER_ERROR", request_start)
+            return False
+        else:
+            self.access(conn.addr, name, "OK", request_start)
+            return True
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -
+"""run selected thrift methods in child processes.
+
+the worker skips over the argument struct of an offloaded call while
+recording its raw bytes, a child process decodes them, runs the handler
+and sends back the serialized reply. Children are separate interpreters
+started with ``python -m gunicorn_thrift.workers.offload APP_MODULE
+PROTOCOL_FACTORY`` and talk to the worker over their stdin/stdout:
+
+    request: !iii seqid, len(name), len(args) + name + args
+    reply:   !ii  status, len(data) + data
+
+status 0 carries the reply message, 1 a traceback.
+"""
+
+import os
+import sys
+import traceback
+from struct import pack, unpack
+
+from thrift.Thrift import TType
+from thrift.transport.TTransport import TMemoryBuffer
+
+from gunicorn_thrift.thrift.transport import TCaptureTransport
+
+
+class OffloadError(Exception):
+    pass
+
+
+class ProcessOffloadPool(object):
+
+    def __init__(self, app_uri, pfactory, size):
+        # imported here so the children do not need gevent
+        from gevent.queue import Queue
+
+        self.args = [sys.executable, "-m", "gunicorn_thrift.workers.offload",
+                     app_uri, "%s.%s" % (pfactory.__class__.__module__,
+                                         pfactory.__class__.__name__)]
+        self.env = dict(os.environ)
+        self.env["PYTHONPATH"] = os.pathsep.join(p for p in sys.path if p)
+        # children waiting for a call, running holds all of them
+        self.children = Queue()
+        self.running = set()
+        self.closed = False
+        for _ in range(size):
+            self.children.put(self.spawn())
+
+    def spawn(self):
+        from gevent.subprocess import Popen, PIPE
+
+        child = Popen(self.args, stdin=PIPE, stdout=PIPE, env=self.env,
+                      close_fds=True)
+        self.running.add(child)
+        return child
+
+    def kill(self, child):
+        self.running.discard(child)
+        try:
+            child.kill()
+        except OSError:
+            pass
+        child.wait()
+
+    def replace(self, child):
+        self.kill(child)
+        if not self.closed:
+            self.children.put(self.spawn())
+
+    def call(self, name, seqid, args):
+        child = self.children.get()
+        try:
+            child.stdin.write(pack("!iii", seqid, len(name), len(args)))
+            child.stdin.write(name)
+            child.stdin.write(args)
+            child.stdin.flush()
+            header = child.stdout.read(8)
+            if len(header) < 8:
+                raise OffloadError("offload process %s exited" % child.pid)
+            status, size = unpack("!ii", header)
+            data = child.stdout.read(size)
+        except EnvironmentError as ex:
+            self.replace(child)
+            raise OffloadError("offload process %s failed: %s"
+                               % (child.pid, ex))
+        except:
+            # timed out or broken, the stream is out of sync
+            self.replace(child)
+            raise
+        self.children.put(child)
+        if status:
+            raise OffloadError(data)
+        return data
+
+    def process(self, name, seqid, iprot, oprot):
+        """a dispatch entry sending the call to a child process."""
+        trans = iprot.trans
+        iprot.trans = capture = TCaptureTransport(trans)
+        try:
+            iprot.skip(TType.STRUCT)
+        finally:
+            iprot.trans = trans
+        iprot.readMessageEnd()
+        oprot.trans.write(self.call(name, seqid, capture.getvalue()))
+        oprot.trans.flush()
+
+    def close(self):
+        """stop the children, busy ones too."""
+        self.closed = True
+        for child in list(self.running):
+            self.kill(child)
+
+
+def serve(app_uri, pfactory_uri, rfile, wfile):
+    from gunicorn_thrift.app.thriftapp import ThriftApplication
+    from gunicorn_thrift.config import load_factory, PROTOCOL_FACTORIES
+    from gunicorn_thrift.workers.base import ThriftWorkerMixin
+
+    pfactory = load_factory(pfactory_uri, PROTOCOL_FACTORIES)
+    mixin = ThriftWorkerMixin()
+    mixin.pfactory = pfactory
+    dispatch = mixin.build_dispatch(ThriftApplication.load_app(app_uri))
+
+    while True:
+        header = rfile.read(12)
+        if len(header) < 12:
+            return
+        seqid, name_len, args_len = unpack("!iii", header)
+        name = rfile.read(name_len)
+        args = rfile.read(args_len)
+        otrans = TMemoryBuffer()
+        try:
+            dispatch[name](seqid, pfactory.getProtocol(TMemoryBuffer(args)),
+                           pfactory.getProtocol(otrans))
+            status, data = 0, otrans.getvalue()
+        except Exception:
+            status, data = 1, traceback.format_exc()
+        wfile.write(pack("!ii", status, len(data)))
+        wfile.write(data)
+        wfile.flush()
+
+
+def main():
+    # keep stdout for replies, anything the handler prints goes to stderr
+    rfile = os.fdopen(os.dup(0), "rb")
+    wfile = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    try:
+        serve(sys.argv[1], sys.argv[2], rfile, wfile)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
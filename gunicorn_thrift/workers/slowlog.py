@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -
+"""log the calls slower than thrift_slow_threshold with their phases.
+
+a PhaseClock timestamps a call through the protocol and transport methods
+the generated processors call, set as attributes of the connection's
+protocol objects (fastbinary still sees their class). Each phase ends at:
+
+    queued   the start of its greenlet, for pipelined frames
+    read     readMessageEnd, the arguments are decoded
+    handler  writeMessageBegin of the reply
+    encode   the flush of the reply transport
+    write    the reply written to the client
+
+a phase whose end is not seen is merged into the next one, read into the
+handler. Calls still running at the threshold get the stack of their
+greenlet taken, as soon as the hub runs.
+"""
+
+import time
+import traceback
+
+import gevent
+
+PHASES = ("queued", "read", "handler", "encode", "write")
+
+
+class PhaseClock(object):
+
+    def __init__(self, iprot, oprot):
+        self.received = self.started = 0
+        # phase -> time it ended
+        self.marks = {}
+        iprot.readMessageEnd = self.marking("read", iprot.readMessageEnd)
+        oprot.writeMessageBegin = self.marking(
+            "handler", oprot.writeMessageBegin)
+        oprot.trans.flush = self.marking("encode", oprot.trans.flush)
+
+    def marking(self, phase, method):
+        marks = self.marks
+
+        def marked(*args):
+            if phase not in marks:
+                marks[phase] = time.time()
+            return method(*args)
+        return marked
+
+    def start(self, received, started=None):
+        self.marks.clear()
+        self.received = received
+        self.started = started or received
+
+    def phases(self, end):
+        """[(phase, seconds)] of a call ending at end."""
+        marks = self.marks
+        times = [self.received, self.started, marks.get("read"),
+                 marks.get("handler"), marks.get("encode"), end]
+        if times[2] is None:
+            times[2] = times[1]
+        for i in (4, 3):
+            if times[i] is None:
+                times[i] = times[i + 1]
+        return [(phase, max(times[i + 1] - times[i], 0))
+                for i, phase in enumerate(PHASES)]
+
+
+class SlowLog(object):
+
+    def __init__(self, log, threshold, timer):
+        """timer is the TimerWheel of the worker."""
+        self.log = log
+        self.threshold = threshold
+        # greenlet -> (time, formatted stack)
+        self.stacks = {}
+        self.timer = timer
+
+    def begin(self, clock, received=None):
+        """start timing a call on clock, received when it was read."""
+        now = time.time()
+        clock.start(received or now, now)
+        self.timer.add(gevent.getcurrent(),
+                       self.threshold - (now - clock.received),
+                       self.take_stack)
+
+    def take_stack(self, greenlet, seconds):
+        frame = greenlet.gr_frame
+        if frame is not None:
+            self.stacks[greenlet] = (
+                time.time(), "".join(traceback.format_stack(frame)))
+
+    def cancel(self):
+        current = gevent.getcurrent()
+        self.timer.cancel(current, self.take_stack)
+        return self.stacks.pop(current, None)
+
+    def end(self, clock, addr, name):
+        """log the call begun on clock when it was slow."""
+        stack = self.cancel()
+        end = time.time()
+        finish = end - clock.received
+        if finish < self.threshold:
+            return
+        if stack is not None:
+            stack = (stack[0] - clock.received, stack[1])
+        self.log.slow(addr, name, finish, clock.phases(end), stack)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -
+"""a hashed timer wheel throwing Deadline into greenlets that overrun.
+
+one greenlet ticks every TICK seconds and fires the deadlines of the
+slot it reaches, so scheduling and cancelling a deadline are a set add and
+discard instead of a timer watcher on the hub each. It only runs while
+deadlines are pending. Deadlines fire up to one tick late. A deadline
+added with expired calls expired(greenlet, seconds) instead of throwing,
+a greenlet has one deadline per expired function at most.
+"""
+
+import time
+
+import gevent
+from gevent.hub import get_hub
+
+
+class Deadline(BaseException):
+
+    """raised in a greenlet past its deadline.
+
+    a BaseException like gevent.Timeout, so handlers catching Exception do
+    not swallow it.
+    """
+
+    def __init__(self, seconds):
+        BaseException.__init__(self, seconds)
+        self.seconds = seconds
+
+    def __str__(self):
+        return "%s seconds" % self.seconds
+
+
+class TimerWheel(object):
+
+    TICK = 0.01
+    SLOTS = 512
+
+    def __init__(self, tick=TICK, slots=SLOTS):
+        self.tick = tick
+        self.wheel = [set() for _ in range(slots)]
+        # (greenlet, expired) -> (tick, seconds)
+        self.deadlines = {}
+        self.current = int(time.time() / tick)
+        self.loop = get_hub().loop
+        self.greenlet = None
+
+    def add(self, greenlet, seconds, expired=None):
+        """schedule Deadline(seconds) for greenlet, or expired, replacing
+        the deadline it had."""
+        key = (greenlet, expired or self.throw)
+        self._cancel(key)
+        now = time.time()
+        if self.greenlet is None:
+            # nothing was pending, the ticks while stopped are empty
+            self.current = int(now / self.tick)
+            self.greenlet = gevent.spawn(self._run)
+        tick = int((now + seconds) / self.tick) + 1
+        if tick <= self.current:
+            tick = self.current + 1
+        self.deadlines[key] = (tick, seconds)
+        self.wheel[tick % len(self.wheel)].add(key)
+
+    def cancel(self, greenlet, expired=None):
+        self._cancel((greenlet, expired or self.throw))
+
+    def _cancel(self, key):
+        deadline = self.deadlines.pop(key, None)
+        if deadline is not None:
+            self.wheel[deadline[0] % len(self.wheel)].discard(key)
+
+    def _run(self):
+        while self.deadlines:
+            gevent.sleep(self.tick)
+            now = int(time.time() / self.tick)
+            # catch up on the ticks missed while the hub was busy, one
+            # round is enough after a long stall or a clock jump
+            self.current = max(self.current, now - len(self.wheel))
+            while self.current < now:
+                self.current += 1
+                self._expire(self.current)
+        self.greenlet = None
+
+    def _expire(self, tick):
+        slot = self.wheel[tick % len(self.wheel)]
+        if not slot:
+            return
+        deadlines = self.deadlines
+        for key in [k for k in slot if deadlines[k][0] <= tick]:
+            slot.discard(key)
+            # the greenlet may finish before the callback runs
+            self.loop.run_callback(self._fire, key, deadlines[key])
+
+    def _fire(self, key, deadline):
+        if self.deadlines.get(key) is deadline:
+            del self.deadlines[key]
+            greenlet, expired = key
+            if not greenlet.dead:
+                expired(greenlet, deadline[1])
+
+    def throw(self, greenlet, seconds):
+        greenlet.throw(Deadline(seconds))
+
+    def close(self):
+        if self.greenlet is not None:
+            self.greenlet.kill()
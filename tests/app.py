@@ -0,0 +1,40 @@
+# coding:utf8
+"""Ping handlers for the worker tests, msg selects what a call does:
+
+    "sleep:S"   time.sleep(S), cooperative under the gevent worker
+    "spin:S"    busy loop for S seconds
+    "fail"      raise ValueError
+    "pid"       the pid of the process running the handler
+    anything else is echoed back
+"""
+import os
+import time
+
+from ping import Ping
+
+
+class PingHandler(object):
+
+    def __init__(self, prefix=u""):
+        self.prefix = prefix
+
+    def send_ping(self, msg):
+        kind, _, arg = msg.partition(u":")
+        if kind == u"sleep":
+            time.sleep(float(arg))
+        elif kind == u"spin":
+            end = time.time() + float(arg)
+            while time.time() < end:
+                pass
+        elif kind == u"fail":
+            raise ValueError(msg)
+        elif kind == u"pid":
+            return u"%d" % os.getpid()
+        return self.prefix + msg
+
+
+def make_processor(prefix=u""):
+    return Ping.Processor(PingHandler(prefix))
+
+
+processor = make_processor()
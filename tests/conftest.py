@@ -0,0 +1,26 @@
+# coding:utf8
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# the Ping example service
+sys.path.insert(0, os.path.join(ROOT, "examples"))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def server(tmpdir):
+    """start(*args, **kw) runs a server.Server, stopped after the test."""
+    from server import Server
+
+    servers = []
+
+    def start(*args, **kw):
+        servers.append(Server(tmpdir.mkdir("server%d" % len(servers)),
+                              args, **kw))
+        return servers[-1]
+    yield start
+    for s in servers:
+        s.stop()
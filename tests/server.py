@@ -0,0 +1,136 @@
+# coding:utf8
+"""run gunicorn_thrift serving tests/app.py, and talk to it."""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from thrift.Thrift import TApplicationException, TMessageType
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.transport.TSocket import TSocket
+from thrift.transport.TTransport import TBufferedTransport
+from thrift.transport.TTransport import TFramedTransport
+
+from ping.Ping import send_ping_args, send_ping_result
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS)
+GEVENT_WORKER = "gunicorn_thrift.workers.gthriftgevent.ThriftGeventWorker"
+THREAD_WORKER = "gunicorn_thrift.workers.gthriftthread.ThriftThreadWorker"
+ASYNCIO_WORKER = \
+    "gunicorn_thrift.workers.gthriftasyncio.ThriftAsyncioWorker"
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for(check, timeout=10, interval=0.05):
+    """poll check until it returns something true, return it."""
+    end = time.time() + timeout
+    while True:
+        value = check()
+        if value or time.time() > end:
+            return value
+        time.sleep(interval)
+
+
+class Server(object):
+
+    """a gunicorn_thrift arbiter with one worker by default."""
+
+    def __init__(self, tmpdir, args=(), app="app:processor",
+                 worker_class=GEVENT_WORKER, workers=1):
+        self.port = free_port()
+        self.error_log = str(tmpdir.join("error.log"))
+        self.access_log = str(tmpdir.join("access.log"))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [ROOT, os.path.join(ROOT, "examples"), TESTS])
+        cmd = [sys.executable, "-c",
+               "from gunicorn_thrift.app.thriftapp import run; run()",
+               "--bind", "127.0.0.1:%d" % self.port,
+               "--workers", str(workers), "--worker-class", worker_class,
+               "--logger-class", "gunicorn_thrift.thriftlogging.ThriftLogger",
+               "--error-logfile", self.error_log,
+               "--access-logfile", self.access_log,
+               "--log-level", "debug"] + list(args) + [app]
+        self.proc = subprocess.Popen(cmd, env=env, cwd=TESTS)
+        if not wait_for(self.accepts):
+            self.stop()
+            raise RuntimeError("server did not start:\n" + self.errors())
+
+    def accepts(self):
+        try:
+            socket.create_connection(("127.0.0.1", self.port)).close()
+            return True
+        except socket.error:
+            return False
+
+    def client(self, framed=False):
+        return Client(self.port, framed)
+
+    def errors(self):
+        with open(self.error_log) as f:
+            return f.read()
+
+    def access(self):
+        """the access log lines written so far."""
+        with open(self.access_log) as f:
+            return f.read().splitlines()
+
+    def stop(self, sig=signal.SIGTERM):
+        if self.proc.poll() is None:
+            self.proc.send_signal(sig)
+        if not wait_for(lambda: self.proc.poll() is not None, 30):
+            self.proc.kill()
+        return self.proc.wait()
+
+
+class Client(object):
+
+    """a connection sending send_ping calls and reading their replies
+    apart, so calls can be pipelined."""
+
+    def __init__(self, port, framed=False, timeout=10):
+        self.sock = TSocket("127.0.0.1", port)
+        self.sock.setTimeout(timeout * 1000)
+        if framed:
+            self.trans = TFramedTransport(self.sock)
+        else:
+            self.trans = TBufferedTransport(self.sock)
+        self.prot = TBinaryProtocol(self.trans)
+        self.trans.open()
+
+    def send(self, msg, seqid=1, name="send_ping"):
+        self.prot.writeMessageBegin(name, TMessageType.CALL, seqid)
+        send_ping_args(msg=msg).write(self.prot)
+        self.prot.writeMessageEnd()
+        self.trans.flush()
+
+    def receive(self):
+        """(name, type, seqid, result), result is the reply string or the
+        TApplicationException."""
+        (name, type, seqid) = self.prot.readMessageBegin()
+        if type == TMessageType.EXCEPTION:
+            result = TApplicationException()
+            result.read(self.prot)
+        else:
+            reply = send_ping_result()
+            reply.read(self.prot)
+            result = reply.success
+        self.prot.readMessageEnd()
+        return name, type, seqid, result
+
+    def call(self, msg, seqid=1, name="send_ping"):
+        self.send(msg, seqid, name)
+        return self.receive()
+
+    def close(self):
+        self.trans.close()
@@ -0,0 +1,88 @@
+# coding:utf8
+import pytest
+
+from thrift.Thrift import TMessageType
+from thrift.protocol.TBinaryProtocol import TBinaryProtocolAccelerated
+from thrift.transport.TTransport import TMemoryBuffer
+
+from ping import Ping
+
+from gunicorn_thrift.thrift import protocol
+from gunicorn_thrift.thrift.protocol import TBinaryProtocolExt
+from gunicorn_thrift.thrift.protocol import decode_strings, encode_strings
+from gunicorn_thrift.workers.base import ThriftWorkerMixin
+
+pytestmark = pytest.mark.skipif(protocol.fastbinary is None,
+                                reason="fastbinary is not installed")
+
+TEXT = u"h\xe9llo 世界"
+
+
+class Handler(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def send_ping(self, msg):
+        self.calls.append(msg)
+        return msg
+
+
+def call(process, pfactory, msg):
+    otrans = TMemoryBuffer()
+    oprot = pfactory.getProtocol(otrans)
+    oprot.writeMessageBegin("send_ping", TMessageType.CALL, 1)
+    Ping.send_ping_args(msg=msg).write(oprot)
+    oprot.writeMessageEnd()
+    iprot = pfactory.getProtocol(TMemoryBuffer(otrans.getvalue()))
+    iprot.readMessageBegin()
+    out = TMemoryBuffer()
+    process(1, iprot, pfactory.getProtocol(out))
+    return out.getvalue()
+
+
+def test_uses_fastbinary():
+    pfactory = protocol.TBinaryProtocolAcceleratedFactoryExt()
+    assert pfactory.accelerated()
+    assert pfactory.getProtocol(TMemoryBuffer()).__class__ is \
+        TBinaryProtocolAccelerated
+    pfactory.set_limits(string_limit=10)
+    assert not pfactory.accelerated()
+    assert pfactory.getProtocol(TMemoryBuffer()).__class__ is \
+        TBinaryProtocolExt
+
+
+def test_handlers_get_unicode():
+    pfactory = protocol.TBinaryProtocolAcceleratedFactoryExt()
+    handler = Handler()
+    mixin = ThriftWorkerMixin()
+    mixin.pfactory = pfactory
+    process = mixin.build_dispatch(Ping.Processor(handler))["send_ping"]
+    data = call(process, pfactory, TEXT.encode("utf8"))
+    assert handler.calls == [TEXT]
+    assert type(handler.calls[0]) is unicode
+
+    # the reply is what the binary protocol sends
+    binary = ThriftWorkerMixin()
+    binary.pfactory = protocol.TBinaryProtocolFactoryExt()
+    process = binary.build_dispatch(Ping.Processor(Handler()))["send_ping"]
+    assert data == call(process, binary.pfactory, TEXT)
+
+
+def test_processor_left_alone():
+    handler = Handler()
+    processor = Ping.Processor(handler)
+    mixin = ThriftWorkerMixin()
+    mixin.pfactory = protocol.TBinaryProtocolAcceleratedFactoryExt()
+    mixin.build_dispatch({"Ping": processor})
+    assert processor._handler is handler
+
+
+def test_convert_strings():
+    args = Ping.send_ping_args(msg=TEXT.encode("utf8"))
+    value = decode_strings([{"k": args}, set(["a"]), 1, None])
+    assert value == [{u"k": Ping.send_ping_args(msg=TEXT)}, set([u"a"]),
+                     1, None]
+    # structs are copied
+    assert args.msg == TEXT.encode("utf8")
+    assert encode_strings(value) == [{"k": args}, set(["a"]), 1, None]
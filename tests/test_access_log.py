@@ -0,0 +1,92 @@
+# coding:utf8
+import os
+
+import pytest
+from gunicorn.config import Config
+
+# registers the thrift settings with Config
+import gunicorn_thrift.config  # noqa
+from gunicorn_thrift.thriftlogging import ThriftLogger
+from server import wait_for
+
+ADDR = ("10.0.0.1", 4242)
+
+
+@pytest.fixture
+def logger(tmpdir):
+    """logger(**settings) a ThriftLogger writing to tmpdir, its writer is
+    not started so tests flush the buffer themselves."""
+    loggers = []
+
+    def make(**settings):
+        cfg = Config()
+        cfg.set("accesslog", str(tmpdir.join("access.log")))
+        cfg.set("errorlog", str(tmpdir.join("error.log")))
+        for name, value in settings.items():
+            cfg.set(name, value)
+        log = ThriftLogger(cfg)
+        log._access_writer_pid = os.getpid()
+        loggers.append(log)
+        return log
+    yield make
+    for log in loggers:
+        for handler in log.access_log.handlers + log.error_log.handlers:
+            handler.close()
+
+
+def lines(tmpdir, name="access.log"):
+    return tmpdir.join(name).read().splitlines()
+
+
+def test_now_cached_per_second(logger):
+    log = logger()
+    first = log.now(1000.2)
+    assert log.now(1000.9) is first
+    assert log.now(1001.0) != first
+
+
+def test_records_buffered_until_flushed(logger, tmpdir):
+    log = logger()
+    log.access(ADDR, "send_ping", "OK", 0.002)
+    log.access(ADDR, "send_ping", "TIMEOUT", 0.5)
+    assert lines(tmpdir) == []
+    log.flush_access()
+    written = lines(tmpdir)
+    assert [line.split()[0] for line in written] == ["10.0.0.1"] * 2
+    assert [line.split()[3:5] for line in written] == \
+        [["send_ping", "200"], ["send_ping", "504"]]
+    assert float(written[0].split()[5]) == pytest.approx(2)
+
+
+def test_drop_new(logger, tmpdir):
+    log = logger(thrift_access_log_buffer=2)
+    for name in ("a", "b", "c"):
+        log.access(ADDR, name, "OK", 0)
+    assert log.access_dropped == 1
+    log.flush_access()
+    assert [line.split()[3] for line in lines(tmpdir)] == ["a", "b"]
+    assert "1 lines dropped" in tmpdir.join("error.log").read()
+
+
+def test_drop_old(logger, tmpdir):
+    log = logger(thrift_access_log_buffer=2,
+                 thrift_access_log_overflow="drop_old")
+    for name in ("a", "b", "c"):
+        log.access(ADDR, name, "OK", 0)
+    assert log.access_dropped == 1
+    log.flush_access()
+    assert [line.split()[3] for line in lines(tmpdir)] == ["b", "c"]
+
+
+def test_unbuffered(logger, tmpdir):
+    log = logger(thrift_access_log_buffer=0)
+    log.access(ADDR, "send_ping", "OK", 0)
+    assert len(lines(tmpdir)) == 1
+
+
+def test_server_writes_buffered_lines(server):
+    s = server()
+    client = s.client()
+    for i in range(3):
+        client.call(u"hi")
+    assert wait_for(lambda: len(s.access()) == 3)
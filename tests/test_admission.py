@@ -0,0 +1,134 @@
+# coding:utf8
+import time
+
+import gevent
+import pytest
+from thrift.Thrift import TApplicationException, TMessageType
+
+from gunicorn_thrift.stats import fetch_stats
+from gunicorn_thrift.workers.admission import AdmissionControl, Bulkhead
+from server import wait_for
+
+
+def end_interval(control):
+    control.interval_start = time.time() - 2 * control.INTERVAL
+
+
+def test_max_in_flight():
+    control = AdmissionControl(max_in_flight=2)
+    assert control.admit()
+    assert control.admit()
+    assert not control.admit()
+    assert control.rejected == 1
+    control.release()
+    assert control.admit()
+    assert control.in_flight == 2
+
+
+def test_standing_queue_cuts_share():
+    control = AdmissionControl(target=0.005)
+    control.observe(0.02)
+    end_interval(control)
+    control.observe(0.01)
+    assert control.ratio == control.DECREASE
+    for _ in range(100):
+        end_interval(control)
+        control.observe(0.01)
+    assert control.ratio == control.MIN_RATIO
+
+
+def test_burst_keeps_share():
+    control = AdmissionControl(target=0.005)
+    control.observe(0.05)
+    # the queue drained once during the interval
+    control.observe(0.001)
+    end_interval(control)
+    control.observe(0.05)
+    assert control.ratio == 1.0
+
+
+def test_share_grows_back():
+    control = AdmissionControl(target=0.005)
+    control.ratio = 0.5
+    end_interval(control)
+    control.observe(0)
+    assert control.ratio == pytest.approx(0.5 + control.INCREASE)
+    for _ in range(30):
+        end_interval(control)
+        control.observe(0)
+    assert control.ratio == 1.0
+
+
+def test_share_rejects():
+    control = AdmissionControl(target=0.005)
+    control.ratio = 0.1
+    admitted = sum(control.admit() for _ in range(1000))
+    assert 30 < admitted < 200
+    assert control.rejected == 1000 - admitted
+
+
+def test_over_max_in_flight_rejected(server):
+    s = server("--thrift-max-in-flight", "1")
+    busy = s.client()
+    busy.send(u"sleep:0.5")
+    time.sleep(0.1)
+    client = s.client()
+    name, type, seqid, ex = client.call(u"hi", 2)
+    assert (name, type, seqid) == ("send_ping", TMessageType.EXCEPTION, 2)
+    assert isinstance(ex, TApplicationException)
+    assert "overloaded" in ex.message
+    assert busy.receive()[3] == u"sleep:0.5"
+    # the rejected connection stays open
+    assert client.call(u"hi", 3)[3] == u"hi"
+    assert wait_for(lambda: any(" 503 " in line for line in s.access()), 5)
+
+
+def test_bulkhead_queue():
+    bulkhead = Bulkhead(1, queue=1)
+    assert bulkhead.acquire()
+    waiter = gevent.spawn(bulkhead.acquire)
+    gevent.sleep(0)
+    assert bulkhead.waiting == 1
+    # the queue is full
+    assert not bulkhead.acquire()
+    bulkhead.release()
+    assert waiter.get(timeout=1)
+    assert bulkhead.waiting == 0
+
+
+def test_bulkhead_without_queue():
+    bulkhead = Bulkhead(2)
+    assert bulkhead.acquire()
+    assert bulkhead.acquire()
+    assert not bulkhead.acquire()
+    bulkhead.release()
+    assert bulkhead.acquire()
+
+
+def test_method_over_concurrency_rejected(server):
+    s = server("--thrift-method-concurrency", "send_ping=1",
+               "--thrift-stats-endpoint")
+    busy = s.client()
+    busy.send(u"sleep:0.5")
+    time.sleep(0.1)
+    client = s.client()
+    name, type, seqid, ex = client.call(u"hi", 2)
+    assert (type, seqid) == (TMessageType.EXCEPTION, 2)
+    assert isinstance(ex, TApplicationException)
+    # other methods are not limited
+    assert "send_ping" in fetch_stats("127.0.0.1", s.port, timeout=5)[
+        "methods"]
+    assert busy.receive()[3] == u"sleep:0.5"
+    assert client.call(u"hi", 3)[3] == u"hi"
+
+
+def test_method_calls_queued(server):
+    s = server("--thrift-method-concurrency", "send_ping=1",
+               "--thrift-bulkhead-queue", "1")
+    busy = s.client()
+    busy.send(u"sleep:0.3")
+    time.sleep(0.1)
+    start = time.time()
+    assert s.client().call(u"hi")[3] == u"hi"
+    assert time.time() - start > 0.1
+    assert busy.receive()[3] == u"sleep:0.3"
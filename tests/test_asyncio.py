@@ -0,0 +1,123 @@
+# coding:utf8
+import socket
+import sys
+import time
+
+import pytest
+from thrift.Thrift import TApplicationException, TMessageType
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.protocol.TBinaryProtocol import TBinaryProtocolFactory
+from thrift.transport.TTransport import TMemoryBuffer
+
+from app import processor
+from ping.Ping import send_ping_args
+from server import ASYNCIO_WORKER, wait_for
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 5),
+                                reason="the asyncio worker needs python 3.5")
+
+BINARY = ("--thrift-protocol-factory", "binary")
+
+
+def message(msg, seqid=1):
+    buf = TMemoryBuffer()
+    prot = TBinaryProtocol(buf)
+    prot.writeMessageBegin("send_ping", TMessageType.CALL, seqid)
+    send_ping_args(msg=msg).write(prot)
+    prot.writeMessageEnd()
+    return buf.getvalue()
+
+
+def parser():
+    """a worker reading calls of the tests' Ping processor."""
+    from gunicorn_thrift.workers import _gthriftasyncio
+
+    worker = _gthriftasyncio.ThriftAsyncioWorker.__new__(
+        _gthriftasyncio.ThriftAsyncioWorker)
+    worker.pfactory = TBinaryProtocolFactory()
+    worker.dispatch = {
+        "send_ping": _gthriftasyncio.AsyncProcess(processor, "send_ping")}
+    return worker
+
+
+def test_parse_message_decodes_arguments():
+    data = message(u"hi", 7) + message(u"next", 8)
+    size, ((name, type, seqid), args) = parser().parse_message(data)
+    assert size == len(message(u"hi", 7))
+    assert (name, type, seqid) == ("send_ping", TMessageType.CALL, 7)
+    assert args.msg == u"hi"
+
+
+def test_parse_message_incomplete():
+    data = message(u"hello")
+    assert parser().parse_message(data[:-3]) is None
+
+
+def test_parse_message_skips_other_processes():
+    worker = parser()
+    worker.dispatch["send_ping"] = worker.process_stats
+    size, (header, args) = worker.parse_message(message(u"hi"))
+    assert size == len(message(u"hi"))
+    assert args is None
+
+
+def test_call(server):
+    client = server(*BINARY, worker_class=ASYNCIO_WORKER).client()
+    assert client.call(u"hi") == ("send_ping", TMessageType.REPLY, 1, u"hi")
+
+
+def test_messages_in_one_write(server):
+    client = server(*BINARY, worker_class=ASYNCIO_WORKER).client()
+    client.sock.write(b"".join(message(u"m%d" % i, i) for i in range(1, 4)))
+    for i in range(1, 4):
+        assert client.receive() == \
+            ("send_ping", TMessageType.REPLY, i, u"m%d" % i)
+
+
+def test_large_unframed_message(server):
+    # past STREAM_AFTER, read through the executor
+    msg = u"x" * 200000
+    client = server(*BINARY, worker_class=ASYNCIO_WORKER).client()
+    assert client.call(msg)[3] == msg
+    assert client.call(u"after")[3] == u"after"
+
+
+def test_slow_sender_is_not_idle(server):
+    client = server("--thrift-idle-timeout", "0.5", *BINARY,
+                    worker_class=ASYNCIO_WORKER).client()
+    data = message(u"slow")
+    client.sock.write(data[:10])
+    time.sleep(1)
+    client.sock.write(data[10:])
+    assert client.receive()[3] == u"slow"
+
+
+def test_idle_connection_closed(server):
+    s = server("--thrift-idle-timeout", "0.5", *BINARY,
+               worker_class=ASYNCIO_WORKER)
+    sock = socket.create_connection(("127.0.0.1", s.port))
+    sock.settimeout(5)
+    assert sock.recv(1) == b""
+    assert "Closing idle connection" in s.errors()
+
+
+def test_oversized_frame_skipped(server):
+    s = server("--thrift-transport-factory", "framed",
+               "--thrift-max-message-size", "1024", *BINARY,
+               worker_class=ASYNCIO_WORKER)
+    client = s.client(framed=True)
+    name, type, seqid, ex = client.call(u"x" * 4096, 3)
+    assert (name, type, seqid) == ("send_ping", TMessageType.EXCEPTION, 3)
+    assert isinstance(ex, TApplicationException)
+    # the frame was read past, the connection goes on
+    assert client.call(u"after", 4)[3] == u"after"
+    assert wait_for(lambda: any(" 413 " in line for line in s.access()))
+
+
+def test_oversized_unframed_message(server):
+    s = server("--thrift-max-message-size", "1024", *BINARY,
+               worker_class=ASYNCIO_WORKER)
+    client = s.client()
+    name, type, seqid, ex = client.call(u"x" * 4096, 3)
+    assert (name, type, seqid) == ("send_ping", TMessageType.EXCEPTION, 3)
+    assert isinstance(ex, TApplicationException)
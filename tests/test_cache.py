@@ -0,0 +1,144 @@
+# coding:utf8
+from functools import partial
+
+import pytest
+
+from thrift.Thrift import TMessageType
+from thrift.transport.TTransport import TMemoryBuffer
+
+from ping import Ping
+
+from gunicorn_thrift.thrift.protocol import TBinaryProtocolFactoryExt
+from gunicorn_thrift.workers import cache as cache_module
+from gunicorn_thrift.workers.cache import ResponseCache
+
+PFACTORY = TBinaryProtocolFactoryExt()
+OVERHEAD = ResponseCache.OVERHEAD
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.hits = []
+
+    def cache(self, name, hit):
+        self.hits.append(hit)
+
+
+class Handler(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def send_ping(self, msg):
+        self.calls.append(msg)
+        return msg
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    return now
+
+
+def call(process, name, msg, seqid):
+    """run process on a send_ping call named name, return the reply header
+    and result."""
+    otrans = TMemoryBuffer()
+    oprot = PFACTORY.getProtocol(otrans)
+    oprot.writeMessageBegin(name, TMessageType.CALL, seqid)
+    Ping.send_ping_args(msg=msg).write(oprot)
+    oprot.writeMessageEnd()
+    iprot = PFACTORY.getProtocol(TMemoryBuffer(otrans.getvalue()))
+    iprot.readMessageBegin()
+    out = TMemoryBuffer()
+    process(seqid, iprot, PFACTORY.getProtocol(out))
+    iprot = PFACTORY.getProtocol(TMemoryBuffer(out.getvalue()))
+    header = iprot.readMessageBegin()
+    result = Ping.send_ping_result()
+    result.read(iprot)
+    return header, result.success
+
+
+def test_lru_eviction(clock):
+    cache = ResponseCache(PFACTORY, {}, 3 * (OVERHEAD + 3))
+    for key in ("a", "b", "c"):
+        cache.put((key, b"x"), key, b"y", 60)
+    assert cache.get(("a", b"x")) == ("a", b"y")
+    # b is the least recently used now
+    cache.put(("d", b"x"), "d", b"y", 60)
+    assert cache.get(("b", b"x")) is None
+    assert cache.get(("a", b"x")) == ("a", b"y")
+    assert cache.get(("d", b"x")) == ("d", b"y")
+    assert cache.summary() == {
+        "entries": 3, "bytes": 3 * (OVERHEAD + 3), "evictions": 1}
+
+
+def test_entry_over_max_bytes(clock):
+    cache = ResponseCache(PFACTORY, {}, OVERHEAD + 3)
+    cache.put(("a", b"x"), "a", b"yy", 60)
+    assert cache.get(("a", b"x")) is None
+    assert cache.summary()["bytes"] == 0
+
+
+def test_ttl(clock):
+    cache = ResponseCache(PFACTORY, {}, 1 << 20)
+    cache.put(("a", b"x"), "a", b"y", 10)
+    clock[0] += 10
+    assert cache.get(("a", b"x")) == ("a", b"y")
+    clock[0] += 0.1
+    assert cache.get(("a", b"x")) is None
+    assert cache.summary() == {"entries": 0, "bytes": 0, "evictions": 0}
+
+
+def test_replace_keeps_size(clock):
+    cache = ResponseCache(PFACTORY, {}, 1 << 20)
+    cache.put(("a", b"x"), "a", b"y", 10)
+    cache.put(("a", b"x"), "a", b"zz", 10)
+    assert cache.get(("a", b"x")) == ("a", b"zz")
+    assert cache.summary()["bytes"] == OVERHEAD + 4
+
+
+def test_invalidate(clock):
+    cache = ResponseCache(PFACTORY, {"send_ping": 60}, 1 << 20)
+    handler = Handler()
+    process = cache.wrap(
+        "send_ping", partial(Ping.Processor.process_send_ping,
+                             Ping.Processor(handler)))
+    call(process, "send_ping", u"a", 1)
+    call(process, "send_ping", u"b", 2)
+    cache_module.invalidate("send_ping", Ping.send_ping_args(msg=u"a"))
+    call(process, "send_ping", u"a", 3)
+    call(process, "send_ping", u"b", 4)
+    assert handler.calls == [u"a", u"b", u"a"]
+    cache.invalidate()
+    assert cache.summary()["entries"] == 0
+
+
+@pytest.mark.parametrize("name", ["send_ping", "Ping:send_ping"])
+def test_hits_answer_like_misses(clock, name):
+    handler = Handler()
+    stats = Stats()
+    cache = ResponseCache(PFACTORY, {name: 60}, 1 << 20, stats)
+    # multiplexed processors reply with the bare method name
+    process = cache.wrap(
+        name, partial(Ping.Processor.process_send_ping,
+                      Ping.Processor(handler)))
+    replies = [call(process, name, u"hi", seqid) for seqid in (1, 2, 3)]
+    assert handler.calls == [u"hi"]
+    assert stats.hits == [False, True, True]
+    # the header of the miss, with the seqid of each call
+    (reply_name, type, _), result = replies[0]
+    assert replies == [((reply_name, type, seqid), result)
+                       for seqid in (1, 2, 3)]
+
+
+def test_cached_multiplexed_calls(server):
+    s = server("--thrift-cache-methods", "Ping:send_ping=60",
+               app="Ping=app:processor")
+    client = s.client()
+    replies = [client.call(u"pid", seqid, "Ping:send_ping")
+               for seqid in (1, 2)]
+    assert replies == [("send_ping", TMessageType.REPLY, seqid, replies[0][3])
+                       for seqid in (1, 2)]
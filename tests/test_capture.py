@@ -0,0 +1,141 @@
+# coding:utf8
+import json
+import struct
+
+import pytest
+
+from thrift.Thrift import TMessageType
+from thrift.protocol.TCompactProtocol import TCompactProtocol
+from thrift.transport.TSocket import TSocket
+from thrift.transport.TTransport import TBufferedTransport
+
+from gunicorn_thrift.capture import CALL_HEADER, CALL_HEADER_SIZE
+from gunicorn_thrift.capture import CaptureWriter, load_capture
+from gunicorn_thrift.capture import read_records, replay
+from gunicorn_thrift.thrift.protocol import TCompactProtocolFactoryExt
+from ping import Ping
+from server import wait_for
+
+PROTOCOL = "gunicorn_thrift.thrift.protocol.TCompactProtocolFactoryExt"
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join("capture.bin"))
+
+
+def test_file_format(path):
+    writer = CaptureWriter(path, TCompactProtocolFactoryExt(), True)
+    writer.record("send_ping", TMessageType.CALL, b"\x01\x02")
+    writer.close()
+    with open(path, "rb") as f:
+        data = f.read()
+
+    assert data[:1] == b"P"
+    size, = struct.unpack("!H", data[1:3])
+    assert json.loads(data[3:3 + size].decode("utf-8")) == {
+        "protocol": PROTOCOL, "framed": True}
+    data = data[3 + size:]
+    assert data[:1] == b"C"
+    at, type, name_len, args_len = struct.unpack(
+        CALL_HEADER, data[1:1 + CALL_HEADER_SIZE])
+    assert type == TMessageType.CALL
+    assert (name_len, args_len) == (9, 2)
+    assert data[1 + CALL_HEADER_SIZE:] == b"send_ping\x01\x02"
+
+
+def test_records_round_trip(path):
+    for framed in (False, True):
+        # each worker appends its own protocol record
+        writer = CaptureWriter(path, TCompactProtocolFactoryExt(), framed)
+        writer.record(u"send_ping", TMessageType.CALL, b"args")
+        writer.record("stop", TMessageType.ONEWAY, b"")
+        writer.close()
+    records = list(read_records(path))
+    assert [r[0] for r in records] == ["P", "C", "C", "P", "C", "C"]
+    assert records[0][1]["framed"] is False
+    assert records[3][1]["framed"] is True
+    assert records[1][2:] == (TMessageType.CALL, "send_ping", b"args")
+    assert records[2][2:] == (TMessageType.ONEWAY, "stop", b"")
+
+    desc, calls = load_capture(path)
+    assert desc == {"protocol": PROTOCOL, "framed": False}
+    assert len(calls) == 4
+    assert [c[0] for c in calls] == sorted(c[0] for c in calls)
+
+
+def test_truncated_record_ignored(path):
+    writer = CaptureWriter(path, TCompactProtocolFactoryExt(), False)
+    writer.record("send_ping", TMessageType.CALL, b"args")
+    writer.close()
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:-2])
+    assert [r[0] for r in read_records(path)] == ["P"]
+
+
+def test_max_bytes(path):
+    writer = CaptureWriter(path, TCompactProtocolFactoryExt(), False,
+                           max_bytes=200)
+    assert writer.sample()
+    for _ in range(10):
+        writer.record("send_ping", TMessageType.CALL, b"x" * 20)
+    writer.close()
+    assert not writer.sample()
+    records = list(read_records(path))
+    assert 1 < len(records) < 11
+
+
+def test_max_bytes_of_all_writers(path):
+    # two workers appending to the same file
+    writers = [CaptureWriter(path, TCompactProtocolFactoryExt(), False,
+                             max_bytes=300) for _ in range(2)]
+    for _ in range(5):
+        for writer in writers:
+            writer.record("send_ping", TMessageType.CALL, b"x" * 20)
+            writer.flush()
+    for writer in writers:
+        writer.close()
+    with open(path, "rb") as f:
+        size = len(f.read())
+    assert 250 < size <= 300
+    records = list(read_records(path))
+    assert sum(len(r[4]) for r in records if r[0] == "C") == \
+        20 * (len(records) - 2)
+    assert all(not writer.sample() for writer in writers)
+
+
+def test_no_protocol_record(path):
+    with open(path, "wb") as f:
+        f.write(b"")
+    with pytest.raises(ValueError):
+        load_capture(path)
+
+
+def captured(path):
+    """the calls in the capture at path, the workers write it every
+    second."""
+    try:
+        return len(load_capture(path)[1])
+    except (IOError, ValueError):
+        return 0
+
+
+def test_replay_compact(server, path):
+    # the compact protocol of thrift 0.9 writes str only on python 2
+    s = server("--thrift-protocol-factory", "compact",
+               "--thrift-capture-file", path,
+               app="app:make_processor(prefix='')")
+    trans = TBufferedTransport(TSocket("127.0.0.1", s.port))
+    client = Ping.Client(TCompactProtocol(trans))
+    trans.open()
+    for i in range(3):
+        assert client.send_ping(u"%d" % i) == u"%d" % i
+    trans.close()
+    assert wait_for(lambda: captured(path) == 3)
+
+    report = replay(path, "127.0.0.1", s.port, speed=0, connections=2)
+    assert report["calls"] == 3
+    assert report["errors"] == 0
+    assert report["methods"]["send_ping"]["count"] == 3
@@ -0,0 +1,109 @@
+# coding:utf8
+import threading
+import time
+from functools import partial
+
+import pytest
+
+from thrift.Thrift import TMessageType
+from thrift.transport.TTransport import TMemoryBuffer
+
+from ping import Ping
+
+from gunicorn_thrift.thrift.protocol import TBinaryProtocolFactoryExt
+from gunicorn_thrift.workers.coalesce import CoalescedCallFailed
+from gunicorn_thrift.workers.coalesce import SingleFlight
+
+PFACTORY = TBinaryProtocolFactoryExt()
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.coalesced = []
+
+    def coalesce(self, name):
+        self.coalesced.append(name)
+
+
+class Handler(object):
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def send_ping(self, msg):
+        self.calls.append(msg)
+        self.release.wait(5)
+        if msg == u"boom":
+            raise ValueError(msg)
+        return msg
+
+
+def call(process, name, seqid, replies):
+    otrans = TMemoryBuffer()
+    oprot = PFACTORY.getProtocol(otrans)
+    oprot.writeMessageBegin(name, TMessageType.CALL, seqid)
+    Ping.send_ping_args(msg=u"boom" if seqid < 0 else u"hi").write(oprot)
+    oprot.writeMessageEnd()
+    iprot = PFACTORY.getProtocol(TMemoryBuffer(otrans.getvalue()))
+    iprot.readMessageBegin()
+    out = TMemoryBuffer()
+    try:
+        process(seqid, iprot, PFACTORY.getProtocol(out))
+    except Exception as ex:
+        replies.append(ex)
+        return
+    iprot = PFACTORY.getProtocol(TMemoryBuffer(out.getvalue()))
+    header = iprot.readMessageBegin()
+    result = Ping.send_ping_result()
+    result.read(iprot)
+    replies.append((header, result.success))
+
+
+def run_calls(flight, handler, name, seqids):
+    """start the calls of seqids while the first one holds the handler."""
+    process = flight.wrap(name, partial(Ping.Processor.process_send_ping,
+                                        Ping.Processor(handler)))
+    replies = []
+    threads = [threading.Thread(target=call,
+                                args=(process, name, seqid, replies))
+               for seqid in seqids]
+    threads[0].start()
+    while not handler.calls:
+        time.sleep(0.001)
+    for thread in threads[1:]:
+        thread.start()
+    # the followers wait for the flight of the first call
+    time.sleep(0.05)
+    handler.release.set()
+    for thread in threads:
+        thread.join()
+    return replies
+
+
+@pytest.mark.parametrize("name", ["send_ping", "Ping:send_ping"])
+def test_identical_calls_share_a_run(name):
+    handler = Handler()
+    stats = Stats()
+    flight = SingleFlight(PFACTORY, stats)
+    replies = run_calls(flight, handler, name, [1, 2, 3])
+    assert handler.calls == [u"hi"]
+    # followers answer like the leader, with their own seqid
+    (reply_name, type, _), result = [r for r in replies if r[0][2] == 1][0]
+    assert sorted(r for r in replies if r[0][2] != 1) == [
+        ((reply_name, type, seqid), result) for seqid in (2, 3)]
+    assert stats.coalesced == [name, name]
+    assert not flight.flights
+
+
+def test_failed_run_fails_followers():
+    handler = Handler()
+    stats = Stats()
+    flight = SingleFlight(PFACTORY, stats)
+    replies = run_calls(flight, handler, "send_ping", [-1, -2])
+    assert handler.calls == [u"boom"]
+    assert sorted(type(r).__name__ for r in replies) == [
+        CoalescedCallFailed.__name__, ValueError.__name__]
+    assert stats.coalesced == []
+    assert not flight.flights
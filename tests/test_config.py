@@ -0,0 +1,42 @@
+# coding:utf8
+import pytest
+
+from gunicorn.errors import ConfigError
+
+from gunicorn_thrift.config import PROTOCOL_FACTORIES, load_factory
+from gunicorn_thrift.config import validate_float, validate_pos_float
+from gunicorn_thrift.config import validate_rate
+from gunicorn_thrift.thrift.protocol import TBinaryProtocolFactoryExt
+
+
+def test_validate_float():
+    assert validate_float("0") == 0
+    assert validate_float(1.5) == 1.5
+    with pytest.raises(ValueError) as info:
+        validate_float(-1)
+    assert "negative" in str(info.value)
+
+
+def test_validate_pos_float():
+    assert validate_pos_float("0.5") == 0.5
+    with pytest.raises(ValueError):
+        validate_pos_float(0)
+
+
+@pytest.mark.parametrize("value", [0, "0.25", 1])
+def test_validate_rate(value):
+    assert validate_rate(value) == float(value)
+
+
+@pytest.mark.parametrize("value", [-0.1, 1.01, 2])
+def test_validate_rate_out_of_range(value):
+    with pytest.raises(ValueError):
+        validate_rate(value)
+
+
+def test_load_factory():
+    factory = load_factory("binary", PROTOCOL_FACTORIES)
+    assert isinstance(factory, TBinaryProtocolFactoryExt)
+    assert load_factory(factory, PROTOCOL_FACTORIES) is factory
+    with pytest.raises(ConfigError):
+        load_factory("no.such.Factory", PROTOCOL_FACTORIES)
@@ -0,0 +1,121 @@
+# coding:utf8
+import socket
+import time
+
+import pytest
+from thrift.transport.TTransport import TTransportException
+
+from gunicorn_thrift.stats import fetch_stats
+from server import GEVENT_WORKER, THREAD_WORKER, wait_for
+
+WORKERS = [GEVENT_WORKER, THREAD_WORKER]
+
+
+def closed(sock):
+    """the server closed sock, within its timeout."""
+    try:
+        return sock.recv(1) == b""
+    except socket.error:
+        return True
+
+
+@pytest.mark.parametrize("worker_class", WORKERS)
+def test_idle_connection_closed(server, worker_class):
+    s = server("--thrift-idle-timeout", "0.3", worker_class=worker_class)
+    sock = socket.create_connection(("127.0.0.1", s.port))
+    sock.settimeout(5)
+    start = time.time()
+    assert closed(sock)
+    assert 0.2 < time.time() - start < 3
+    assert wait_for(lambda: "Closing idle connection" in s.errors(), 5)
+
+
+@pytest.mark.parametrize("worker_class", WORKERS)
+def test_calls_reset_idle_timeout(server, worker_class):
+    client = server("--thrift-idle-timeout", "0.5",
+                    worker_class=worker_class).client()
+    for _ in range(4):
+        time.sleep(0.25)
+        assert client.call(u"hi")[3] == u"hi"
+
+
+@pytest.mark.parametrize("worker_class", WORKERS)
+def test_long_call_not_idle(server, worker_class):
+    client = server("--thrift-idle-timeout", "0.2",
+                    worker_class=worker_class).client()
+    assert client.call(u"sleep:0.6")[3] == u"sleep:0.6"
+
+
+def test_pipelined_calls_not_idle(server):
+    client = server("--thrift-idle-timeout", "0.2",
+                    "--thrift-transport-factory", "framed",
+                    "--thrift-pipeline", "2").client(framed=True)
+    client.send(u"sleep:0.6", 1)
+    assert client.receive()[3] == u"sleep:0.6"
+
+
+@pytest.mark.parametrize("worker_class", WORKERS)
+def test_max_requests_per_connection(server, worker_class):
+    s = server("--thrift-max-requests-per-connection", "2",
+               worker_class=worker_class)
+    client = s.client()
+    assert client.call(u"a", 1)[3] == u"a"
+    assert client.call(u"b", 2)[3] == u"b"
+    # closed once the second reply is written
+    with pytest.raises((TTransportException, socket.error)):
+        client.call(u"c", 3)
+    assert s.client().call(u"d")[3] == u"d"
+
+
+def test_idle_and_active_counts(server):
+    s = server("--thrift-stats-endpoint")
+    idle = [s.client() for _ in range(2)]
+    for client in idle:
+        client.call(u"hi")
+    busy = s.client()
+    busy.send(u"sleep:0.5")
+    time.sleep(0.1)
+    connections = fetch_stats("127.0.0.1", s.port, timeout=5)["connections"]
+    # the busy call and the stats call itself
+    assert connections["active"] == 2
+    assert connections["idle"] == 2
+    busy.receive()
+
+
+def test_drain_idle_connections(server):
+    s = server("--graceful-timeout", "30")
+    clients = [s.client() for _ in range(4)]
+    for client in clients:
+        client.call(u"hi")
+    start = time.time()
+    s.stop()
+    assert time.time() - start < 5
+
+
+def test_drain_finishes_calls(server):
+    s = server("--graceful-timeout", "30")
+    busy = s.client()
+    busy.send(u"sleep:0.5")
+    time.sleep(0.1)
+    start = time.time()
+    s.proc.terminate()
+    assert busy.receive()[3] == u"sleep:0.5"
+    # closed at the message boundary
+    with pytest.raises((TTransportException, socket.error)):
+        busy.call(u"after", 2)
+    s.stop()
+    assert time.time() - start < 5
+
+
+def test_drain_finishes_pipelined_calls(server):
+    s = server("--graceful-timeout", "30", "--thrift-transport-factory",
+               "framed", "--thrift-pipeline", "4")
+    client = s.client(framed=True)
+    for seqid in (1, 2):
+        client.send(u"sleep:0.4", seqid)
+    time.sleep(0.1)
+    s.proc.terminate()
+    assert sorted(client.receive()[2] for _ in range(2)) == [1, 2]
+    start = time.time()
+    s.stop()
+    assert time.time() - start < 5
@@ -0,0 +1,128 @@
+# coding:utf8
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+import pytest
+
+from thrift.Thrift import TMessageType, TType
+from thrift.transport.TTransport import TMemoryBuffer
+
+from gunicorn_thrift.stats import LatencyHistogram
+from gunicorn_thrift.thrift.protocol import TBinaryProtocolFactoryExt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..",
+                                "benchmarks"))
+from loadgen import Connection, compare  # noqa: E402
+
+from ping.Ping import send_ping_result  # noqa: E402
+
+PFACTORY = TBinaryProtocolFactoryExt()
+
+
+def read_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+def serve_framed(sock, frames):
+    """answer frames holding a single call, close on any other."""
+    try:
+        while True:
+            size, = struct.unpack("!i", read_exactly(sock, 4))
+            frame = read_exactly(sock, size)
+            frames.append(frame)
+            itrans = TMemoryBuffer(frame)
+            iprot = PFACTORY.getProtocol(itrans)
+            (name, type, seqid) = iprot.readMessageBegin()
+            iprot.skip(TType.STRUCT)
+            iprot.readMessageEnd()
+            if itrans.cstringio_buf.read():
+                return
+            otrans = TMemoryBuffer()
+            oprot = PFACTORY.getProtocol(otrans)
+            oprot.writeMessageBegin(name, TMessageType.REPLY, seqid)
+            send_ping_result(success=u"pong").write(oprot)
+            oprot.writeMessageEnd()
+            reply = otrans.getvalue()
+            sock.sendall(struct.pack("!i", len(reply)) + reply)
+    except EOFError:
+        pass
+    finally:
+        sock.close()
+
+
+@pytest.fixture
+def framed_server():
+    """a server thread answering one connection, and the frames it got."""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    frames = []
+
+    def accept():
+        sock, _ = listener.accept()
+        serve_framed(sock, frames)
+    thread = threading.Thread(target=accept)
+    thread.daemon = True
+    thread.start()
+    yield listener.getsockname()[1], frames
+    listener.close()
+
+
+def test_framed_pipeline_one_message_per_frame(framed_server):
+    port, frames = framed_server
+    histogram = LatencyHistogram()
+    connection = Connection({
+        "host": "127.0.0.1", "port": port, "protocol": "binary",
+        "transport": "framed", "payload": 16, "pipeline": 4,
+    }, histogram)
+    start = time.time()
+    connection.run(start, start + 0.2)
+    assert connection.errors == 0
+    assert not connection.sent
+    assert histogram.count > 0
+    assert len(frames) == connection.seqid
+
+
+@pytest.mark.parametrize("transport", ["buffered", "framed"])
+def test_pipelined_calls_against_worker(server, transport):
+    s = server("--thrift-transport-factory", transport,
+               "--thrift-pipeline", "4")
+    histogram = LatencyHistogram()
+    connection = Connection({
+        "host": "127.0.0.1", "port": s.port, "protocol": "binary",
+        "transport": transport, "payload": 64, "pipeline": 4,
+    }, histogram)
+    start = time.time()
+    connection.run(start, start + 0.2)
+    assert connection.errors == 0
+    # every call answered, the ones still in flight at the end uncounted
+    assert not connection.sent
+    assert connection.seqid - 4 <= histogram.count <= connection.seqid
+
+
+def result(throughput, p99, **conf):
+    result = {"protocol": "binary", "transport": "framed", "connections": 8,
+              "pipeline": 1, "payload": 16, "throughput": throughput,
+              "latency_ms": {"p99": p99}}
+    result.update(conf)
+    return result
+
+
+def test_compare_to_baseline(capsys):
+    baseline = {"results": [result(1000, 2.0), result(500, 4.0, payload=4096)]}
+    compare([result(1100, 1.5), result(700, 1.0, pipeline=4)], baseline)
+    lines = capsys.readouterr().err.splitlines()
+    assert len(lines) == 1
+    assert "binary framed 8 1 16" in lines[0]
+    assert "+10.0%" in lines[0]
+    assert "-25.0%" in lines[0]
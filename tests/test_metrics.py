@@ -0,0 +1,171 @@
+# coding:utf8
+import re
+
+from gunicorn.six.moves import http_client
+
+from gunicorn_thrift.metrics import MAX_METHODS, OTHER, SLOT_PID
+from gunicorn_thrift.metrics import SharedMetrics, escape
+from server import free_port, wait_for
+
+
+def samples(text):
+    """{(name, labels): value} of a Prometheus text exposition."""
+    result = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        match = re.match(r"^(\w+)(?:\{(.*)\})? (\S+)$", line)
+        assert match, line
+        result[match.group(1), match.group(2) or ""] = float(match.group(3))
+    return result
+
+
+def test_slots_summed():
+    metrics = SharedMetrics(2)
+    first = metrics.attach(0, ["ping"])
+    second = metrics.attach(1, ["ping"])
+    for stats in (first, second, second):
+        stats.start("ping")
+        stats.finish("ping", "OK", 0.002)
+    second.start("ping")
+    snapshot = metrics.snapshot()
+    assert snapshot["workers"] == 2
+    assert snapshot["in_flight"] == 1
+    ping = snapshot["methods"]["ping"]
+    assert ping["statuses"]["OK"]["count"] == 3
+    assert ping["in_flight"] == 1
+    assert ping["errors"] == 0
+
+
+def test_unknown_names_share_other():
+    metrics = SharedMetrics(1)
+    stats = metrics.attach(0, ["ping"])
+    for name in ("nope", "other"):
+        stats.start(name)
+        stats.finish(name, "FUNC_NOT_FOUND", 0)
+    methods = metrics.snapshot()["methods"]
+    assert sorted(methods) == [OTHER]
+    assert methods[OTHER]["errors"] == 2
+    assert metrics.slots[0].names == []
+
+
+def test_rows_on_first_use():
+    metrics = SharedMetrics(1)
+    stats = metrics.attach(0, ["a", "b", "c"])
+    stats.start("c")
+    stats.finish("c", "OK", 0)
+    assert metrics.slots[0].names == ["c"]
+
+
+def test_full_slot_counts_under_other():
+    names = ["m%d" % i for i in range(MAX_METHODS + 1)]
+    metrics = SharedMetrics(1)
+    stats = metrics.attach(0, names)
+    for name in names:
+        stats.start(name)
+        stats.finish(name, "OK", 0)
+    methods = metrics.snapshot()["methods"]
+    assert len(metrics.slots[0].names) == MAX_METHODS
+    assert methods[OTHER]["statuses"]["OK"]["count"] == 1
+
+
+def test_new_worker_keeps_slot_totals():
+    metrics = SharedMetrics(1)
+    stats = metrics.attach(0, ["ping"])
+    stats.start("ping")
+    stats.finish("ping", "OK", 0)
+    # a worker died with a call in flight
+    stats.start("ping")
+    stats = metrics.attach(0, ["ping"])
+    stats.start("ping")
+    stats.finish("ping", "OK", 0)
+    ping = metrics.snapshot()["methods"]["ping"]
+    assert ping["statuses"]["OK"]["count"] == 2
+    assert ping["in_flight"] == 0
+
+
+def test_dead_workers_not_counted():
+    metrics = SharedMetrics(2)
+    metrics.attach(0, ["ping"]).start("ping")
+    stats = metrics.attach(1, ["ping"])
+    stats.start("ping")
+    stats.finish("ping", "OK", 0)
+    # no process has pid 2 ** 22 + 1, the pid_max of linux is 2 ** 22
+    metrics.slots[1].ints[SLOT_PID] = 2 ** 22 + 1
+    snapshot = metrics.snapshot()
+    assert snapshot["workers"] == 1
+    assert snapshot["methods"]["ping"]["in_flight"] == 1
+    assert snapshot["methods"]["ping"]["statuses"]["OK"]["count"] == 1
+
+
+def test_assign_slot():
+    class Worker(object):
+        def __init__(self, slot):
+            self.thrift_metrics_slot = slot
+
+    metrics = SharedMetrics(2)
+    assert metrics.assign_slot([]) == 0
+    assert metrics.assign_slot([Worker(0)]) == 1
+    assert metrics.assign_slot([Worker(1), Worker(0)]) is None
+
+
+def test_prometheus_histogram():
+    metrics = SharedMetrics(1)
+    stats = metrics.attach(0, ["ping"])
+    for duration in (0.0001, 0.003, 0.003, 0.2, 20):
+        stats.start("ping")
+        stats.finish("ping", "OK", duration)
+    stats.start("ping")
+    stats.finish("ping", "TIMEOUT", 1.5)
+    values = samples(metrics.prometheus())
+    labels = 'method="ping",status="OK"'
+    bucket = "thrift_request_duration_seconds_bucket"
+    assert values[bucket, labels + ',le="0.0005"'] == 1
+    assert values[bucket, labels + ',le="0.005"'] == 3
+    assert values[bucket, labels + ',le="0.25"'] == 4
+    assert values[bucket, labels + ',le="10.0"'] == 4
+    assert values[bucket, labels + ',le="+Inf"'] == 5
+    assert values["thrift_request_duration_seconds_count", labels] == 5
+    assert abs(values["thrift_request_duration_seconds_sum", labels] -
+               20.2061) < 1e-6
+    assert values["thrift_request_duration_seconds_count",
+                  'method="ping",status="TIMEOUT"'] == 1
+    assert values["thrift_requests_in_flight", 'method="ping"'] == 0
+    assert values["thrift_workers", ""] == 1
+
+
+def test_escape():
+    assert escape('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_metrics_of_all_workers(server):
+    port = free_port()
+    s = server("--thrift-metrics-bind", "127.0.0.1:%d" % port, workers=2)
+
+    def scrape():
+        conn = http_client.HTTPConnection("127.0.0.1", port, timeout=5)
+        try:
+            conn.request("GET", "/metrics")
+            response = conn.getresponse()
+            assert response.status == 200
+            return samples(response.read().decode("utf-8"))
+        finally:
+            conn.close()
+
+    def accepted(values):
+        return sum(value for (name, labels), value in values.items()
+                   if name == "thrift_connections_accepted_total")
+
+    assert wait_for(lambda: scrape()["thrift_workers", ""] == 2)
+    # the probe of the server start was accepted already
+    before = accepted(scrape())
+    clients = [s.client() for _ in range(6)]
+    for client in clients:
+        client.call(u"hi")
+    for client in clients:
+        client.close()
+    count = ("thrift_request_duration_seconds_count",
+             'method="send_ping",status="OK"')
+    values = wait_for(lambda: scrape().get(count) == 6 and scrape())
+    assert values
+    assert accepted(values) - before == 6
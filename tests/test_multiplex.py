@@ -0,0 +1,56 @@
+# coding:utf8
+from thrift.Thrift import TApplicationException, TMessageType
+
+from ping import Ping
+
+from gunicorn_thrift.app.thriftapp import ThriftApplication
+from gunicorn_thrift.workers.base import ThriftWorkerMixin
+
+import app
+
+
+def test_load_app():
+    assert ThriftApplication.load_app("app:processor") is app.processor
+
+
+def test_load_app_factory_keywords():
+    processor = ThriftApplication.load_app(
+        "app:make_processor(prefix=u'x')")
+    assert isinstance(processor, Ping.Processor)
+    assert processor._handler.prefix == u"x"
+    # a comma in the arguments does not make it multiplexed either
+    processor = ThriftApplication.load_app(
+        "app:make_processor(prefix=u'a,b=c:d')")
+    assert processor._handler.prefix == u"a,b=c:d"
+
+
+def test_load_multiplexed_app():
+    services = ThriftApplication.load_app(
+        "Ping=app:processor, Echo=app:make_processor(prefix=u'e')")
+    assert sorted(services) == ["Echo", "Ping"]
+    assert services["Ping"] is app.processor
+    assert services["Echo"]._handler.prefix == u"e"
+
+
+def test_multiplexed_dispatch():
+    mixin = ThriftWorkerMixin()
+    dispatch = mixin.build_dispatch({"Ping": app.processor,
+                                     "Echo": app.make_processor(u"e")})
+    assert sorted(dispatch) == ["Echo:send_ping", "Ping:send_ping"]
+
+
+def test_multiplexed_calls(server):
+    s = server(app="Ping=app:processor,Echo=app:make_processor(u'e:')")
+    client = s.client()
+    # replies carry the bare method name, as with TMultiplexedProcessor
+    assert client.call(u"hi", 1, "Ping:send_ping") == \
+        ("send_ping", TMessageType.REPLY, 1, u"hi")
+    assert client.call(u"hi", 2, "Echo:send_ping")[3] == u"e:hi"
+    name, type, seqid, x = client.call(u"hi", 3, "send_ping")
+    assert type == TMessageType.EXCEPTION
+    assert x.type == TApplicationException.UNKNOWN_METHOD
+
+
+def test_factory_keywords_served(server):
+    client = server(app="app:make_processor(prefix=u'k:')").client()
+    assert client.call(u"hi")[3] == u"k:hi"
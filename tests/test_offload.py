@@ -0,0 +1,114 @@
+# coding:utf8
+import os
+import time
+
+import pytest
+
+from thrift.Thrift import TMessageType
+from thrift.transport.TTransport import TMemoryBuffer
+
+from ping import Ping
+
+from gunicorn_thrift.thrift.protocol import TBinaryProtocolFactoryExt
+from gunicorn_thrift.workers.offload import OffloadError, ProcessOffloadPool
+
+from server import wait_for
+
+PFACTORY = TBinaryProtocolFactoryExt()
+APP = "Ping=app:processor,Echo=app:processor"
+
+
+def encode_args(msg):
+    otrans = TMemoryBuffer()
+    Ping.send_ping_args(msg=msg).write(PFACTORY.getProtocol(otrans))
+    return otrans.getvalue()
+
+
+def decode_reply(data):
+    iprot = PFACTORY.getProtocol(TMemoryBuffer(data))
+    header = iprot.readMessageBegin()
+    result = Ping.send_ping_result()
+    result.read(iprot)
+    return header, result.success
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+@pytest.fixture
+def pool():
+    pool = ProcessOffloadPool("app:processor", PFACTORY, 1)
+    yield pool
+    pool.close()
+
+
+def test_call(pool):
+    data = pool.call("send_ping", 7, encode_args(u"hi"))
+    assert decode_reply(data) == (("send_ping", TMessageType.REPLY, 7),
+                                  u"hi")
+    pid = int(decode_reply(pool.call("send_ping", 8,
+                                     encode_args(u"pid")))[1])
+    assert pid != os.getpid()
+    assert pid in [child.pid for child in pool.running]
+
+
+def test_failing_call_keeps_child(pool):
+    child, = pool.running
+    with pytest.raises(OffloadError) as info:
+        pool.call("send_ping", 1, encode_args(u"fail"))
+    assert "ValueError" in str(info.value)
+    assert pool.running == set([child])
+    assert decode_reply(pool.call("send_ping", 2,
+                                  encode_args(u"hi")))[1] == u"hi"
+
+
+def test_dead_child_replaced(pool):
+    child, = pool.running
+    child.kill()
+    child.wait()
+    with pytest.raises(OffloadError):
+        pool.call("send_ping", 1, encode_args(u"hi"))
+    assert child not in pool.running
+    assert len(pool.running) == 1
+    assert decode_reply(pool.call("send_ping", 2,
+                                  encode_args(u"hi")))[1] == u"hi"
+
+
+def test_close_kills_children():
+    pool = ProcessOffloadPool("app:processor", PFACTORY, 2)
+    children = list(pool.running)
+    pool.close()
+    assert not pool.running
+    assert all(child.returncode is not None for child in children)
+    # a call failing after close does not start a new child
+    with pytest.raises(OffloadError):
+        pool.call("send_ping", 1, encode_args(u"hi"))
+    assert not pool.running
+
+
+def test_offloaded_calls_in_children(server):
+    s = server("--thrift-offload-methods", "Ping:send_ping",
+               "--thrift-offload-workers", "2", app=APP)
+    client = s.client()
+    worker_pid = int(client.call(u"pid", 1, "Echo:send_ping")[3])
+    pids = set(int(client.call(u"pid", seqid, "Ping:send_ping")[3])
+               for seqid in range(2, 10))
+    assert worker_pid not in pids
+    assert all(alive(pid) for pid in pids)
+
+    # a busy child leaves the worker serving other calls
+    busy = s.client()
+    busy.send(u"spin:0.6", 1, "Ping:send_ping")
+    time.sleep(0.1)
+    start = time.time()
+    assert client.call(u"hi", 11, "Echo:send_ping")[3] == u"hi"
+    assert time.time() - start < 0.3
+    assert busy.receive()[3] == u"spin:0.6"
+
+    s.stop()
+    assert wait_for(lambda: not any(alive(pid) for pid in pids), 5)
@@ -0,0 +1,56 @@
+# coding:utf8
+import time
+
+from thrift.Thrift import TMessageType
+
+PIPELINE = ("--thrift-transport-factory", "framed", "--thrift-pipeline", "4")
+
+
+def test_replies_out_of_order(server):
+    client = server(*PIPELINE).client(framed=True)
+    client.send(u"sleep:0.3", 1)
+    client.send(u"fast", 2)
+    assert client.receive() == ("send_ping", TMessageType.REPLY, 2, u"fast")
+    assert client.receive() == \
+        ("send_ping", TMessageType.REPLY, 1, u"sleep:0.3")
+
+
+def test_pipelined_calls_run_concurrently(server):
+    client = server(*PIPELINE).client(framed=True)
+    start = time.time()
+    for seqid in range(1, 5):
+        client.send(u"sleep:0.3", seqid)
+    seqids = set(client.receive()[2] for _ in range(4))
+    assert seqids == set([1, 2, 3, 4])
+    assert time.time() - start < 1.0
+
+
+def test_pipeline_depth_bounds_concurrency(server):
+    client = server("--thrift-transport-factory", "framed",
+                    "--thrift-pipeline", "2").client(framed=True)
+    start = time.time()
+    for seqid in range(1, 5):
+        client.send(u"sleep:0.3", seqid)
+    for _ in range(4):
+        client.receive()
+    # two rounds of two
+    assert 0.6 <= time.time() - start < 1.2
+
+
+def test_without_pipeline_in_order(server):
+    client = server("--thrift-transport-factory", "framed").client(
+        framed=True)
+    client.send(u"sleep:0.2", 1)
+    client.send(u"fast", 2)
+    assert client.receive()[2] == 1
+    assert client.receive()[2] == 2
+
+
+def test_pipelined_errors_keep_connection(server):
+    client = server(*PIPELINE).client(framed=True)
+    client.send(u"fast", 1, name="no_such_method")
+    client.send(u"after", 2)
+    replies = sorted((client.receive() for _ in range(2)),
+                     key=lambda reply: reply[2])
+    assert replies[0][1] == TMessageType.EXCEPTION
+    assert replies[1] == ("send_ping", TMessageType.REPLY, 2, u"after")
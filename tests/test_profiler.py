@@ -0,0 +1,111 @@
+# coding:utf8
+import marshal
+import pstats
+import threading
+import time
+
+import gevent
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.transport.TTransport import TMemoryBuffer
+
+from gunicorn_thrift.profiler import PROFILE_METHOD, SamplingProfiler
+from gunicorn_thrift.profiler import write_profile_args
+from gunicorn_thrift.stats import call_admin, fetch_stats
+from gunicorn_thrift.workers.gthriftgevent import ThriftGeventWorker
+from server import free_port
+
+
+def spin(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def call(name, seconds):
+    # the frame the profiler takes the method name from
+    spin(seconds)
+
+
+def profile(tmpdir, format="collapsed"):
+    profiler = SamplingProfiler(str(tmpdir), 1000, format,
+                                call.__code__)
+    assert profiler.start(0.2)
+    assert not profiler.start(0.2)
+    call("ping", 0.1)
+    spin(0.15)
+    assert profiler.poll()
+    assert not profiler.running
+    return profiler
+
+
+def test_collapsed(tmpdir):
+    profiler = profile(tmpdir)
+    summary = profiler.summary()
+    assert summary["samples"] > 0
+    assert summary["error"] is None
+    with open(summary["path"]) as f:
+        lines = f.read().splitlines()
+    methods = set(line.split(";", 1)[0] for line in lines)
+    assert "ping" in methods
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == \
+        summary["samples"]
+
+
+def test_pstats(tmpdir):
+    path = profile(tmpdir, "pstats").summary()["path"]
+    with open(path, "rb") as f:
+        assert marshal.load(f)
+    stats = pstats.Stats(path)
+    assert any(func[2] == "<call ping>" for func in stats.stats)
+
+
+def test_idle_profile_not_written(tmpdir):
+    profiler = SamplingProfiler(str(tmpdir), 100)
+    profiler.start(0.05)
+    time.sleep(0.1)
+    assert profiler.poll()
+    assert profiler.summary()["path"] is None
+
+
+class Config(object):
+    thrift_profile_seconds = 60
+
+
+def test_cut_short_call_stops_profiler(tmpdir):
+    worker = ThriftGeventWorker.__new__(ThriftGeventWorker)
+    worker.cfg = Config()
+    worker.profiler = SamplingProfiler(str(tmpdir), 100)
+    args = TMemoryBuffer()
+    write_profile_args(TBinaryProtocol(args), 0)
+    iprot = TBinaryProtocol(TMemoryBuffer(args.getvalue()))
+    greenlet = gevent.spawn(worker.process_profile, 1, iprot, None)
+    gevent.sleep(0.05)
+    assert worker.profiler.running
+    greenlet.kill()
+    assert not worker.profiler.running
+
+
+def profile_call(port, seconds):
+    return call_admin("127.0.0.1", port, PROFILE_METHOD,
+                      lambda oprot: write_profile_args(oprot, seconds),
+                      timeout=10)
+
+
+def test_profile_endpoint(server):
+    # a profile longer than the timeout of the calls
+    s = server("--thrift-stats-endpoint", "--timeout", "1",
+               "--thrift-metrics-bind", "127.0.0.1:%d" % free_port())
+    summaries = []
+    thread = threading.Thread(
+        target=lambda: summaries.append(profile_call(s.port, 1.5)))
+    thread.start()
+    time.sleep(0.1)
+    s.client().call(u"spin:0.3")
+    thread.join()
+    summary = summaries[0]
+    assert summary["samples"] > 0
+    with open(summary["path"]) as f:
+        assert any(line.startswith("send_ping;") for line in f)
+    # the profile call has a metrics row of its own
+    methods = fetch_stats("127.0.0.1", s.port, timeout=5)["methods"]
+    assert methods[PROFILE_METHOD]["statuses"]["OK"]["count"] == 1
@@ -0,0 +1,125 @@
+# coding:utf8
+import pytest
+
+from thrift.Thrift import TMessageType, TType
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.protocol.TCompactProtocol import TCompactProtocol
+from thrift.protocol.TProtocol import TProtocolException
+from thrift.transport.TTransport import TMemoryBuffer
+
+from ping.Ping import send_ping_args
+
+from gunicorn_thrift.thrift.protocol import SizeLimitExceeded
+from gunicorn_thrift.thrift.protocol import TBinaryProtocolFactoryExt
+from gunicorn_thrift.thrift.protocol import TCompactProtocolFactoryExt
+
+
+def encode(write, protocol=TBinaryProtocol):
+    otrans = TMemoryBuffer()
+    write(protocol(otrans))
+    return otrans.getvalue()
+
+
+def limited(data, string_limit=0, container_limit=0, message_limit=0,
+            factory=TBinaryProtocolFactoryExt):
+    pfactory = factory()
+    pfactory.set_limits(string_limit, container_limit, message_limit)
+    return pfactory.getProtocol(TMemoryBuffer(data))
+
+
+def test_negative_string_size():
+    iprot = limited(encode(lambda p: p.writeI32(-1)))
+    with pytest.raises(SizeLimitExceeded) as info:
+        iprot.readString()
+    assert info.value.type == TProtocolException.NEGATIVE_SIZE
+
+
+def test_negative_list_size():
+    iprot = limited(encode(lambda p: (p.writeByte(TType.I32),
+                                      p.writeI32(-5))))
+    with pytest.raises(SizeLimitExceeded) as info:
+        iprot.readListBegin()
+    assert info.value.type == TProtocolException.NEGATIVE_SIZE
+
+
+def test_string_limit():
+    data = encode(lambda p: p.writeString(b"x" * 10))
+    assert limited(data, string_limit=10).readString() == u"x" * 10
+    with pytest.raises(SizeLimitExceeded) as info:
+        limited(data, string_limit=9).readString()
+    assert info.value.type == TProtocolException.SIZE_LIMIT
+
+
+def test_compact_string_limit():
+    def write(p):
+        p.writeMessageBegin("send_ping", TMessageType.CALL, 1)
+        send_ping_args(msg=b"x" * 10).write(p)
+        p.writeMessageEnd()
+    data = encode(write, TCompactProtocol)
+    iprot = limited(data, string_limit=10,
+                    factory=TCompactProtocolFactoryExt)
+    iprot.readMessageBegin()
+    args = send_ping_args()
+    args.read(iprot)
+    assert args.msg == b"x" * 10
+    iprot = limited(data, string_limit=9, factory=TCompactProtocolFactoryExt)
+    iprot.readMessageBegin()
+    with pytest.raises(SizeLimitExceeded):
+        send_ping_args().read(iprot)
+
+
+@pytest.mark.parametrize("write,read", [
+    (lambda p: p.writeListBegin(TType.I32, 5), "readListBegin"),
+    (lambda p: p.writeSetBegin(TType.I32, 5), "readSetBegin"),
+    (lambda p: p.writeMapBegin(TType.I32, TType.I32, 5), "readMapBegin"),
+])
+def test_container_limit(write, read):
+    data = encode(write)
+    getattr(limited(data, container_limit=5), read)()
+    with pytest.raises(SizeLimitExceeded):
+        getattr(limited(data, container_limit=4), read)()
+
+
+def test_map_costs_two_per_entry():
+    data = encode(lambda p: p.writeMapBegin(TType.I32, TType.I32, 6))
+    limited(data, message_limit=12).readMapBegin()
+    with pytest.raises(SizeLimitExceeded):
+        limited(data, message_limit=11).readMapBegin()
+    # a list of as many elements fits
+    data = encode(lambda p: p.writeListBegin(TType.I32, 6))
+    limited(data, message_limit=11).readListBegin()
+
+
+def test_message_budget_adds_up():
+    data = encode(lambda p: (p.writeString(b"x" * 6),
+                             p.writeString(b"y" * 6)))
+    iprot = limited(data, message_limit=11)
+    iprot.readString()
+    with pytest.raises(SizeLimitExceeded):
+        iprot.readString()
+
+
+def test_message_budget_resets_per_message():
+    def write(p):
+        for seqid in (1, 2):
+            p.writeMessageBegin("m", 1, seqid)
+            p.writeString(b"x" * 8)
+    iprot = limited(encode(write), message_limit=10)
+    for seqid in (1, 2):
+        assert iprot.readMessageBegin()[2] == seqid
+        iprot.readString()
+
+
+def test_skip_string_only_message_limit():
+    data = encode(lambda p: (p.writeString(b"x" * 20), p.writeI32(7)))
+    # skipped strings are not allocated, string_limit does not apply
+    iprot = limited(data, string_limit=10)
+    iprot.skip(TType.STRING)
+    assert iprot.readI32() == 7
+    with pytest.raises(SizeLimitExceeded):
+        limited(data, message_limit=10).skip(TType.STRING)
+
+
+def test_no_limits():
+    data = encode(lambda p: p.writeString(b"x" * 100000))
+    assert len(limited(data).readString()) == 100000
@@ -0,0 +1,38 @@
+# coding:utf8
+from gunicorn_thrift.stats import fetch_stats
+from server import free_port, wait_for
+
+
+def accepted(s):
+    """connections accepted by the workers of s, by listener."""
+    return fetch_stats("127.0.0.1", s.port, timeout=5)["connections"][
+        "accepted"]
+
+
+def start(server, *args):
+    # with shared metrics the stats method answers for all the workers
+    args = ("--thrift-metrics-bind", "127.0.0.1:%d" % free_port(),
+            "--thrift-stats-endpoint") + args
+    s = server(*args, workers=2)
+    assert wait_for(lambda: fetch_stats(
+        "127.0.0.1", s.port, timeout=5)["workers"] == 2)
+    return s
+
+
+def test_reuseport_listeners(server):
+    s = start(server, "--thrift-reuse-port")
+    for i in range(30):
+        client = s.client()
+        assert client.call(u"%d" % i)[3] == u"%d" % i
+        client.close()
+    counts = accepted(s)
+    assert counts["reuseport"] > 0
+    assert counts["shared"] + counts["reuseport"] > 30
+    assert "SO_REUSEPORT" not in s.errors()
+
+
+def test_shared_listeners_by_default(server):
+    s = start(server)
+    for i in range(5):
+        s.client().call(u"hi")
+    assert accepted(s)["reuseport"] == 0
@@ -0,0 +1,104 @@
+# coding:utf8
+import pytest
+
+from gunicorn_thrift.workers.slowlog import PHASES, PhaseClock
+from server import wait_for
+
+
+class Protocol(object):
+
+    def __init__(self):
+        self.trans = self
+
+    def readMessageEnd(self):
+        pass
+
+    def writeMessageBegin(self, *args):
+        pass
+
+    def flush(self):
+        pass
+
+
+def clock_marks(**marks):
+    """a PhaseClock started at 10 with marks set."""
+    prot = Protocol()
+    clock = PhaseClock(prot, prot)
+    clock.start(10.0, 10.5)
+    clock.marks.update(marks)
+    return clock
+
+
+def test_phases():
+    clock = clock_marks(read=11.0, handler=13.0, encode=13.25)
+    assert clock.phases(14.0) == list(zip(
+        PHASES, [0.5, 0.5, 2.0, 0.25, 0.75]))
+
+
+def test_missing_marks_merged():
+    # a call failing in the handler writes no reply
+    clock = clock_marks()
+    assert clock.phases(12.0) == list(zip(PHASES, [0.5, 0, 1.5, 0, 0]))
+
+
+def test_first_call_marks():
+    prot = Protocol()
+    clock = PhaseClock(prot, prot)
+    clock.start(10.0)
+    prot.readMessageEnd()
+    read = clock.marks["read"]
+    prot.readMessageEnd()
+    assert clock.marks["read"] == read
+    prot.trans.flush()
+    assert sorted(clock.marks) == ["encode", "read"]
+
+
+def slow_lines(path):
+    assert wait_for(lambda: path.check() and path.read())
+    return path.read().splitlines()
+
+
+@pytest.fixture
+def slow(server, tmpdir):
+    """start(*args) a server logging calls over 0.1s, and its slow log."""
+    path = tmpdir.join("slow.log")
+
+    def start(*args):
+        s = server("--thrift-slow-log", str(path),
+                   "--thrift-slow-threshold", "0.1", *args)
+        return s, path
+    return start
+
+
+def test_slow_call_logged(slow):
+    s, path = slow()
+    client = s.client()
+    client.call(u"fast")
+    client.call(u"sleep:0.3")
+    lines = slow_lines(path)
+    fields = lines[0].split()
+    assert fields[0] == "127.0.0.1"
+    assert "send_ping" in fields
+    phases = dict(field.split("=") for field in fields if "=" in field)
+    assert sorted(phases) == sorted(PHASES)
+    assert float(phases["handler"]) >= 250
+    assert "stack at" in lines[1]
+    # the handler was sleeping at the threshold
+    assert any("send_ping" in line for line in lines[2:])
+    assert not any("fast" in line for line in lines)
+
+
+def test_blocked_hub_has_no_stack(slow):
+    s, path = slow()
+    s.client().call(u"spin:0.3")
+    lines = slow_lines(path)
+    assert "no stack" in lines[1]
+
+
+def test_pipelined_call_logged(slow):
+    s, path = slow("--thrift-transport-factory", "framed",
+                   "--thrift-pipeline", "2")
+    client = s.client(framed=True)
+    client.call(u"sleep:0.2")
+    lines = slow_lines(path)
+    assert "send_ping" in lines[0].split()
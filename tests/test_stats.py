@@ -0,0 +1,78 @@
+# coding:utf8
+import pytest
+from thrift.Thrift import TApplicationException
+
+from gunicorn_thrift.stats import BUCKETS, HALF_COUNT, MAX_VALUE, SUB_COUNT
+from gunicorn_thrift.stats import LatencyHistogram, bucket_index
+from gunicorn_thrift.stats import bucket_value, fetch_stats
+from server import wait_for
+
+
+def test_exact_below_sub_count():
+    for value in range(SUB_COUNT):
+        assert bucket_index(value) == value
+        assert bucket_value(value) == value
+
+
+@pytest.mark.parametrize("value", [
+    SUB_COUNT, SUB_COUNT + 1, 63, 64, 65, 1000, 12345, 999999,
+    1 << 20, (1 << 20) + 1, MAX_VALUE])
+def test_bucket_bounds(value):
+    index = bucket_index(value)
+    # the bucket holds value, and is narrower than 1 / HALF_COUNT of it
+    assert bucket_value(index - 1) < value <= bucket_value(index)
+    assert bucket_value(index) - bucket_value(index - 1) <= \
+        value // HALF_COUNT + 1
+
+
+def test_buckets_contiguous():
+    for index in range(1, BUCKETS):
+        assert bucket_value(index) > bucket_value(index - 1)
+        assert bucket_index(bucket_value(index)) == index
+        assert bucket_index(bucket_value(index - 1) + 1) == index
+    assert bucket_index(MAX_VALUE) == BUCKETS - 1
+
+
+def test_percentiles():
+    histogram = LatencyHistogram()
+    for value in range(1, 1001):
+        histogram.record(value)
+    assert histogram.count == 1000
+    assert histogram.max == 1000
+    for percent, value in ((50, 500), (99, 990), (99.9, 999)):
+        assert value <= histogram.percentile(percent) <= \
+            value + value // HALF_COUNT
+    assert histogram.percentile(100) == 1000
+
+
+def test_record_clamps():
+    histogram = LatencyHistogram()
+    histogram.record(-5)
+    histogram.record(MAX_VALUE * 2)
+    assert histogram.counts[0] == 1
+    assert histogram.counts[BUCKETS - 1] == 1
+    assert histogram.max == MAX_VALUE
+
+
+def test_stats_endpoint(server):
+    s = server("--thrift-stats-endpoint")
+    client = s.client()
+    for _ in range(2):
+        client.call(u"hi")
+    client.call(u"sleep:0.05")
+
+    def ok_count():
+        stats = fetch_stats("127.0.0.1", s.port, timeout=5)
+        statuses = stats["methods"].get("send_ping", {}).get("statuses", {})
+        return statuses.get("OK", {}).get("count") == 3 and stats
+    stats = wait_for(ok_count)
+    assert stats
+    ok = stats["methods"]["send_ping"]["statuses"]["OK"]
+    assert ok["max"] >= 50
+    assert stats["connections"]["active"] >= 1
+
+
+def test_stats_endpoint_off(server):
+    s = server()
+    with pytest.raises(TApplicationException):
+        fetch_stats("127.0.0.1", s.port, timeout=5)
@@ -0,0 +1,126 @@
+# coding:utf8
+import socket
+import threading
+
+import pytest
+
+from gunicorn_thrift.statsd import StatsdClient
+
+
+@pytest.fixture
+def statsd():
+    """a udp socket standing in for the statsd server."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(5)
+    yield sock
+    sock.close()
+
+
+def receive(sock):
+    """the datagrams received, until none comes for a moment."""
+    packets = [sock.recv(65536).decode("utf-8")]
+    sock.settimeout(0.2)
+    try:
+        while True:
+            packets.append(sock.recv(65536).decode("utf-8"))
+    except socket.timeout:
+        pass
+    return packets
+
+
+def client(sock, **kw):
+    # no flush on the interval during the test
+    return StatsdClient(*sock.getsockname(), interval=3600, **kw)
+
+
+def test_counters_summed(statsd):
+    c = client(statsd)
+    c.increment("a")
+    c.increment("a", 2)
+    c.increment("b")
+    c.flush()
+    assert sorted(receive(statsd)[0].split("\n")) == ["a:3|c", "b:1|c"]
+
+
+def test_flush_resets(statsd):
+    c = client(statsd)
+    c.increment("a")
+    c.flush()
+    receive(statsd)
+    c.flush()
+    c.increment("a")
+    c.flush()
+    assert receive(statsd) == ["a:1|c"]
+
+
+def test_timings_under_max_samples(statsd):
+    c = client(statsd, max_samples=10)
+    for value in (1, 2.5, 3):
+        c.timing("t", value)
+    c.flush()
+    assert receive(statsd)[0].split("\n") == ["t:1|ms", "t:2.5|ms", "t:3|ms"]
+
+
+def test_timings_sampled_with_rate(statsd):
+    c = client(statsd, max_samples=10)
+    for value in range(40):
+        c.timing("t", value)
+    c.flush()
+    lines = receive(statsd)[0].split("\n")
+    assert len(lines) == 10
+    assert all(line.endswith("|ms|@0.25") for line in lines)
+    assert all(0 <= int(line.split(":")[1].split("|")[0]) < 40
+               for line in lines)
+
+
+def test_datagrams_up_to_mtu(statsd):
+    c = client(statsd, mtu=100)
+    names = ["metric.%02d" % i for i in range(50)]
+    for name in names:
+        c.increment(name)
+    c.flush()
+    packets = receive(statsd)
+    assert len(packets) > 1
+    assert all(len(packet) <= 100 for packet in packets)
+    lines = [line for packet in packets for line in packet.split("\n")]
+    assert sorted(lines) == ["%s:1|c" % name for name in names]
+
+
+def test_concurrent_increments(statsd):
+    c = client(statsd)
+
+    def record():
+        for _ in range(1000):
+            c.increment("a")
+            c.timing("t", 1)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert c.counters == {"a": 8000}
+    assert c.timers["t"][0] == 8000
+
+
+def test_access_metrics_sent(server, statsd):
+    s = server("--thrift-statsd-host", "%s:%d" % statsd.getsockname(),
+               "--thrift-statsd-interval", "0.1")
+    client = s.client()
+    for _ in range(3):
+        client.call(u"hi")
+    # the worker drops the connection of a failed call
+    s.client().send(u"fail")
+    lines = []
+    while not any(".send_ping.500:" in line for line in lines):
+        lines.extend(statsd.recv(65536).decode("utf-8").split("\n"))
+    counts = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        if value.endswith("|c"):
+            counts[name] = counts.get(name, 0) + int(value[:-2])
+    assert [(name.split(".", 2)[2], count)
+            for name, count in sorted(counts.items())
+            if ".send_ping." in name] == \
+        [("send_ping.200", 3), ("send_ping.500", 1)]
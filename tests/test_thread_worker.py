@@ -0,0 +1,60 @@
+# coding:utf8
+import threading
+import time
+
+import pytest
+
+from thrift.transport.TTransport import TTransportException
+
+from server import THREAD_WORKER, wait_for
+
+
+def start(server, *args):
+    return server("--threads", "4", *args, worker_class=THREAD_WORKER)
+
+
+def test_calls_on_one_connection(server):
+    client = start(server).client()
+    for seqid in range(1, 20):
+        assert client.call(u"hi %d" % seqid, seqid)[2:] == \
+            (seqid, u"hi %d" % seqid)
+
+
+def test_blocking_calls_run_in_threads(server):
+    s = start(server)
+    clients = [s.client() for _ in range(4)]
+    start_time = time.time()
+    for client in clients:
+        client.send(u"sleep:0.3")
+    for client in clients:
+        assert client.receive()[3] == u"sleep:0.3"
+    assert time.time() - start_time < 0.9
+
+
+def test_many_connections_keep_alive(server):
+    s = start(server)
+    errors = []
+
+    def run(n):
+        try:
+            client = s.client()
+            for seqid in range(50):
+                assert client.call(u"%d.%d" % (n, seqid), seqid)[3] == \
+                    u"%d.%d" % (n, seqid)
+            client.close()
+        except Exception as ex:
+            errors.append(ex)
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(16)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert errors == []
+
+
+def test_call_over_timeout_dropped(server):
+    s = start(server, "--timeout", "1")
+    client = s.client()
+    with pytest.raises(TTransportException):
+        client.call(u"sleep:1.5")
+    assert wait_for(lambda: any(" 504 " in line for line in s.access()), 5)
+    # the worker still answers
+    assert s.client().call(u"hi")[3] == u"hi"
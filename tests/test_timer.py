@@ -0,0 +1,117 @@
+# coding:utf8
+import time
+
+import gevent
+import pytest
+from thrift.transport.TTransport import TTransportException
+
+from gunicorn_thrift.workers.timer import Deadline, TimerWheel
+from server import wait_for
+
+
+def run(wheel, seconds, sleep, expired=None):
+    """sleep in a greenlet with a deadline, return what was thrown."""
+    def work():
+        wheel.add(gevent.getcurrent(), seconds, expired)
+        try:
+            gevent.sleep(sleep)
+        except Deadline as ex:
+            return ex
+        finally:
+            wheel.cancel(gevent.getcurrent(), expired)
+    return gevent.spawn(work).get()
+
+
+def test_deadline_thrown():
+    wheel = TimerWheel(tick=0.005)
+    ex = run(wheel, 0.02, 1)
+    assert isinstance(ex, Deadline)
+    assert ex.seconds == 0.02
+
+
+def test_deadline_not_reached():
+    wheel = TimerWheel(tick=0.005)
+    assert run(wheel, 0.5, 0.01) is None
+    assert not wheel.deadlines
+
+
+def test_cancel():
+    wheel = TimerWheel(tick=0.005)
+
+    def work():
+        wheel.add(gevent.getcurrent(), 0.01)
+        wheel.cancel(gevent.getcurrent())
+        gevent.sleep(0.05)
+        return True
+    assert gevent.spawn(work).get()
+
+
+def test_add_replaces_deadline():
+    wheel = TimerWheel(tick=0.005)
+
+    def work():
+        wheel.add(gevent.getcurrent(), 0.01)
+        wheel.add(gevent.getcurrent(), 1)
+        gevent.sleep(0.05)
+        wheel.cancel(gevent.getcurrent())
+        return True
+    assert gevent.spawn(work).get()
+
+
+def test_expired_callback():
+    wheel = TimerWheel(tick=0.005)
+    calls = []
+    assert run(wheel, 0.01, 0.05,
+               lambda greenlet, seconds: calls.append(seconds)) is None
+    assert calls == [0.01]
+
+
+def test_deadline_and_callback_coexist():
+    wheel = TimerWheel(tick=0.005)
+    calls = []
+
+    def expired(greenlet, seconds):
+        calls.append(seconds)
+
+    def work():
+        wheel.add(gevent.getcurrent(), 0.01, expired)
+        wheel.add(gevent.getcurrent(), 0.03)
+        try:
+            gevent.sleep(1)
+        except Deadline as ex:
+            return ex
+    assert isinstance(gevent.spawn(work).get(), Deadline)
+    assert calls == [0.01]
+
+
+def test_ticks_only_while_pending():
+    wheel = TimerWheel(tick=0.005)
+    assert wheel.greenlet is None
+    run(wheel, 0.5, 0.01)
+    gevent.sleep(0.02)
+    assert wheel.greenlet is None
+    # and starts again for the next deadline
+    assert isinstance(run(wheel, 0.01, 1), Deadline)
+
+
+def test_dead_greenlet_not_fired():
+    wheel = TimerWheel(tick=0.005)
+    calls = []
+    greenlet = gevent.spawn(lambda: None)
+    greenlet.join()
+    wheel.add(greenlet, 0.01, lambda g, s: calls.append(s))
+    gevent.sleep(0.05)
+    assert calls == []
+    assert not wheel.deadlines
+
+
+def test_method_deadline(server):
+    s = server("--thrift-method-timeouts", "send_ping=0.2")
+    client = s.client()
+    start = time.time()
+    with pytest.raises(TTransportException):
+        client.call(u"sleep:2")
+    assert time.time() - start < 1
+    assert wait_for(lambda: any(" 504 " in line for line in s.access()), 5)
+    # other calls keep the timeout of the worker
+    assert s.client().call(u"hi")[3] == u"hi"
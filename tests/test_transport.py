@@ -0,0 +1,82 @@
+# coding:utf8
+import socket
+
+import pytest
+
+from thrift.transport.TTransport import TTransportException
+
+from gunicorn_thrift.thrift.protocol import SizeLimitExceeded
+from gunicorn_thrift.thrift.transport import TSocketTransportExt
+
+
+@pytest.fixture
+def pair():
+    client, server = socket.socketpair()
+    yield client, server
+    client.close()
+    server.close()
+
+
+def test_read_all_max_read(pair):
+    client, server = pair
+    trans = TSocketTransportExt(server)
+    trans.max_read = 100
+    client.sendall(b"a" * 100 + b"b" * 4)
+    with pytest.raises(SizeLimitExceeded) as info:
+        trans.readAll(101)
+    assert info.value.pending == 101
+    # nothing was read
+    assert trans.readAll(100) == b"a" * 100
+    assert trans.readAll(4) == b"bbbb"
+
+
+def test_read_all_unlimited(pair):
+    client, server = pair
+    trans = TSocketTransportExt(server, rbuf_size=16)
+    client.sendall(b"x" * 3 + b"y" * 1000)
+    assert trans.readAll(3) == b"xxx"
+    # more than the read buffer
+    assert trans.readAll(1000) == b"y" * 1000
+    assert not trans.pending()
+
+
+def test_read_all_end_of_file(pair):
+    client, server = pair
+    trans = TSocketTransportExt(server)
+    client.sendall(b"abc")
+    client.close()
+    with pytest.raises(TTransportException) as info:
+        trans.readAll(4)
+    assert info.value.type == TTransportException.END_OF_FILE
+
+
+def test_flush_joins_writes(pair):
+    client, server = pair
+    trans = TSocketTransportExt(server)
+    trans.write(b"ab")
+    trans.write(b"cd")
+    trans.flush()
+    assert client.recv(10) == b"abcd"
+
+
+def test_read_returns_buffered_bytes(pair):
+    client, server = pair
+    trans = TSocketTransportExt(server)
+    client.sendall(b"abcdef")
+    assert trans.read(2) == b"ab"
+    assert trans.pending()
+    assert trans.read(100) == b"cdef"
+    assert not trans.pending()
+
+
+def test_cstringio_refill(pair):
+    client, server = pair
+    trans = TSocketTransportExt(server, rbuf_size=4)
+    client.sendall(b"abcdefgh")
+    assert trans.read(1) == b"a"
+    # the rest of the read buffer
+    cbuf = trans.cstringio_buf
+    assert cbuf.read(10) == b"bcd"
+    # fastbinary asks for the rest of a partial read
+    cbuf = trans.cstringio_refill(b"cd", 6)
+    assert cbuf.read(6) == b"cdefgh"